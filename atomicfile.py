@@ -0,0 +1,56 @@
+import os, io, time, filecmp, hashlib
+
+BUFFER_SIZE = 64 * 1024
+
+class AtomicFile():
+	'''
+	A file that is written next to its destination under a temporary name, and only
+	moved into place if its contents differ from what is already there. Anything
+	watching the destination sees either the old or the new contents, and nothing
+	at all if they are the same.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+		self.temp_path = "%s.%d.tmp" % (path, os.getpid())
+		self.file = None
+		self.hash = hashlib.sha1()
+		self.changed = False
+		# time spent writing the file and putting it in place, even if others were written alongside it
+		self.seconds = 0.0
+
+	def __enter__(self):
+		start = time.perf_counter()
+		self.file = io.open(self.temp_path, 'wb', buffering=BUFFER_SIZE)
+		self.seconds += time.perf_counter() - start
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		start = time.perf_counter()
+		self.file.close()
+		if exc_type is None and not (os.path.isfile(self.path) and filecmp.cmp(self.temp_path, self.path, shallow=False)):
+			os.replace(self.temp_path, self.path)
+			self.changed = True
+		else:
+			os.remove(self.temp_path)
+		self.seconds += time.perf_counter() - start
+
+	def write(self, data):
+		start = time.perf_counter()
+		self.hash.update(data)
+		self.file.write(data)
+		self.seconds += time.perf_counter() - start
+
+class TemplateStream(AtomicFile):
+	''' A text file written piece by piece from templates, encoded as UTF-8 '''
+
+	def write(self, template, *values):
+		AtomicFile.write(self, (template % values).encode('utf-8'))
+
+def write_if_changed(path, data):
+	''' Writes bytes or a string to a file atomically. Returns whether the file changed. '''
+	if not isinstance(data, bytes):
+		data = data.encode('utf-8')
+	with AtomicFile(path) as f:
+		f.write(data)
+	return f.changed
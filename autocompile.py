@@ -0,0 +1,76 @@
+'''
+Recompiles highlighting schemes when they, or any of the files they were generated from
+(mixins and the bases of derived schemes), are saved. Only schemes that have already
+been compiled once are recompiled.
+'''
+
+import os
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from . import compile
+from . import registry
+from .resources import CACHE
+
+# How long to wait after the last save before recompiling, in milliseconds
+DEBOUNCE_MS = 500
+
+def normalise(path):
+	return os.path.normcase(os.path.abspath(path))
+
+def load_dependents(registry_path):
+	'''
+	Inverts the registry: maps every file a scheme depends on, and the scheme's own
+	source, to the sources of the schemes that have to be recompiled when it changes.
+	'''
+	dependents = {}
+	for entry in registry.read(os.path.dirname(registry_path)).values():
+		source = entry.get("source")
+		if not source:
+			continue
+		for path in [source] + entry.get("dependencies", []):
+			dependents.setdefault(normalise(path), set()).add(source)
+	return dependents
+
+def affected_schemes(path):
+	''' Returns the sources of the schemes affected by a change to path '''
+	registry_path = registry.registry_path(compile.SYNESTHESIA_OUTPUT_PATH)
+	if not os.path.isfile(registry_path):
+		return set()
+	return CACHE.get(registry_path, load_dependents).get(normalise(path), set())
+
+class SynesthesiaAutoCompileListener(sublime_plugin.EventListener):
+	def __init__(self):
+		# sources of the schemes waiting to be recompiled
+		self.pending = set()
+		# incremented on every relevant save, so that only the last one's timer fires
+		self.generation = 0
+
+	def on_post_save(self, view):
+		path = view.file_name()
+		if not path:
+			return
+		schemes = affected_schemes(path)
+		if not schemes:
+			return
+
+		self.pending.update(schemes)
+		self.generation += 1
+		generation = self.generation
+		window = view.window()
+		sublime.set_timeout(lambda: self.flush(generation, window), DEBOUNCE_MS)
+
+	def flush(self, generation, window):
+		if generation != self.generation:
+			# a later save restarted the wait
+			return
+		schemes, self.pending = self.pending, set()
+		view = window.active_view() if window else None
+		default_colours = compile.read_default_settings(view) if view else None
+		for path in sorted(schemes):
+			if os.path.isfile(path):
+				compile.compile_in_background(path, default_colours)
@@ -0,0 +1,218 @@
+'''
+Measures how compiling a highlighting scheme scales with keyword count, the mix of
+keyword types, include depth and deriving mode. Run from the directory containing
+the synesthesia package:
+
+	python -m synesthesia.benchmarks.bench_compile --json results.json
+
+Each case is compiled headlessly into a temporary directory. A case is run once to
+time it, once more with tracemalloc to find its peak memory, and once again without
+--force to time the no-op recompile.
+'''
+
+import os, sys, json, time, random, shutil, tempfile, argparse, plistlib, tracemalloc
+
+from .. import compile, includes, colourful, resources, instrument
+
+SIZES = [10, 100, 1000, 10000]
+FULL_SIZES = [10, 100, 1000, 10000, 50000, 200000]
+
+# name -> options for generate_scheme
+SCENARIOS = [
+	("literal-plain", dict(literal=1.0, styled=0.0)),
+	("regex-styled", dict(literal=0.0, styled=1.0)),
+	("mixed", dict(literal=0.5, styled=0.5)),
+	("mixed-collapsed", dict(literal=0.5, styled=0.5, collapse=True)),
+	("mixed-collapsed-syntax", dict(literal=0.5, styled=0.5, collapse=True, format="sublime-syntax")),
+	("mixed-includes", dict(literal=0.5, styled=0.5, include_depth=4)),
+	("mixed-deriving", dict(literal=0.5, styled=0.5, deriving=True)),
+]
+
+COLOURS = ["red", "plum", "orange", "#ff8800", "#44aaff", "auto"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+def random_word(rng):
+	return ''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 10)))
+
+def random_regex(rng):
+	return rng.choice([
+		"%s\\d+" % random_word(rng),
+		"(?:%s|%s)-[0-9]+" % (random_word(rng), random_word(rng)),
+		"\\[%s[^\\]]*\\]" % random_word(rng),
+		"%s\\.[a-z]+\\(\\)" % random_word(rng),
+	])
+
+def random_style(rng, styled):
+	if rng.random() >= styled:
+		return rng.choice(COLOURS)
+	return {
+		"colour": rng.choice(COLOURS),
+		"bold": rng.random() < 0.5,
+		"italics": rng.random() < 0.2,
+		"whole-word": rng.random() < 0.5,
+		"case-insensitive": rng.random() < 0.5,
+	}
+
+def generate_keywords(n, literal, styled, rng):
+	keywords = {}
+	while len(keywords) < n:
+		key = random_word(rng) if rng.random() < literal else random_regex(rng)
+		keywords[key] = random_style(rng, styled)
+	return keywords
+
+def write_json(path, data):
+	with open(path, 'w') as f:
+		json.dump(data, f)
+
+def write_deriving_bases(directory):
+	with open(os.path.join(directory, "BenchBase.tmLanguage"), 'wb') as f:
+		plistlib.dump({
+			"name": "BenchBase",
+			"scopeName": "text.benchbase",
+			"patterns": [{"include": "#main"}],
+			"repository": {"main": {"patterns": []}},
+			"uuid": "00000000-0000-0000-0000-000000000000",
+		}, f)
+	with open(os.path.join(directory, "BenchBase.tmTheme"), 'wb') as f:
+		plistlib.dump({
+			"name": "BenchBase",
+			"settings": [{"settings": {"background": "#000000", "foreground": "#ffffff"}}],
+		}, f)
+	write_json(os.path.join(directory, "BenchBase.sublime-settings"), {"extensions": ["bench"]})
+
+def generate_scheme(directory, name, n, literal=0.5, styled=0.5, include_depth=0, collapse=False, deriving=False, format="tmLanguage", seed=0):
+	'''
+	Writes a synthetic scheme with n keywords to directory, spreading them evenly
+	over the scheme and a chain of include_depth mixins. Returns the scheme's path.
+	'''
+	rng = random.Random(seed)
+	keywords = list(generate_keywords(n, literal, styled, rng).items())
+	share = len(keywords) // (include_depth + 1)
+
+	for depth in range(include_depth):
+		mixin = {"keywords": dict(keywords[share * (depth + 1):share * (depth + 2)] if depth + 1 < include_depth else keywords[share * (depth + 1):])}
+		if depth + 1 < include_depth:
+			mixin["include"] = ["%s_mixin%d" % (name, depth + 1)]
+		write_json(os.path.join(directory, "%s_mixin%d.json" % (name, depth)), mixin)
+
+	scheme = {"keywords": dict(keywords[:share] if include_depth else keywords), "collapse_keywords": collapse, "format": format}
+	if include_depth:
+		scheme["include"] = ["%s_mixin0" % name]
+	if deriving:
+		write_deriving_bases(directory)
+		scheme["deriving"] = {"tmLanguage": "BenchBase", "tmTheme": "BenchBase", "sublime-settings": "BenchBase", "tmLanguage_scope": "repository.main"}
+
+	path = os.path.join(directory, name + ".json")
+	write_json(path, scheme)
+	return path
+
+def reset_caches():
+	''' Makes every run start cold, as in a fresh editor session '''
+	includes.INDEX = includes.IncludeIndex()
+	colourful.memo.clear()
+	resources.CACHE.entries.clear()
+
+def output_size(out, name, format):
+	return sum(os.path.getsize(os.path.join(out, "%s.%s" % (name, ext))) for ext in compile.OUTPUT_FORMATS[format])
+
+def run_case(scenario, options, n, seed):
+	workspace = tempfile.mkdtemp(prefix="synesthesia-bench-")
+	try:
+		out = os.path.join(workspace, "out")
+		compile.configure_headless(out)
+		name = "bench_%s_%d" % (scenario.replace("-", "_"), n)
+		path = generate_scheme(workspace, name, n, seed=seed, **options)
+
+		reset_caches()
+		start = time.perf_counter()
+		compiled = compile.compile_scheme(path, force=True)
+		total = time.perf_counter() - start
+		report = instrument.last_report()
+
+		reset_caches()
+		tracemalloc.start()
+		compile.compile_scheme(path, force=True)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+
+		start = time.perf_counter()
+		compile.compile_scheme(path)
+		noop = time.perf_counter() - start
+
+		return {
+			"scenario": scenario,
+			"keywords": n,
+			"options": options,
+			"ok": compiled is not None,
+			"total_s": total,
+			"stages_s": report.stages,
+			"counters": report.counters,
+			"noop_recompile_s": noop,
+			"peak_memory_bytes": peak,
+			"output_bytes": output_size(out, name, options.get("format", "tmLanguage")) if compiled else 0,
+		}
+	finally:
+		shutil.rmtree(workspace, ignore_errors=True)
+
+def find_regressions(results, baseline, tolerance):
+	''' Returns descriptions of cases that got slower or bigger than the baseline by more than tolerance '''
+	previous = dict(((r["scenario"], r["keywords"]), r) for r in baseline["results"])
+	regressions = []
+	for result in results:
+		before = previous.get((result["scenario"], result["keywords"]))
+		if before is None:
+			continue
+		for metric in ["total_s", "peak_memory_bytes", "output_bytes"]:
+			if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+				regressions.append("%s/%d: %s went from %s to %s" % (result["scenario"], result["keywords"], metric, before[metric], result[metric]))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.benchmarks.bench_compile", description="Benchmark compiling synthetic highlighting schemes.")
+	parser.add_argument("--sizes", help="comma-separated keyword counts (default: %s)" % ','.join(map(str, SIZES)))
+	parser.add_argument("--full", action="store_true", help="also run the largest sizes, up to 200k keywords")
+	parser.add_argument("--scenarios", help="comma-separated scenarios to run (default: all of %s)" % ', '.join(s for s, _ in SCENARIOS))
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="file to write results to")
+	parser.add_argument("--baseline", help="results of an earlier run to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression against the baseline (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	sizes = [int(x) for x in args.sizes.split(',')] if args.sizes else (FULL_SIZES if args.full else SIZES)
+	wanted = args.scenarios.split(',') if args.scenarios else [s for s, _ in SCENARIOS]
+
+	# keep the compiler's own progress output out of the report
+	results = []
+	stdout = sys.stdout
+	for scenario, options in SCENARIOS:
+		if scenario not in wanted:
+			continue
+		for n in sizes:
+			sys.stdout = open(os.devnull, 'w')
+			try:
+				result = run_case(scenario, options, n, args.seed)
+			finally:
+				sys.stdout.close()
+				sys.stdout = stdout
+			results.append(result)
+			print("%-22s %7d keywords  %8.3fs  no-op %7.4fs  peak %8.1f MB  output %8.1f KB" % (scenario, n, result["total_s"], result["noop_recompile_s"], result["peak_memory_bytes"] / 1e6, result["output_bytes"] / 1e3))
+
+	report = {
+		"python": sys.version.split()[0],
+		"numpy": colourful.numpy is not None,
+		"results": results,
+	}
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent=4, sort_keys=True)
+
+	if args.baseline:
+		with open(args.baseline, 'r') as f:
+			regressions = find_regressions(results, json.load(f), args.tolerance)
+		for regression in regressions:
+			print("Regression: %s" % regression)
+		return 1 if regressions else 0
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -1,6 +1,21 @@
 
 import random, colorsys, hashlib
 
+try:
+	import numpy
+except ImportError:
+	# Sublime Text doesn't ship NumPy; everything works without it, just more slowly
+	numpy = None
+
+# Saturation and brightness ranges for bright and dark colours
+PRETTY = ((0.2, 1), (0.67, 1))
+UGLY = ((0, 0.2), (0, 0.67))
+
+# Colours already worked out for strings, so that keys shared by many schemes
+# (or compiled again and again) are only hashed once per session
+MEMO_LIMIT = 1 << 18
+memo = {}
+
 def rescale(n, lower, upper):
 	return (upper-lower)*n + lower
 
@@ -8,13 +23,7 @@ def string_to_rgb(s="#ffffff"):
 	return int(s[1:3], 16), int(s[3:5], 16), int(s[5:7], 16)
 
 def rgb_to_string(r=255, g=255, b=255):
-	r, g, b = hex(int(r))[2:], hex(int(g))[2:], hex(int(b))[2:]
-
-	r = '0' + r if len(r) < 2 else r
-	g = '0' + g if len(g) < 2 else g
-	b = '0' + b if len(b) < 2 else b
-
-	return '#' + r + g + b
+	return '#%02x%02x%02x' % (int(r), int(g), int(b))
 
 def random_pastel(tint="#ffffff"):
 	tint_r, tint_g, tint_b = string_to_rgb(tint)
@@ -25,39 +34,83 @@ def random_pastel(tint="#ffffff"):
 
 	return rgb_to_string(r, g, b)
 
-def prettify(r, g, b):
+def rescale_hsv(r, g, b, saturation, brightness):
 	h, s, v = colorsys.rgb_to_hsv(r/255, g/255, b/255)
 
+	s = rescale(s, *saturation)
+	v = rescale(v, *brightness)
+
+	r, g, b = colorsys.hsv_to_rgb(h, s, v)
+	r, g, b = r*255, g*255, b*255
+
+	return r, g, b
+
+def prettify(r, g, b):
 	# Rescale values into the following ranges:
 
 	# Hue: [0, 360]
 	# Saturation: [20, 100]
 	# Brightness: [67, 100]
 
-	s = rescale(s, 0.2, 1)
-	v = rescale(v, 0.67, 1)
-
-	r, g, b = colorsys.hsv_to_rgb(h, s, v)
-	r, g, b = r*255, g*255, b*255
-
-	return r, g, b
+	return rescale_hsv(r, g, b, *PRETTY)
 
 def uglify(r, g, b):
-	h, s, v = colorsys.rgb_to_hsv(r/255, g/255, b/255)
-
 	# Rescale values into the following ranges:
 
 	# Hue: [0, 360]
 	# Saturation: [0, 20]
 	# Brightness: [0, 67]
 
-	s = rescale(s, 0, 0.2)
-	v = rescale(v, 0, 0.67)
-
-	r, g, b = colorsys.hsv_to_rgb(h, s, v)
-	r, g, b = r*255, g*255, b*255
-
-	return r, g, b
+	return rescale_hsv(r, g, b, *UGLY)
+
+def rgb_to_hsv_array(rgb):
+	''' colorsys.rgb_to_hsv over an n x 3 array of values in [0, 1] '''
+	r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+	maxc = rgb.max(axis=1)
+	minc = rgb.min(axis=1)
+	rangec = maxc - minc
+	grey = rangec == 0
+	# avoid dividing by zero; grey entries are fixed up at the end
+	safe_rangec = numpy.where(grey, 1.0, rangec)
+	safe_maxc = numpy.where(maxc == 0, 1.0, maxc)
+
+	s = rangec / safe_maxc
+	rc = (maxc - r) / safe_rangec
+	gc = (maxc - g) / safe_rangec
+	bc = (maxc - b) / safe_rangec
+	h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+	h = (h / 6.0) % 1.0
+
+	return numpy.where(grey, 0.0, h), numpy.where(grey, 0.0, s), maxc
+
+def hsv_to_rgb_array(h, s, v):
+	''' colorsys.hsv_to_rgb over arrays, returning an n x 3 array '''
+	i = (h * 6.0).astype(int)
+	f = (h * 6.0) - i
+	p = v * (1.0 - s)
+	q = v * (1.0 - s * f)
+	t = v * (1.0 - s * (1.0 - f))
+	i = i % 6
+
+	cases = [i == 0, i == 1, i == 2, i == 3, i == 4, i == 5]
+	r = numpy.select(cases, [v, q, p, p, t, v])
+	g = numpy.select(cases, [t, v, v, q, p, p])
+	b = numpy.select(cases, [p, p, t, v, v, q])
+
+	grey = s == 0.0
+	return numpy.stack([numpy.where(grey, v, r), numpy.where(grey, v, g), numpy.where(grey, v, b)], axis=1)
+
+def rescale_rgbs(rgbs, saturation, brightness):
+	''' Applies rescale_hsv to a list of RGB triples, returning colour strings '''
+	if numpy is None or not rgbs:
+		return [rgb_to_string(*rescale_hsv(r, g, b, saturation, brightness)) for r, g, b in rgbs]
+
+	h, s, v = rgb_to_hsv_array(numpy.array(rgbs, dtype=float) / 255)
+	s = rescale(s, *saturation)
+	v = rescale(v, *brightness)
+	rgb = (hsv_to_rgb_array(h, s, v) * 255).astype(int)
+
+	return ['#%02x%02x%02x' % (r, g, b) for r, g, b in rgb.tolist()]
 
 def random_rgb():
 	r = random.randrange(0, 256)
@@ -68,38 +121,191 @@ def random_rgb():
 def random_colour():
 	return rgb_to_string(*random_rgb())
 
-def string_to_colour(s):
-	h = int(hashlib.sha1(s.encode('utf-8')).hexdigest(), 16)
+def string_to_rgb_hash(s):
+	# the lowest three bytes of the hash, i.e. the last three of the digest
+	digest = hashlib.sha1(s.encode('utf-8')).digest()
+	return digest[19], digest[18], digest[17]
 
-	r = h & 0xFF
-	g = (h >> 8) & 0xFF
-	b = (h >> 16) & 0xFF
+def strings_to_colours(strings, saturation, brightness):
+	key = (saturation, brightness)
+	result = [memo.get((s, key)) for s in strings]
+	missing = [i for i, c in enumerate(result) if c is None]
 
-	r, g, b = prettify(r, g, b)
+	if missing:
+		if len(memo) + len(missing) > MEMO_LIMIT:
+			memo.clear()
+		colours = rescale_rgbs([string_to_rgb_hash(strings[i]) for i in missing], saturation, brightness)
+		for i, c in zip(missing, colours):
+			result[i] = memo[(strings[i], key)] = c
 
-	return rgb_to_string(r, g, b)
+	return result
 
-def string_to_dark_colour(s):
-	h = int(hashlib.sha1(s.encode('utf-8')).hexdigest(), 16)
+def string_to_colours(strings):
+	''' string_to_colour for many strings at once '''
+	return strings_to_colours(list(strings), *PRETTY)
 
-	r = h & 0xFF
-	g = (h >> 8) & 0xFF
-	b = (h >> 16) & 0xFF
+def string_to_dark_colours(strings):
+	''' string_to_dark_colour for many strings at once '''
+	return strings_to_colours(list(strings), *UGLY)
 
-	r, g, b = uglify(r, g, b)
+def string_to_colour(s):
+	return string_to_colours([s])[0]
 
-	return rgb_to_string(r, g, b)
+def string_to_dark_colour(s):
+	return string_to_dark_colours([s])[0]
 
 GOLDEN_RATIO_CONJUGATE = 0.618033988749895
 
-def cyclic_colours(n, seed):
+def cyclic_hues(n, seed):
 	h, _, _ = colorsys.rgb_to_hsv(*(random_rgb() if not seed else string_to_rgb(seed)))
 
 	result = []
 	for i in range(0, n):
 		h = (h + GOLDEN_RATIO_CONJUGATE) % 1
-		r, g, b = colorsys.hsv_to_rgb(h, 0.5, 0.95)
-		r, g, b = r*255, g*255, b*255
-		result.append(rgb_to_string(r, g, b))
+		result.append(h)
 
 	return result
+
+def cyclic_colours(n, seed):
+	hues = cyclic_hues(n, seed)
+
+	if numpy is None or not hues:
+		result = []
+		for h in hues:
+			r, g, b = colorsys.hsv_to_rgb(h, 0.5, 0.95)
+			r, g, b = r*255, g*255, b*255
+			result.append(rgb_to_string(r, g, b))
+		return result
+
+	h = numpy.array(hues)
+	rgb = (hsv_to_rgb_array(h, numpy.full_like(h, 0.5), numpy.full_like(h, 0.95)) * 255).astype(int)
+	return ['#%02x%02x%02x' % (r, g, b) for r, g, b in rgb.tolist()]
+
+def srgb_to_linear(c):
+	c = c / 255
+	return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+def lab_f(t):
+	return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+def rgb_to_lab(r, g, b):
+	''' Converts sRGB in [0, 255] to CIELAB (D65), in which distance approximates perceived difference '''
+	r, g, b = srgb_to_linear(r), srgb_to_linear(g), srgb_to_linear(b)
+	x = (0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047
+	y = 0.2126729 * r + 0.7151522 * g + 0.0721750 * b
+	z = (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883
+	fx, fy, fz = lab_f(x), lab_f(y), lab_f(z)
+	return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+# Steps of a low-discrepancy sequence over three dimensions (the R3 sequence), so that
+# the alternatives tried for a colour spread evenly over hue, saturation and brightness
+R3 = (0.8191725133961645, 0.6710436067037893, 0.5497004779019703)
+
+# Alternatives tried for a colour that is too close to another, within each range
+CANDIDATES = 48
+
+# Hues of alternatives are rounded to this many steps, so that their conversions can be reused
+HUE_STEPS = 720
+
+# Saturation and brightness ranges alternatives are taken from, each tried once those
+# before it have no room left: those of auto colours first, then wider and wider ones
+RELAXED_RANGES = (PRETTY, ((0.1, 1), (0.5, 1)), ((0, 1), (0.25, 1)))
+
+# How much the separation is lowered by when there is no room left in any range
+RELAX_DISTANCE = 0.9
+
+# Separations smaller than this are given up on, since they can't be seen
+MIN_SEPARATION = 0.5
+
+class ColourSpace():
+	'''
+	Colours placed so far, indexed by a grid over CIELAB space whose cells are as wide as
+	the minimum separation. Only the 27 cells around a colour can hold colours closer than
+	that, so checking a colour costs the same however many have been placed.
+	'''
+
+	# offsets of a cell and its neighbours, the cell itself first
+	NEIGHBOURS = sorted(((i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)), key=lambda o: o != (0, 0, 0))
+
+	def __init__(self, min_distance):
+		self.min_distance = float(min_distance)
+		self.limit = self.min_distance ** 2
+		# cell -> [lab]
+		self.cells = {}
+
+	def relax(self, distance):
+		'''
+		Lowers the separation that crowded checks for. The grid is kept, since cells at
+		least as wide as the separation still hold every colour that could be too close.
+		'''
+		self.limit = distance ** 2
+
+	def cell(self, lab):
+		return (int(lab[0] // self.min_distance), int(lab[1] // self.min_distance), int(lab[2] // self.min_distance))
+
+	def add(self, lab):
+		self.cells.setdefault(self.cell(lab), []).append(lab)
+
+	def crowded(self, lab):
+		''' Whether a colour closer than the minimum separation has been placed '''
+		ci, cj, ck = self.cell(lab)
+		l, a, b = lab
+		for i, j, k in self.NEIGHBOURS:
+			for other in self.cells.get((ci + i, cj + j, ck + k), ()):
+				if (l - other[0]) ** 2 + (a - other[1]) ** 2 + (b - other[2]) ** 2 < self.limit:
+					return True
+		return False
+
+def alternative(hue_step, n, ranges=PRETTY):
+	''' The nth alternative to a colour whose hue is hue_step / HUE_STEPS, as whole RGB and its CIELAB '''
+	h = (hue_step / HUE_STEPS + n * R3[0]) % 1
+	s = rescale((n * R3[1]) % 1, *ranges[0])
+	v = rescale((n * R3[2]) % 1, *ranges[1])
+	rgb = tuple(int(x * 255) for x in colorsys.hsv_to_rgb(h, s, v))
+	return rgb, rgb_to_lab(*rgb)
+
+def distinct_colours(preferred, min_distance, avoid=()):
+	'''
+	Takes colour strings and returns colours as close to them as possible while being apart
+	(CIE76 delta E) from each other and from the colours in avoid. Colours that have to
+	move are moved within the saturation and brightness range of auto colours, or failing
+	that within RELAXED_RANGES. If there is no room left even there, the separation is
+	lowered for the remaining colours until there is.
+	Returns the colours and the separation every pair of them is kept, at most min_distance.
+	'''
+	space = ColourSpace(min_distance)
+	for c in avoid:
+		space.add(rgb_to_lab(*string_to_rgb(c)))
+
+	# (hue step, range, n) -> alternative
+	alternatives = {}
+	result = []
+	distance = float(min_distance)
+	for c in preferred:
+		rgb = string_to_rgb(c)
+		lab = rgb_to_lab(*rgb)
+		h, _, _ = colorsys.rgb_to_hsv(rgb[0] / 255, rgb[1] / 255, rgb[2] / 255)
+		hue_step = int(h * HUE_STEPS)
+		while space.crowded(lab):
+			found = None
+			for r, ranges in enumerate(RELAXED_RANGES):
+				for n in range(1, CANDIDATES + 1):
+					key = (hue_step, r, n)
+					if key not in alternatives:
+						alternatives[key] = alternative(hue_step, n, ranges)
+					if not space.crowded(alternatives[key][1]):
+						found = alternatives[key]
+						break
+				if found:
+					break
+			if found:
+				rgb, lab = found
+				break
+			distance *= RELAX_DISTANCE
+			if distance < MIN_SEPARATION:
+				distance = 0.0
+			space.relax(distance)
+		space.add(lab)
+		result.append(rgb_to_string(*rgb))
+
+	return result, distance
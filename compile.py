@@ -1,11 +1,50 @@
-import re, uuid, os.path, json, plistlib
-import sublime, sublime_plugin
+import re, os.path, csv, json, plistlib, hashlib, argparse
+from itertools import islice
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import sublime, sublime_plugin
+except ImportError:
+    # Compiling outside the editor
+    from . import headless as sublime
+    from . import headless as sublime_plugin
+
 from . import templates
 from . import colours
-from .colourful import string_to_colour, random_colour, string_to_dark_colour, cyclic_colours
+from .colourful import string_to_colour, random_colour, string_to_dark_colour, cyclic_colours, string_to_colours, string_to_dark_colours, distinct_colours
+from .trie import trie_regex
+from . import includes
+from .plistwriter import PlistStream, escape
+from .atomicfile import AtomicFile, TemplateStream
+from .resources import CACHE
+from . import regexcost
+from .prune import shadowed_keywords
+from . import dispatch
+from .jobs import QUEUE, Cancelled
+from . import instrument
+from . import registry
+from .sublimeformat import yaml_string, colour_scheme_globals, colour_scheme_rule, tmTheme_to_colour_scheme
 
 PATH_SEPARATOR = "\\" if sublime.platform() == "windows" else "/"
 
+# format -> extensions of the syntax, theme and settings files generated in it
+OUTPUT_FORMATS = {
+    "tmLanguage": ["tmLanguage", "tmTheme", "sublime-settings"],
+    "sublime-syntax": ["sublime-syntax", "sublime-color-scheme", "sublime-settings"],
+}
+OUTPUT_EXTENSIONS = OUTPUT_FORMATS["tmLanguage"]
+
+# Bump whenever the same input starts producing different output,
+# so that schemes compiled by an older version are rebuilt
+FINGERPRINT_VERSION = 8
+
+# Keywords read from a keywords_file at a time, so that their auto colours are worked out together
+KEYWORDS_FILE_BATCH = 10000
+
+# Keywords left out of a scheme that are listed individually
+PRUNE_REPORT_LIMIT = 20
+
 def plugin_loaded():
     global PACKAGES_PATH, SYNESTHESIA_INCLUDE_PATH, SYNESTHESIA_OUTPUT_PATH, SYNESTHESIA_OUTPUT_PATH_RELATIVE
     PACKAGES_PATH = sublime.packages_path()
@@ -13,10 +52,13 @@ def plugin_loaded():
     SYNESTHESIA_OUTPUT_PATH = os.path.join(sublime.packages_path(), "User")
     SYNESTHESIA_OUTPUT_PATH_RELATIVE = "Packages/User"
 
-def write_file(filepath, s):
-    f = open(filepath, 'w')
-    f.write(s)
-    f.close()
+def configure_headless(output_path, output_path_relative="Packages/User"):
+    ''' Sets up paths for compiling outside the editor, where plugin_loaded is never called '''
+    global SYNESTHESIA_INCLUDE_PATH, SYNESTHESIA_OUTPUT_PATH, SYNESTHESIA_OUTPUT_PATH_RELATIVE
+    plugin_loaded()
+    SYNESTHESIA_INCLUDE_PATH = "Packages/%s/include/" % sublime.PACKAGE_NAME
+    SYNESTHESIA_OUTPUT_PATH = os.path.abspath(output_path)
+    SYNESTHESIA_OUTPUT_PATH_RELATIVE = output_path_relative
 
 def read_file(filepath):
     f = open(filepath, 'r')
@@ -38,19 +80,70 @@ def ensure_directory_exists(path):
         print("%s does not exist; created" % path)
         os.makedirs(path)
 
+def read_plist(path):
+    if hasattr(plistlib, 'load'):
+        with open(path, 'rb') as f:
+            return plistlib.load(f)
+    return plistlib.readPlist(path)
+
+def plist_bytes(plist):
+    if hasattr(plistlib, 'dumps'):
+        return plistlib.dumps(plist)
+    return plistlib.writePlistToBytes(plist)
+
+def write_artifact(path, data):
+    ''' Writes bytes or a string to a generated file atomically, if it changed, and reports it '''
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    with AtomicFile(path) as f:
+        f.write(data)
+    report_written(path, f)
+
+def report_written(path, written):
+    ''' Reports a generated file, given the AtomicFile it was written with '''
+    changed = written.changed
+    instrument.artifact(path, changed, written.seconds)
+    if changed:
+        print("Written to %s." % path)
+    else:
+        print("%s is unchanged." % path)
+
 def read_default_settings(view):
-    colour_scheme_path = re.sub("Packages", sublime.packages_path(), view.settings().get('color_scheme'))
+    return read_colour_scheme_defaults(re.sub("Packages", sublime.packages_path(), view.settings().get('color_scheme')))
 
+def read_colour_scheme_defaults(colour_scheme_path):
     if (os.path.exists(colour_scheme_path)):
-        settings_block = re.compile(r"[ \t]+<dict>\s+<key>settings</key>[\s\w></#]+</dict>")
-        settings_text = read_file(colour_scheme_path)
-        match = settings_block.search(settings_text)
-        if match:
-            default_colours = match.group(0)
-            return default_colours
+        return CACHE.get(colour_scheme_path, load_default_colours)
 
     return None
 
+def load_default_colours(colour_scheme_path):
+    ''' Returns the global settings of a tmTheme, or None if it has none '''
+    try:
+        plist = read_plist(colour_scheme_path)
+    except Exception:
+        print("%s could not be parsed." % colour_scheme_path)
+        return None
+
+    # the global settings are the ones that don't apply to any particular scope
+    for element in plist.get('settings', []):
+        if 'scope' not in element and 'settings' in element:
+            settings = element['settings']
+            return dict((key, settings[key]) for key in settings if isinstance(settings[key], str))
+
+    return None
+
+def default_colours_element(settings):
+    return templates.default_colours_element % ''.join(templates.default_colour % (escape(key), escape(settings[key])) for key in sorted(settings))
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        # read in blocks, since keyword files can be large
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 def load_json_data(source, path=True):
     _, themename, ext = split_filepath(source)
 
@@ -67,14 +160,6 @@ def load_json_data(source, path=True):
 
     return themename, entries
 
-def get_include_contents():
-    ''' Returns the contents of the include directory, abstracting away differences between directory and .sublime_package format '''
-    include = re.compile(SYNESTHESIA_INCLUDE_PATH)
-    # Get json file names in include directory
-    files = [include.sub('', x) for x in sublime.find_resources('*.json') if include.search(x) is not None]
-    # Strip extension
-    return [x[:-5] for x in files]
-
 def colour(key, c, dark=False):
     c = c.lower()
     if dark and c == "auto":
@@ -87,6 +172,260 @@ def colour(key, c, dark=False):
         c = colours.name_to_hex[c]
     return c
 
+def post_process_regex(key, whole_word, case_insensitive):
+    regex = key
+    if whole_word or strip_non_alpha(key) == key:
+        # regex is completely alphabetical;
+        # automatically enforce word boundary
+        regex = "\\b%s\\b" % regex
+    if case_insensitive:
+        regex = "(?i:%s)" % regex
+    return regex
+
+def keyword_options(value):
+    '''
+    Reads a keyword's value, either a colour or a dict of options, into
+    (colour, background, fontstyle, whole_word, case_insensitive), with colours as given
+    and None for anything unset.
+    '''
+    if type(value) == str:
+        return value, None, None, False, False
+    if type(value) != dict:
+        return None, None, None, False, False
+    fontstyle = []
+    if "italics" in value and value["italics"]:
+        fontstyle.append("italic")
+    if "bold" in value and value["bold"]:
+        fontstyle.append("bold")
+    whole_word = "whole-word" in value and bool(value["whole-word"])
+    case_insensitive = "case-insensitive" in value and bool(value["case-insensitive"])
+    return value.get("colour"), value.get("background"), ' '.join(fontstyle) or None, whole_word, case_insensitive
+
+def keyword_regexes(keyword_map):
+    ''' Yields the regex each keyword is matched with '''
+    for key, value in keyword_map.items():
+        _, _, _, whole_word, case_insensitive = keyword_options(value)
+        yield post_process_regex(key, whole_word, case_insensitive)
+
+# Bits of KeywordTable.flags
+LITERAL, CASE_INSENSITIVE, WHOLE_WORD = 1, 2, 4
+
+class KeywordTable():
+    '''
+    The keywords of a scheme, read once and shared by every output format.
+
+    Keywords are stored column by column: their keys, a byte of flags each, and the index
+    of their style, a (foreground, background, fontstyle) triple with None for anything
+    unset. Styles are interned, since most keywords share one with many others. Regexes
+    and names are worked out again as the table is iterated, so a keyword takes a few
+    bytes beyond its key, which the keyword map holds anyway.
+    '''
+
+    def __init__(self):
+        self.keys = []
+        self.flags = bytearray()
+        self.style_ids = array('I')
+        self.styles = []
+        # style -> index in styles
+        self.style_index = {}
+
+    @classmethod
+    def build(cls, keyword_map):
+        table = cls()
+        for key, value in keyword_map.items():
+            table.add(key, value)
+        return table
+
+    def add(self, key, value):
+        foreground, background, fontstyle, whole_word, case_insensitive = keyword_options(value)
+        if foreground is not None:
+            foreground = colour(key, foreground)
+        if background is not None:
+            background = colour(key, background, True)
+        style = (foreground, background, fontstyle)
+        style_id = self.style_index.get(style)
+        if style_id is None:
+            style_id = self.style_index[style] = len(self.styles)
+            self.styles.append(style)
+
+        self.keys.append(key)
+        self.flags.append((is_literal(key, whole_word) and LITERAL) | (case_insensitive and CASE_INSENSITIVE) | (whole_word and WHOLE_WORD))
+        self.style_ids.append(style_id)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        '''
+        Yields a (key, regex, keyname, style, literal, case_insensitive) entry for each keyword,
+        named by its position so that the same scheme always gets the same names.
+        '''
+        for n, key in enumerate(self.keys):
+            flags = self.flags[n]
+            regex = post_process_regex(key, flags & WHOLE_WORD, flags & CASE_INSENSITIVE)
+            yield key, regex, "%s_%d" % (strip_non_alpha(key), n), self.styles[self.style_ids[n]], bool(flags & LITERAL), bool(flags & CASE_INSENSITIVE)
+
+    def entries(self, collapse=False):
+        ''' Returns (regex, keyname, style, merged) entries, with literals merged if collapse is set '''
+        if collapse:
+            return collapse_literal_keywords(self)
+        return ((regex, keyname, style, False) for _, regex, keyname, style, _, _ in self)
+
+def dispatched_patterns(entries, groups, text):
+    '''
+    Takes (regex, keyname, style, merged) entries and their grouping by dispatch.plan, and
+    yields (regex, keyname, captures) for each pattern to write, where text(entry) is what
+    to write for an entry's regex. A keyword written as it is has no captures; a group has
+    no keyname, and captures lists (capture group, keyname) for each of its members.
+    '''
+    for guard, indices in groups:
+        if guard is None:
+            entry = entries[indices[0]]
+            yield text(entry), entry[1], None
+            continue
+        members = [entries[n] for n in indices]
+        regex, numbers = dispatch.combine(guard, [text(entry) for entry in members], [entry[0] for entry in members])
+        yield regex, None, [(number, entry[1]) for number, entry in zip(numbers, members)]
+
+def theme_settings(style):
+    ''' Returns the settings dict of a tmTheme element for a style '''
+    foreground, background, fontstyle = style
+    settings = {}
+    if foreground is not None:
+        settings['foreground'] = foreground
+    if background is not None:
+        settings['background'] = background
+    if fontstyle is not None:
+        settings['fontStyle'] = fontstyle
+    return settings
+
+def theme_element_options(style):
+    ''' Returns the escaped XML for the theme settings of a style '''
+    foreground, background, fontstyle = style
+    options = []
+    if foreground is not None:
+        options.append(templates.theme_element_foreground % escape(foreground))
+    if background is not None:
+        options.append(templates.theme_element_background % escape(background))
+    if fontstyle is not None:
+        options.append(templates.theme_element_fontstyle % fontstyle)
+    return ''.join(options)
+
+def is_auto(c):
+    return isinstance(c, str) and c.lower() == "auto"
+
+def prepare_auto_colours(keywords):
+    ''' Works out every auto colour of some (key, value) pairs in one batch, so that colour() finds them already memoised '''
+    keys = []
+    dark_keys = []
+    for key, value in keywords:
+        if type(value) == dict:
+            if is_auto(value.get("colour")):
+                keys.append(key)
+            if is_auto(value.get("background")):
+                dark_keys.append(key)
+        elif is_auto(value):
+            keys.append(key)
+    string_to_colours(keys)
+    string_to_dark_colours(dark_keys)
+
+def is_generated_colour(c):
+    return isinstance(c, str) and c.lower() in ("auto", "random")
+
+def with_foreground(value, c):
+    ''' Returns a keyword's value with its colour replaced, leaving the original (which may be a mixin's) alone '''
+    return dict(value, colour=c) if type(value) == dict else c
+
+def read_keywords_file(path, default):
+    '''
+    Yields a (key, value) pair for each keyword in a file, reading one line at a time.
+    Files ending in .csv have the keyword in the first column and optionally a colour in
+    the second; anything else has a keyword on each line. Keywords get the value default,
+    with the colour replaced if one is given.
+    '''
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        rows = csv.reader(f) if path.lower().endswith('.csv') else ([line] for line in f)
+        for row in rows:
+            key = row[0].strip() if row else ''
+            if not key:
+                continue
+            if len(row) > 1 and row[1].strip():
+                yield key, with_foreground(default, row[1].strip())
+            else:
+                yield key, default
+
+def is_literal(key, whole_word):
+    ''' Whether a keyword is a plain word that only ever matches as a whole word '''
+    return re.match(r"^[A-Za-z0-9]+$", key) is not None and (whole_word or strip_non_alpha(key) == key)
+
+def collapse_literal_keywords(entries):
+    '''
+    Takes (key, regex, keyname, style, literal, case_insensitive) entries, e.g. a
+    KeywordTable, and merges the literal keywords sharing a style into single
+    trie-optimised alternations. Each group takes the place and name of its first member.
+    Returns (regex, keyname, style, merged) entries.
+
+    Moving a keyword up to its group's place must not change which pattern wins where it
+    matches, so a keyword only joins a group if nothing it is moved past can match where
+    it starts: other literals can't, being different whole words, unless they differ only
+    in case and either is case-insensitive; regex keywords can't if none of the characters
+    they can start with begins the keyword. Otherwise the keyword starts new groups.
+    '''
+    result = []
+    # (style, case_insensitive) -> the entry its next literal joins, as [regex, keyname, style, members, case_insensitive]
+    groups = {}
+    # lowercased literal -> the (style, case_insensitive) of the groups it is in
+    words = {}
+    # characters the regex keywords moved past can start with
+    barrier = set()
+    for key, regex, keyname, style, literal, case_insensitive in entries:
+        if not literal:
+            result.append([regex, keyname, style, None, False])
+            chars = dispatch.first_characters(regex)
+            if chars is None:
+                groups, words, barrier = {}, {}, set()
+            else:
+                barrier |= chars
+            continue
+        group = (style, case_insensitive)
+        clashes = any(other != group and (case_insensitive or other[1]) for other in words.get(key.lower(), ()))
+        if clashes or barrier & dispatch.case_variants(key[0], case_insensitive):
+            groups, words, barrier = {}, {}, set()
+        words.setdefault(key.lower(), set()).add(group)
+        if group in groups:
+            groups[group][3].append(key)
+        else:
+            groups[group] = [regex, keyname, style, [key], case_insensitive]
+            result.append(groups[group])
+
+    collapsed = []
+    for regex, keyname, style, members, case_insensitive in result:
+        if members is not None and len(members) > 1:
+            collapsed.append((trie_regex(members, case_insensitive), keyname, style, True))
+        else:
+            collapsed.append((regex, keyname, style, False))
+    return collapsed
+
+def update_fingerprint(fingerprint, data):
+    ''' Feeds JSON-serialisable data into a hashlib object in a canonical form '''
+    fingerprint.update(json.dumps(data, sort_keys=True).encode('utf-8'))
+
+def artifacts_exist(scheme_name, extensions=OUTPUT_EXTENSIONS):
+    return all(os.path.isfile(os.path.join(SYNESTHESIA_OUTPUT_PATH, "%s.%s" % (scheme_name, ext))) for ext in extensions)
+
+def checkpoint(job, scheme_name, stage):
+    ''' Marks the start of a stage of the compile, and stops it here if its job was cancelled '''
+    instrument.begin(stage)
+    if job:
+        job.checkpoint("Compiling %s: %s..." % (scheme_name, stage))
+
+def cancellable(entries, job, every=1000):
+    ''' Passes entries through, checking every so often whether the job was cancelled '''
+    for n, entry in enumerate(entries):
+        if job and n % every == 0:
+            job.checkpoint()
+        yield entry
+
 def first_valid_path(*paths):
     ''' Takes a list of paths, returning the first valid path, or None if none are valid '''
     for path in paths:
@@ -95,66 +434,86 @@ def first_valid_path(*paths):
     return None
 
 class SynesthesiaCompileCommand(sublime_plugin.WindowCommand):
-    def run(self, cmd = []):
-
-        path = cmd[0] if len(cmd) > 0 else self.window.active_view().file_name()
-        filepath = os.path.abspath(path)
+    def run(self, cmd = [], force = False):
+
+        path = os.path.abspath(cmd[0] if len(cmd) > 0 else self.window.active_view().file_name())
+        # the view is only read here, on the UI thread; the compile itself runs in the background
+        compile_in_background(path, read_default_settings(self.window.active_view()), force)
+
+def compile_in_background(path, default_colours=None, force=False):
+    ''' Queues a compile, superseding any compile of the same scheme that hasn't finished '''
+    QUEUE.submit(path, lambda job: compile_scheme(path, default_colours, force, job=job))
+
+def compile_scheme(path, default_colours=None, force=False, record=True, job=None):
+    '''
+    Compiles the highlighting scheme at path.
+    Returns the scheme's name, its registry entry and whether anything had to be generated,
+    or None if it couldn't be compiled.
+    If a job is given, the compile reports its progress to it and stops if it is cancelled.
+    What the compile did is summarised in the console and passed to instrument's listeners.
+    '''
+    filepath = os.path.abspath(path)
+    with instrument.compiling(os.path.basename(filepath)) as report:
+        instrument.begin("loading")
         themename, entries = load_json_data(filepath)
         directory, _, _ = split_filepath(filepath)
 
         if not entries:
-            return
+            return None
+        report.scheme = themename
 
-        hs = HighlightingScheme(directory, entries)
+        hs = HighlightingScheme(directory, entries, filepath)
 
-        default_colours = read_default_settings(self.window.active_view())
         if default_colours:
             hs.default_colours = default_colours
 
-        hs.save(themename)
-
-class Keyword():
-    count = 0
-
-    def __init__(self, regex, value):
-
-        self.colour = None
-        self.background_colour = None
-        self.fontstyle = []
-        self.whole_word = False # do i really need this after modifying the regex?
-        self.case_insensitive = False # same for this one
-        self.name = strip_non_alpha(regex)
-        self.regex = regex
-
-        if type(value) == str:
-            self.colour = colour(regex, value)
-        elif type(value) == dict:
-            if "colour" in value:
-                self.colour = colour(regex, value["colour"])
-            if "background" in value:
-                self.background_colour = colour(key, value["background"], True)
-            if "italics" in value and value["italics"]:
-                self.fontstyle.append("italic")
-            if "bold" in value and value["bold"]:
-                self.fontstyle.append("bold")
-            if "whole-word" in value and value["whole-word"]:
-                self.whole_word = True
-            if "case-insensitive" in value and value["case-insensitive"]:
-                self.case_insensitive = True
-
-        # Post-processing of regex
-
-        if self.whole_word or self.name == regex:
-            # regex is completely alphabetical;
-            # automatically enforce word boundary
-            self.regex = "\\b%s\\b" % regex
-        if self.case_insensitive:
-            self.regex = "(?i:%s)" % regex
-        self.name = "%s_%d" % (self.name, Keyword.count)
-        Keyword.count += 1
+        try:
+            saved = hs.save(themename, force, record, job)
+        except Cancelled:
+            report.outcome = "cancelled"
+            raise
+        if saved:
+            report.outcome = "generated" if hs.generated else "up to date"
+    print(report.summary())
+
+    if not saved:
+        return None
+    return themename, hs.entry, hs.generated
+
+def scheme_up_to_date(path, default_colours=None):
+    ''' Whether compiling the scheme at path would leave its files as they are, found without compiling it '''
+    filepath = os.path.abspath(path)
+    themename, entries = load_json_data(filepath)
+    if not entries:
+        return False
+    directory, _, _ = split_filepath(filepath)
+    hs = HighlightingScheme(directory, entries, filepath)
+    if default_colours:
+        hs.default_colours = default_colours
+    return hs.resolve(themename, "keywords" in entries and entries["keywords"] or {}) and hs.up_to_date(themename)
+
+def load_keywords(path, default_colours=None):
+    '''
+    Reads the keywords of the scheme at path into a KeywordTable, as compiling it would,
+    without generating anything. Returns the scheme's name, the HighlightingScheme and
+    the table, or None if the scheme can't be read.
+    '''
+    filepath = os.path.abspath(path)
+    themename, entries = load_json_data(filepath)
+    if not entries:
+        return None
+    directory, _, _ = split_filepath(filepath)
+    hs = HighlightingScheme(directory, entries, filepath)
+    if default_colours:
+        hs.default_colours = default_colours
+    return themename, hs, hs.build_keywords(themename, hs.resolve_keywords(themename))
 
 def process_tmLanguage(scheme_name, path, keywords, insertion_scope):
-    plist = plistlib.readPlist(path)
+    # The parsed grammar is shared through the cache, so only the parts
+    # that change are copied: the top level, the repository and the path
+    # down to the insertion point
+    plist = dict(CACHE.get(path, read_plist))
+    plist['repository'] = dict(plist.get('repository', {}))
 
     plist['name'] = scheme_name
     plist['scopeName'] += '.' + scheme_name
@@ -165,59 +524,90 @@ def process_tmLanguage(scheme_name, path, keywords, insertion_scope):
         if scope not in insertion_point:
             print("Could not find scope %s from specified insertion scope %s!" % (scope, insertion_scope))
             print("tmLanguage not generated")
-            return
+            return False
+        insertion_point[scope] = dict(insertion_point[scope])
         insertion_point = insertion_point[scope]
     if "patterns" not in insertion_point:
         print("Could not find key 'patterns' in specified insertion scope %s!" % (insertion_scope))
         print("tmLanguage not generated")
-        return
+        return False
     else:
+        insertion_point["patterns"] = list(insertion_point["patterns"])
         insertion_point = insertion_point["patterns"]
 
-    # TODO other features, font, etc.
-    for keyword in keywords:
-        plist['repository'][keyword.name] = {
-            'match': keyword.regex,
-            'name': 'meta.other.%s.%s' % (scheme_name, keyword.name)
+    for regex, keyname, _, _ in keywords:
+        plist['repository'][keyname] = {
+            'match': regex,
+            'name': 'meta.other.%s.%s' % (scheme_name, keyname)
         }
         insertion_point.append({
-            'include': '#%s' % (keyword.name)
+            'include': '#%s' % (keyname)
         })
 
     path = os.path.join(SYNESTHESIA_OUTPUT_PATH, scheme_name + '.tmLanguage')
 
-    plistlib.writePlist(plist, path)
-    print("Generated %s" % (path))
+    write_artifact(path, plist_bytes(plist))
+    return True
 
 def process_tmTheme(scheme_name, path, keywords):
-    plist = plistlib.readPlist(path)
+    # Copied like the grammar in process_tmLanguage
+    plist = dict(CACHE.get(path, read_plist))
+    plist['settings'] = list(plist['settings'])
 
     plist['name'] = scheme_name
 
-    # TODO other features
-    for keyword in keywords:
+    for _, keyname, style, _ in keywords:
         plist['settings'].append({
-            'name': keyword.name,
-            'scope': 'meta.other.%s.%s' % (scheme_name, keyword.name),
-            'settings': {'foreground': keyword.colour}
+            'name': keyname,
+            'scope': 'meta.other.%s.%s' % (scheme_name, keyname),
+            'settings': theme_settings(style)
         })
 
     path = os.path.join(SYNESTHESIA_OUTPUT_PATH, scheme_name + '.tmTheme')
 
-    plistlib.writePlist(plist, path)
-    print("Generated %s" % (path))
+    write_artifact(path, plist_bytes(plist))
+
+def process_sublime_syntax(scheme_name, path, keywords, insertion_scope):
+    # A .sublime-syntax can't be spliced into a tmLanguage, so the base grammar is
+    # embedded whole and the keywords are tried before it at the top level
+    plist = CACHE.get(path, read_plist)
+    base_scope = plist['scopeName']
+    if insertion_scope != 'patterns':
+        print("Keywords are only inserted at the top level of %s when generating a .sublime-syntax, not in %s." % (base_scope, insertion_scope))
+
+    scope_extensions = ''.join(templates.syntax_extension % yaml_string(x) for x in plist.get('fileTypes', [])) or " []"
+    lines = [templates.syntax_header % (yaml_string(scheme_name), scope_extensions, base_scope, scheme_name)]
+    lines.append(templates.syntax_contexts)
+    for regex, keyname, _, _ in keywords:
+        lines.append(templates.syntax_keyword % (yaml_string(regex), yaml_string('meta.other.%s.%s' % (scheme_name, keyname))))
+    lines.append("    - include: %s\n" % yaml_string('scope:' + base_scope))
+
+    path = os.path.join(SYNESTHESIA_OUTPUT_PATH, scheme_name + '.sublime-syntax')
+
+    write_artifact(path, ''.join(lines))
+
+def process_sublime_color_scheme(scheme_name, path, keywords):
+    scheme = tmTheme_to_colour_scheme(CACHE.get(path, read_plist))
+
+    scheme['name'] = scheme_name
+
+    for _, keyname, style, _ in keywords:
+        scheme['rules'].append(colour_scheme_rule(keyname, 'meta.other.%s.%s' % (scheme_name, keyname), style))
+
+    path = os.path.join(SYNESTHESIA_OUTPUT_PATH, scheme_name + '.sublime-color-scheme')
 
-def process_sublime_settings(scheme_name, path, existing_settings):
+    write_artifact(path, json.dumps(scheme, sort_keys=False, indent=4, separators=(',', ': ')))
+
+def process_sublime_settings(scheme_name, path, existing_settings, theme_extension="tmTheme"):
     settings = json.loads(read_file(path))
 
     for key in existing_settings:
         settings[key] = existing_settings[key]
-    settings["color_scheme"] = '%s/%s.tmTheme' % (SYNESTHESIA_OUTPUT_PATH_RELATIVE, scheme_name)
+    settings["color_scheme"] = '%s/%s.%s' % (SYNESTHESIA_OUTPUT_PATH_RELATIVE, scheme_name, theme_extension)
 
     path = os.path.join(SYNESTHESIA_OUTPUT_PATH, scheme_name + '.sublime-settings')
 
-    write_file(path, json.dumps(settings, sort_keys=False, indent=4, separators=(',', ': ')))
-    print("Generated %s" % (path))
+    write_artifact(path, json.dumps(settings, sort_keys=False, indent=4, separators=(',', ': ')))
 
 class HighlightingScheme():
     """
@@ -227,69 +617,183 @@ class HighlightingScheme():
     - a colour theme
     - a settings file
 
+    written either as .tmLanguage and .tmTheme or, with "format": "sublime-syntax",
+    as the .sublime-syntax and .sublime-color-scheme formats native to Sublime Text.
     """
 
     default_colours = templates.default_colours
 
-    def __init__(self, directory, data):
+    def __init__(self, directory, data, path=None):
         self.directory = directory
         self.data = data
+        self.path = path
+        self.job = None
+        # files other than the scheme itself that the output depends on
+        self.dependencies = []
+        # keywords given cyclic colours by expand_sugar
+        self.cyclic_keywords = set()
+
+    @property
+    def format(self):
+        return "format" in self.data and self.data["format"] or "tmLanguage"
+
+    @property
+    def keywords_file(self):
+        ''' The path of the file the scheme reads more keywords from, if any '''
+        if "keywords_file" in self.data and self.data["keywords_file"]:
+            return os.path.join(self.directory, self.data["keywords_file"])
+        return None
+
+    @property
+    def dispatches_keywords(self):
+        return "dispatch_keywords" in self.data and self.data["dispatch_keywords"]
+
+    @property
+    def prunes_keywords(self):
+        return "prune_keywords" not in self.data or self.data["prune_keywords"]
+
+    @property
+    def collapses_keywords(self):
+        return "collapse_keywords" in self.data and self.data["collapse_keywords"]
+
+    def save(self, theme_name, force=False, record=True, job=None):
+        '''
+        Generates the scheme's files unless they are already up to date.
+        The scheme is recorded in the registry unless record is False,
+        in which case the caller is responsible for recording self.entry.
+        Stops between stages if the job is cancelled.
+        Returns whether the files are up to date afterwards; self.generated
+        tells whether they had to be generated.
+        '''
+        self.job = job
+        self.generated = False
 
-    def save(self, theme_name):
         # initialization
         autocompletion = "autocompletion" in self.data and self.data["autocompletion"]
-        keywords = []
-        theme_scopes = []
         keyword_map = "keywords" in self.data and self.data["keywords"] or {}
         settings_map = "settings" in self.data and self.data["settings"] or {}
-        count = 0
-        auto_keywords_list = "auto_keywords" in self.data and self.data["auto_keywords"] or []
-        random_keywords_list = "random_keywords" in self.data and self.data["random_keywords"] or []
-        cyclic_keywords_list = "cyclic_keywords" in self.data and self.data["cyclic_keywords"] or []
-        cyclic_seed = "cyclic_seed" in self.data and self.data["cyclic_seed"] or None
 
         extensions = "extensions" in self.data and self.data["extensions"] or ["txt", "md"]
 
+        checkpoint(job, theme_name, "resolving includes")
+        if not self.resolve(theme_name, keyword_map):
+            return False
+
+        if not force and self.up_to_date(theme_name):
+            print("%s is up to date." % theme_name)
+            sublime.status_message("Highlighting scheme %s is up to date." % theme_name)
+            if record:
+                # e.g. the scheme was moved; the registry is only written if something changed
+                self.record(theme_name)
+            return True
+
+        checkpoint(job, theme_name, "expanding keywords")
+        self.expand_sugar(keyword_map)
+        if self.prunes_keywords:
+            self.prune_keywords(theme_name, keyword_map)
+
+        if "cost_budget" in self.data:
+            checkpoint(job, theme_name, "checking cost budget")
+            if not regexcost.check_budget(self.data["cost_budget"], self.directory, keyword_regexes(keyword_map)):
+                print("%s not generated." % theme_name)
+                sublime.status_message("Highlighting scheme %s is over its cost budget." % theme_name)
+                return False
+
+        checkpoint(job, theme_name, "generating colours")
+        keywords = self.build_keywords(theme_name, keyword_map)
+        instrument.count("keywords", len(keywords))
+
+        # generate syntax and theme files
+        checkpoint(job, theme_name, "writing files")
+        if self.derived_paths:
+            generated = self.generate_derived_files(theme_name, keywords, settings_map, *self.derived_paths)
+        else:
+            generated = self.generate_non_derived_files(autocompletion, theme_name, settings_map, extensions, keywords, self.collapses_keywords, self.dispatches_keywords)
+
+        if generated:
+            if record:
+                self.record(theme_name)
+            sublime.status_message("Highlighting scheme %s generated." % theme_name)
+        self.generated = bool(generated)
+        return self.generated
+
+    def resolve(self, theme_name, keyword_map):
+        '''
+        Merges the scheme's mixins into keyword_map, finds the files it derives from, and
+        works out its fingerprint and registry entry from everything its output depends on.
+        Returns False if the scheme can't be compiled.
+        '''
+        if self.format not in OUTPUT_FORMATS:
+            print("Unknown format %s; expected one of %s." % (self.format, ', '.join(sorted(OUTPUT_FORMATS))))
+            return False
+
+        # the scheme is hashed before anything below gets a chance to modify it
+        fingerprint = hashlib.sha1(str(FINGERPRINT_VERSION).encode('utf-8'))
+        update_fingerprint(fingerprint, [theme_name, self.data])
+        # the settings file points at the colour scheme through the output directory's place in Sublime
+        update_fingerprint(fingerprint, SYNESTHESIA_OUTPUT_PATH_RELATIVE)
+
+        self.merge_mixins(theme_name, keyword_map, fingerprint)
+
+        update_fingerprint(fingerprint, self.default_colours)
+
+        if self.keywords_file:
+            if not os.path.isfile(self.keywords_file):
+                print("Could not locate keywords file %s" % self.keywords_file)
+                return False
+            fingerprint.update(CACHE.get(self.keywords_file, file_digest).encode('utf-8'))
+            self.dependencies.append(os.path.abspath(self.keywords_file))
+
+        self.derived_paths = None
+        if "deriving" in self.data:
+            self.derived_paths = self.locate_derived_files()
+            if not self.derived_paths:
+                return False
+            for path in self.derived_paths:
+                fingerprint.update(CACHE.get(path, file_digest).encode('utf-8'))
+                self.dependencies.append(os.path.abspath(path))
+
+        self.fingerprint = fingerprint = fingerprint.hexdigest()
+        self.entry = {
+            "fingerprint": fingerprint,
+            "source": self.path,
+            "dependencies": self.dependencies,
+            "format": self.format,
+            "artifacts": ["%s.%s" % (theme_name, ext) for ext in OUTPUT_FORMATS[self.format]],
+        }
+        return True
+
+    def up_to_date(self, theme_name):
+        ''' Whether the files generated last time are still there and came from the same inputs; needs resolve first '''
+        recorded = registry.read(SYNESTHESIA_OUTPUT_PATH).get(theme_name, {})
+        return recorded.get("fingerprint") == self.fingerprint and artifacts_exist(theme_name, OUTPUT_FORMATS[self.format])
+
+    def record(self, theme_name):
+        registry.update(SYNESTHESIA_OUTPUT_PATH, {theme_name: self.entry})
+
+    def merge_mixins(self, theme_name, keyword_map, fingerprint=None):
+        ''' Adds the keywords of every mixin the scheme depends on to keyword_map '''
         # resolve dependencies (depth-first)
         if "include" in self.data:
-            inclusions = self.data["include"]
-            inclusions.reverse()
-            already_included = [theme_name]
-            in_include_directory = get_include_contents()
-            while len(inclusions) > 0:
-                i = inclusions.pop()
-                # prevents recursive dependency, since it only looks in the same directory
-                if i in already_included:
-                    print("%s is already included." % (i))
-                else:
-                    already_included.append(i)
-                    print("Looking for %s in %s..." % (i, self.directory), end=' ')
-                    _, entries = load_json_data(os.path.join(self.directory, i + '.json'))
-                    if entries is not None:
-                        print("Found!")
-                    else:
-                        print("Looking in %s..." % (SYNESTHESIA_INCLUDE_PATH), end=' ')
-                        if i in in_include_directory:
-                            print("Found!")
-                            _, entries = load_json_data(sublime.load_resource(os.path.join(SYNESTHESIA_INCLUDE_PATH, i + '.json')), False)
-                        else:
-                            print("Could not find %s." % (i))
-
-                    # Proceed if after all that we actually ended up with some input
-                    if entries is not None:
-                        print("%s included." % (i + '.json'))
-                        if "include" in entries:
-                            to_include = entries["include"]
-                            to_include.reverse()
-                            inclusions.extend(to_include)
-                        if "keywords" in entries:
-                            new_keywords = entries["keywords"]
-                            for key in list(new_keywords.keys()):
-                                # won't add colliding names
-                                if key not in keyword_map:
-                                    keyword_map[key] = new_keywords[key]
-
-        # turn syntactic sugar into actual keywords
+            for mixin in includes.INDEX.resolve(theme_name, self.directory, self.data["include"], SYNESTHESIA_INCLUDE_PATH):
+                print("%s included from %s." % (mixin.name, mixin.location))
+                # mixins inside a .sublime-package have no file of their own
+                self.dependencies.append(includes.resource_file(mixin.location) or mixin.location)
+                if fingerprint:
+                    update_fingerprint(fingerprint, [mixin.name, mixin.digest])
+                new_keywords = mixin.keywords
+                for key in list(new_keywords.keys()):
+                    # won't add colliding names
+                    if key not in keyword_map:
+                        keyword_map[key] = new_keywords[key]
+
+    def expand_sugar(self, keyword_map):
+        ''' Turns syntactic sugar into actual keywords '''
+        auto_keywords_list = "auto_keywords" in self.data and self.data["auto_keywords"] or []
+        random_keywords_list = "random_keywords" in self.data and self.data["random_keywords"] or []
+        cyclic_keywords_list = "cyclic_keywords" in self.data and self.data["cyclic_keywords"] or []
+        cyclic_seed = "cyclic_seed" in self.data and self.data["cyclic_seed"] or None
+
         for keyword in auto_keywords_list:
             if keyword not in keyword_map:
                 keyword_map[keyword] = "auto"
@@ -304,115 +808,274 @@ class HighlightingScheme():
         for keyword, colour in zip(cyclic_keywords_list, cyclic):
             if keyword not in keyword_map:
                 keyword_map[keyword] = colour
-
-        # generate syntax and theme files
+                self.cyclic_keywords.add(keyword)
+
+    def separate_colours(self, theme_name, keyword_map, min_distance):
+        '''
+        Moves auto, random and cyclic foreground colours apart until they are at least
+        min_distance (CIELAB delta E) from each other, from the colours given explicitly,
+        and from the background, or as far apart as there is room for, which is reported.
+        Keywords are replaced in keyword_map with their final colours.
+        '''
+        flexible = []
+        fixed = []
+        for key, value in keyword_map.items():
+            c = value.get("colour") if type(value) == dict else value
+            if not isinstance(c, str):
+                continue
+            if is_generated_colour(c) or key in self.cyclic_keywords:
+                flexible.append((key, colour(key, c)))
+            else:
+                fixed.append(colour(key, c))
+        fixed.append(self.default_colours.get("background", ""))
+        # only plain #rrggbb colours can be measured; alpha is ignored
+        fixed = [c[:7] for c in fixed if re.match(r"^#[0-9A-Fa-f]{6}", c)]
+
+        separated, distance = distinct_colours([c for _, c in flexible], min_distance, fixed)
+        for (key, _), c in zip(flexible, separated):
+            keyword_map[key] = with_foreground(keyword_map[key], c)
+        if distance < min_distance:
+            print("%s: there isn't room for %d generated colours %s apart; they were kept %.1f apart instead." % (theme_name, len(flexible), min_distance, distance))
+
+    def prune_keywords(self, theme_name, keyword_map, report=True):
+        ''' Removes the keywords that an earlier keyword always matches first from keyword_map '''
+        shadowed = shadowed_keywords(zip(list(keyword_map.keys()), keyword_regexes(keyword_map)))
+        for key, reason in shadowed:
+            del keyword_map[key]
+        instrument.count("pruned_keywords", len(shadowed))
+        if shadowed and report:
+            print("%s: left out %d keywords that would never be highlighted:" % (theme_name, len(shadowed)))
+            for key, reason in shadowed[:PRUNE_REPORT_LIMIT]:
+                print("    %s (%s)" % (key, reason))
+            if len(shadowed) > PRUNE_REPORT_LIMIT:
+                print("    and %d more." % (len(shadowed) - PRUNE_REPORT_LIMIT))
+
+    def build_keywords(self, theme_name, keyword_map):
+        ''' Colours the expanded keywords and reads them into a KeywordTable, with those of keywords_file after them '''
+        prepare_auto_colours(keyword_map.items())
+        if "min_colour_distance" in self.data and self.data["min_colour_distance"]:
+            self.separate_colours(theme_name, keyword_map, self.data["min_colour_distance"])
+
+        keywords = KeywordTable.build(keyword_map)
+        if self.keywords_file:
+            self.add_file_keywords(keywords, keyword_map)
+        return keywords
+
+    def keyword_scope(self, theme_name, keyname):
+        ''' The scope the generated theme colours a keyword by '''
         if "deriving" in self.data:
-            self.generate_derived_files(theme_name, keyword_map, settings_map)
-        else:
-            self.generate_non_derived_files(autocompletion, theme_name, settings_map, extensions, theme_scopes, keywords, keyword_map, count)
-
-        sublime.status_message("Highlighting scheme %s generated." % theme_name)
-
-    def generate_derived_files(self, theme_name, keyword_map, settings_map):
+            return 'meta.other.%s.%s' % (theme_name, keyname)
+        return keyname
+
+    def add_file_keywords(self, keywords, keyword_map):
+        '''
+        Streams the keywords of the scheme's keywords_file into a KeywordTable, after every
+        other keyword. Those already in keyword_map are left out.
+        '''
+        default = "keywords_file_style" in self.data and self.data["keywords_file_style"] or "auto"
+        rows = (row for row in read_keywords_file(self.keywords_file, default) if row[0] not in keyword_map)
+        rows = cancellable(rows, self.job)
+        while True:
+            batch = list(islice(rows, KEYWORDS_FILE_BATCH))
+            if not batch:
+                break
+            prepare_auto_colours(batch)
+            for key, value in batch:
+                keywords.add(key, value)
+
+    def resolve_keywords(self, theme_name):
+        ''' Returns every keyword the scheme ends up with, in order of precedence, without generating anything '''
+        keyword_map = dict("keywords" in self.data and self.data["keywords"] or {})
+        self.merge_mixins(theme_name, keyword_map)
+        self.expand_sugar(keyword_map)
+        if self.prunes_keywords:
+            self.prune_keywords(theme_name, keyword_map, report=False)
+        return keyword_map
+
+    def locate_derived_files(self):
+        ''' Returns the paths of the theme, language and settings files to derive from, or None if any can't be found '''
         # Check inputs are present
         for required_key in ["tmLanguage", "tmTheme", "sublime-settings", "tmLanguage_scope"]:
             if required_key not in self.data["deriving"]:
                 print("Missing %s key in 'deriving' field!" % (required_key))
-                return
-
-        # Format file names correctly
-        for file_name_key in ["tmLanguage", "tmTheme", "sublime-settings"]:
-            self.data["deriving"][file_name_key] += "." + file_name_key
-
-        tmTheme = self.data["deriving"]["tmTheme"]
-        tmLanguage = self.data["deriving"]["tmLanguage"]
-        sublime_settings = self.data["deriving"]["sublime-settings"]
-
-        derived_theme_path = first_valid_path(os.path.join(self.directory, tmTheme), os.path.join(SYNESTHESIA_OUTPUT_PATH, tmTheme))
-        derived_language_path = first_valid_path(os.path.join(self.directory, tmLanguage), os.path.join(SYNESTHESIA_OUTPUT_PATH, tmLanguage))
-        derived_settings_path = first_valid_path(os.path.join(self.directory, sublime_settings), os.path.join(SYNESTHESIA_OUTPUT_PATH, sublime_settings))
-
-        if not derived_theme_path:
-            print("Could not locate %s" % tmTheme)
-            return
-        if not derived_language_path:
-            print("Could not locate %s" % tmLanguage)
-            return
-        if not derived_settings_path:
-            print("Could not locate %s" % sublime_settings)
-            return
-
-        # All required info is present
-        # Build data structures
-        keywords = [Keyword(regex, value) for (regex, value) in keyword_map.items()]
+                return None
+
+        paths = []
+        for file_name_key in ["tmTheme", "tmLanguage", "sublime-settings"]:
+            # Format file names correctly
+            file_name = self.data["deriving"][file_name_key] + "." + file_name_key
+            path = first_valid_path(os.path.join(self.directory, file_name), os.path.join(SYNESTHESIA_OUTPUT_PATH, file_name))
+            if not path:
+                print("Could not locate %s" % file_name)
+                return None
+            paths.append(path)
+
+        return paths
+
+    def generate_derived_files(self, theme_name, keywords, settings_map, derived_theme_path, derived_language_path, derived_settings_path):
+        # the keywords are written into two files, so they are worked out once
+        keywords = list(cancellable(keywords.entries(), self.job))
+        instrument.count("patterns", len(keywords))
 
         ensure_directory_exists(SYNESTHESIA_OUTPUT_PATH)
 
-        process_tmLanguage(theme_name, derived_language_path, keywords, self.data["deriving"]["tmLanguage_scope"])
+        if self.format == "sublime-syntax":
+            process_sublime_syntax(theme_name, derived_language_path, keywords, self.data["deriving"]["tmLanguage_scope"])
+            process_sublime_color_scheme(theme_name, derived_theme_path, keywords)
+            process_sublime_settings(theme_name, derived_settings_path, settings_map, "sublime-color-scheme")
+            return True
+
+        if not process_tmLanguage(theme_name, derived_language_path, keywords, self.data["deriving"]["tmLanguage_scope"]):
+            return False
         process_tmTheme(theme_name, derived_theme_path, keywords)
         process_sublime_settings(theme_name, derived_settings_path, settings_map)
+        return True
+
+    def generate_non_derived_files(self, autocompletion, theme_name, settings_map, extensions, keywords, collapse=False, dispatch_keywords=False):
+        # keywords are generated lazily and written out one at a time, unless they were collapsed or are grouped
+        entries = keywords.entries(collapse)
+        groups = None
+        if dispatch_keywords:
+            entries = list(entries)
+            groups = dispatch.plan([regex for regex, _, _, _ in entries])
+            grouped = sum(len(indices) for guard, indices in groups if guard)
+            print("%s: %d of %d patterns grouped by their first character into %d patterns." % (theme_name, grouped, len(entries), sum(1 for guard, _ in groups if guard)))
+            instrument.count("dispatch_groups", sum(1 for guard, _ in groups if guard))
+        if isinstance(entries, list):
+            instrument.count("patterns", len(entries))
+        else:
+            entries = instrument.counted(entries, "patterns")
 
-    def generate_non_derived_files(self, autocompletion, theme_name, settings_map, extensions, theme_scopes, keywords, keyword_map, count):
-        for key in list(keyword_map.keys()):
-            regex = key
-            value = keyword_map[key]
-
-            options = []
-            case_insensitive = False
-            whole_word = False
-
-            if type(value) == str:
-                options.append(templates.theme_element_foreground % colour(key, value))
-            elif type(value) == dict:
-                fontstyle = []
-                if "colour" in value:
-                    options.append(templates.theme_element_foreground % colour(key, value["colour"]))
-                if "background" in value:
-                    options.append(templates.theme_element_background % colour(key, value["background"], True))
-                if "italics" in value and value["italics"]:
-                    fontstyle.append("italic")
-                if "bold" in value and value["bold"]:
-                    fontstyle.append("bold")
-                if "whole-word" in value and value["whole-word"]:
-                    whole_word = True
-                if "case-insensitive" in value and value["case-insensitive"]:
-                    case_insensitive = True
-
-                if len(fontstyle) > 0:
-                    options.append(templates.theme_element_fontstyle % ' '.join(fontstyle))
-
-            keyname = strip_non_alpha(regex)
-
-            if whole_word or keyname == regex:
-                # regex is completely alphabetical;
-                # automatically enforce word boundary
-                regex = "\\b%s\\b" % regex
-            if case_insensitive:
-                regex = "(?i:%s)" % regex
-            keyname = "%s_%d" % (keyname, count)
-            count = count + 1
-
-            keywords.append(templates.keyword % (regex, keyname))
-            theme_scopes.append(templates.theme_element % (keyname, keyname, ''.join(options)))
-
-        keywords = ''.join(keywords)
-        # print(keywords)
-        # keywords = xml strings containing all the data already
-        theme_scopes = ''.join(theme_scopes)
-        scope_extensions = ''.join([(templates.additional_extension % x) for x in extensions])
         settings_extensions = ', '.join([(templates.additional_settings_extension % x) for x in extensions])
         other_settings = ''.join([templates.other_settings % (key, settings_map[key]) for key in list(settings_map.keys())])
+        scope_type = "source" if autocompletion else "text"
 
         # produce output files
         ensure_directory_exists(SYNESTHESIA_OUTPUT_PATH)
 
-        scope_filename = os.path.join(SYNESTHESIA_OUTPUT_PATH, theme_name + ".tmLanguage")
-        theme_filename = os.path.join(SYNESTHESIA_OUTPUT_PATH, theme_name + ".tmTheme")
+        scope_extension, theme_extension, _ = OUTPUT_FORMATS[self.format]
+        scope_filename = os.path.join(SYNESTHESIA_OUTPUT_PATH, "%s.%s" % (theme_name, scope_extension))
+        theme_filename = os.path.join(SYNESTHESIA_OUTPUT_PATH, "%s.%s" % (theme_name, theme_extension))
         settings_filename = os.path.join(SYNESTHESIA_OUTPUT_PATH, theme_name + ".sublime-settings")
-        write_file(scope_filename, templates.scope % (scope_extensions, theme_name, keywords, "source" if autocompletion else "text", theme_name, uuid.uuid4()))
-        # print(os.path.dirname(os.path.realpath(__file__)))
-        print("Written to %s." % scope_filename)
-        write_file(theme_filename, templates.theme % (theme_name, self.default_colours, theme_scopes, uuid.uuid4()))
-        print("Written to %s." % theme_filename)
-        write_file(settings_filename, templates.default_settings % (SYNESTHESIA_OUTPUT_PATH_RELATIVE, theme_name, settings_extensions, other_settings))
-        print("Written to %s." % settings_filename)
+        if self.format == "sublime-syntax":
+            scope_file, theme_file = self.write_sublime_syntax(scope_filename, theme_filename, theme_name, scope_type, extensions, entries, groups)
+        else:
+            scope_file, theme_file = self.write_tmLanguage(scope_filename, theme_filename, theme_name, scope_type, extensions, entries, groups)
+        report_written(scope_filename, scope_file)
+        report_written(theme_filename, theme_file)
+        write_artifact(settings_filename, templates.default_settings % (SYNESTHESIA_OUTPUT_PATH_RELATIVE, theme_name, theme_extension, settings_extensions, other_settings))
+        return True
+
+    def write_tmLanguage(self, scope_filename, theme_filename, theme_name, scope_type, extensions, entries, groups=None):
+        scope_extensions = ''.join([(templates.additional_extension % escape(x)) for x in extensions])
+        with PlistStream(scope_filename) as scope_file, PlistStream(theme_filename) as theme_file:
+            scope_file.write(templates.scope_header, scope_extensions, escape(theme_name))
+            theme_file.write(templates.theme_header, escape(theme_name), default_colours_element(self.default_colours))
+            for regex, keyname, style, _ in cancellable(entries, self.job):
+                if groups is None:
+                    scope_file.write(templates.keyword, escape(regex), keyname)
+                theme_file.write(templates.theme_element, keyname, keyname, theme_element_options(style))
+            if groups is not None:
+                for regex, keyname, captures in cancellable(dispatched_patterns(entries, groups, lambda entry: entry[0]), self.job):
+                    if captures is None:
+                        scope_file.write(templates.keyword, escape(regex), keyname)
+                    else:
+                        scope_file.write(templates.keyword_group, escape(regex), ''.join(templates.keyword_capture % capture for capture in captures))
+            scope_file.write(templates.scope_footer, scope_type, escape(theme_name), scope_file.content_uuid())
+            theme_file.write(templates.theme_footer, theme_file.content_uuid())
+        return scope_file, theme_file
+
+    def write_sublime_syntax(self, scope_filename, theme_filename, theme_name, scope_type, extensions, entries, groups=None):
+        scope_extensions = ''.join([(templates.syntax_extension % yaml_string(x)) for x in extensions]) or " []"
+        with TemplateStream(scope_filename) as scope_file, TemplateStream(theme_filename) as theme_file:
+            scope_file.write(templates.syntax_header, yaml_string(theme_name), scope_extensions, scope_type, theme_name)
+            theme_file.write(templates.colour_scheme_header, json.dumps(theme_name), json.dumps(colour_scheme_globals(self.default_colours), sort_keys=True))
+
+            # merged alternations are kept out of the way in variables;
+            # they only exist when the keywords were collapsed into a list
+            if isinstance(entries, list) and any(merged for _, _, _, merged in entries):
+                scope_file.write(templates.syntax_variables)
+                for regex, keyname, _, merged in entries:
+                    if merged:
+                        scope_file.write(templates.syntax_variable, keyname, yaml_string(regex))
+
+            scope_file.write(templates.syntax_contexts)
+            separator = ""
+            for regex, keyname, style, merged in cancellable(entries, self.job):
+                if groups is None:
+                    scope_file.write(templates.syntax_keyword, yaml_string("{{%s}}" % keyname if merged else regex), yaml_string(keyname))
+                theme_file.write(templates.colour_scheme_rule, separator, json.dumps(colour_scheme_rule(keyname, keyname, style), sort_keys=True))
+                separator = ","
+            if groups is not None:
+                text = lambda entry: "{{%s}}" % entry[1] if entry[3] else entry[0]
+                for regex, keyname, captures in cancellable(dispatched_patterns(entries, groups, text), self.job):
+                    if captures is None:
+                        scope_file.write(templates.syntax_keyword, yaml_string(regex), yaml_string(keyname))
+                    else:
+                        scope_file.write(templates.syntax_keyword_group, yaml_string(regex), ''.join(templates.syntax_capture % (number, yaml_string(keyname)) for number, keyname in captures))
+            theme_file.write(templates.colour_scheme_footer)
+        return scope_file, theme_file
+
+
+def write_report(path, reports):
+    with open(path, 'w') as f:
+        json.dump({"reports": reports}, f, indent=4, separators=(',', ': '))
+    print("Report written to %s." % path)
+
+def compile_worker(path, output_path, output_path_relative, default_colours, force):
+    '''
+    Compiles a scheme without recording it; output_path is only needed in a fresh process.
+    Returns the path, the result of compile_scheme and the compile's report as a dict.
+    '''
+    if output_path:
+        configure_headless(output_path, output_path_relative)
+    try:
+        result = compile_scheme(path, default_colours, force, record=False)
+    except Exception as e:
+        print("%s could not be compiled: %s" % (path, e))
+        result = None
+    report = instrument.last_report()
+    return path, result, report.to_dict() if report else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m synesthesia.compile", description="Compile highlighting schemes outside Sublime Text.")
+    parser.add_argument("schemes", nargs="+", help="highlighting scheme JSON files")
+    parser.add_argument("--out", required=True, help="directory to write generated files to")
+    parser.add_argument("--relative-out", default="Packages/User", help="where the output directory will live inside Sublime Text (default: %(default)s)")
+    parser.add_argument("--colour-scheme", help="tmTheme to take default colours from")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="recompile schemes even if they are up to date")
+    parser.add_argument("--report", help="file to write a JSON report of each compile's stages and counts to")
+    args = parser.parse_args(argv)
+
+    configure_headless(args.out, args.relative_out)
+    default_colours = read_colour_scheme_defaults(args.colour_scheme) if args.colour_scheme else None
+
+    failed = []
+    entries = {}
+    reports = []
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = [pool.submit(compile_worker, path, args.out, args.relative_out, default_colours, args.force) for path in args.schemes]
+        for future in futures:
+            path, result, report = future.result()
+            if report:
+                reports.append(report)
+            if result is None:
+                failed.append(path)
+            else:
+                theme_name, entry, _ = result
+                entries[theme_name] = entry
+
+    # workers don't touch the registry, so that they don't overwrite each other's entries
+    if entries:
+        registry.update(args.out, entries)
+    if args.report:
+        write_report(args.report, reports)
+
+    print("%d of %d schemes compiled." % (len(args.schemes) - len(failed), len(args.schemes)))
+    for path in failed:
+        print("Failed: %s" % path)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
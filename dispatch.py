@@ -0,0 +1,288 @@
+'''
+Groups keyword patterns by the characters they can start with, so that the editor can
+rule out most of them at a position with a single check.
+
+Patterns whose first characters overlap (directly, or through other patterns) are put
+in the same group, and each group is emitted as one pattern: a lookahead for the
+characters its members start with, then the members as an alternation, each in a
+capture group of its own that carries its scope. At any position, the first member that
+matches wins, just as the first of the separate patterns would have; members of
+different groups never start at the same position, so the order of the groups doesn't
+matter.
+
+Patterns whose first character can't be worked out, or that refer to their own groups
+by number or name, are left as they are. Since they might match where any other pattern
+does, groups are only formed between them, never across them.
+'''
+
+import re
+
+from .regexcost import tokenise_atom, read_quantifier
+from .prune import repeat_minimum
+
+# Members of a group beyond this are put into another group with the same characters
+GROUP_LIMIT = 100
+
+# Character classes larger than this are taken to match anything
+CLASS_LIMIT = 256
+
+ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a', 'e': '\x1b'}
+
+# Escapes that match a position rather than a character
+ZERO_WIDTH = set('bBAzZG')
+
+class Unknown(Exception):
+	pass
+
+def case_variants(chars, case_insensitive):
+	if not case_insensitive:
+		return set(chars)
+	return set(v for c in chars for v in (c, c.lower(), c.upper()) if len(v) == 1)
+
+def escaped_char(c):
+	''' The character an escape like \\- or \\t stands for '''
+	if not c.isalnum():
+		return c
+	if c in ESCAPES:
+		return ESCAPES[c]
+	raise Unknown()
+
+def class_chars(atom):
+	''' Returns the characters a character class like [a-f_] matches '''
+	body = atom[1:-1]
+	if not atom.endswith(']') or body.startswith('^') or '[' in body or '&&' in body:
+		raise Unknown()
+	chars = []
+	i = 0
+	while i < len(body):
+		if body[i] == '\\':
+			chars.append(escaped_char(body[i + 1:i + 2] or '\\'))
+			i += 2
+		else:
+			chars.append(body[i])
+			i += 1
+		if i + 1 < len(body) and body[i] == '-':
+			# a range from the character just read
+			if body[i + 1] == '\\':
+				end = escaped_char(body[i + 2:i + 3] or '\\')
+				i += 3
+			else:
+				end = body[i + 1]
+				i += 2
+			if ord(end) - ord(chars[-1]) > CLASS_LIMIT:
+				raise Unknown()
+			chars += [chr(n) for n in range(ord(chars[-1]) + 1, ord(end) + 1)]
+	if len(chars) > CLASS_LIMIT:
+		raise Unknown()
+	return chars
+
+def parse_alternation(regex, i, case_insensitive, opaque=False):
+	'''
+	Returns (characters a match can start with, whether it can be empty, index of the ) or
+	end after it) for the alternation starting at regex[i].
+
+	Once an alternative can't match nothing, what follows in it can't be where a match
+	starts, so it is only skipped over, as is all of an opaque alternation: only the first
+	characters of what can start a match have to be known.
+	'''
+	first = set()
+	nullable = False
+	alternative_first = set()
+	alternative_nullable = not opaque
+	while i < len(regex) and regex[i] != ')':
+		c = regex[i]
+		if c == '|':
+			first |= alternative_first
+			nullable = nullable or alternative_nullable
+			alternative_first = set()
+			alternative_nullable = not opaque
+			i += 1
+			continue
+
+		# whether this item can only come after something else in the match
+		skipped = not alternative_nullable
+
+		if c == '(':
+			prefix = re.match(r'\((?:\?(?:[=!:>]|<=|<!|<[A-Za-z_]\w*>|P<[A-Za-z_]\w*>|([imsx]*)(?:-([imsx]*))?:|[imsx-]+\)))?', regex[i:])
+			if prefix.group(0).endswith(')'):
+				# inline flags change how everything after them matches
+				raise Unknown()
+			group_case_insensitive = case_insensitive
+			if prefix.group(1) is not None:
+				group_case_insensitive = (case_insensitive or 'i' in prefix.group(1)) and 'i' not in (prefix.group(2) or '')
+			# lookarounds don't consume anything, so what they look for is never where a match starts
+			lookaround = prefix.group(0) in ('(?=', '(?!', '(?<=', '(?<!')
+			item_first, item_nullable, i = parse_alternation(regex, i + len(prefix.group(0)), group_case_insensitive, skipped or lookaround)
+			if i >= len(regex):
+				raise Unknown()
+			i += 1
+			if lookaround:
+				item_first, item_nullable = set(), True
+		elif skipped:
+			# shorthand classes, negated classes, dots and the like don't matter here
+			if c == '[':
+				_, i = tokenise_atom(regex, i)
+			else:
+				i += 2 if c == '\\' else 1
+			item_first, item_nullable = set(), False
+		elif c == '\\':
+			if regex[i + 1:i + 2] in ZERO_WIDTH:
+				item_first, item_nullable = set(), True
+			else:
+				item_first, item_nullable = case_variants(escaped_char(regex[i + 1:i + 2] or '\\'), case_insensitive), False
+			i += 2
+		elif c == '[':
+			atom, i = tokenise_atom(regex, i)
+			item_first, item_nullable = case_variants(class_chars(atom), case_insensitive), False
+		elif c == '.':
+			raise Unknown()
+		elif c in '^$':
+			item_first, item_nullable = set(), True
+			i += 1
+		else:
+			item_first, item_nullable = case_variants(c, case_insensitive), False
+			i += 1
+
+		quantifier = read_quantifier(regex, i)
+		if quantifier:
+			item_nullable = item_nullable or repeat_minimum(regex, i) == 0
+			i = quantifier[2]
+
+		if alternative_nullable:
+			alternative_first |= item_first
+		alternative_nullable = alternative_nullable and item_nullable
+
+	return first | alternative_first, nullable or alternative_nullable, i
+
+def first_characters(regex):
+	''' Returns the set of characters a match of regex can start with, or None if it can't be told '''
+	try:
+		first, nullable, i = parse_alternation(regex, 0, False)
+	except (Unknown, IndexError):
+		return None
+	if i != len(regex) or nullable:
+		# an unbalanced ), or a pattern that can match nothing at all, i.e. anywhere
+		return None
+	return frozenset(first)
+
+def capture_groups(regex):
+	'''
+	Returns how many capture groups a regex has, or None if it refers to them (by number
+	or name), which would break once it is put among other patterns.
+	'''
+	groups = 0
+	i = 0
+	while i < len(regex):
+		c = regex[i]
+		if c == '\\':
+			following = regex[i + 1:i + 2]
+			if following in ('k', 'g') or following.isdigit() and following != '0':
+				return None
+			i += 2
+			continue
+		if c == '[':
+			_, i = tokenise_atom(regex, i)
+			continue
+		if c == '(':
+			if not regex.startswith('(?', i):
+				groups += 1
+			elif re.match(r"\(\?(?:P?<[A-Za-z_]|'|\()", regex[i:]):
+				# named groups, and conditionals on groups
+				return None
+		i += 1
+	return groups
+
+def character_class(chars):
+	''' Writes a set of characters as a character class, with runs as ranges '''
+	def escape(c):
+		if c in '\\]^-[':
+			return '\\' + c
+		if c in '\t\n\r\f\v':
+			return '\\' + 'tnrfv'['\t\n\r\f\v'.index(c)]
+		if ord(c) < 32 or ord(c) == 127:
+			return '\\x%02x' % ord(c)
+		return c
+
+	codes = sorted(ord(c) for c in chars)
+	parts = []
+	start = 0
+	while start < len(codes):
+		end = start
+		while end + 1 < len(codes) and codes[end + 1] == codes[end] + 1:
+			end += 1
+		if end - start >= 2:
+			parts.append('%s-%s' % (escape(chr(codes[start])), escape(chr(codes[end]))))
+		else:
+			parts += [escape(chr(code)) for code in codes[start:end + 1]]
+		start = end + 1
+	return '[%s]' % ''.join(parts)
+
+def group_segment(segment, limit):
+	'''
+	Takes (index, first characters) pairs with no pattern of unknown first character
+	between them, and returns them grouped, as (guard, indices) pairs.
+	'''
+	# union-find over characters: characters are joined when a pattern can start with both
+	parent = {}
+	def find(c):
+		while parent[c] != c:
+			parent[c] = parent[parent[c]]
+			c = parent[c]
+		return c
+
+	for _, chars in segment:
+		chars = iter(chars)
+		root = next(chars)
+		parent.setdefault(root, root)
+		root = find(root)
+		for c in chars:
+			parent.setdefault(c, c)
+			parent[find(c)] = root
+
+	# root character -> members, in order; groups are kept in the order of their first member
+	groups = {}
+	for n, chars in segment:
+		groups.setdefault(find(next(iter(chars))), []).append((n, chars))
+
+	result = []
+	for members in groups.values():
+		for start in range(0, len(members), limit):
+			chunk = members[start:start + limit]
+			if len(chunk) == 1:
+				result.append((None, [chunk[0][0]]))
+			else:
+				result.append((character_class(set().union(*(chars for _, chars in chunk))), [n for n, _ in chunk]))
+	return result
+
+def plan(regexes, limit=GROUP_LIMIT):
+	'''
+	Works out how to emit patterns, given their regexes in order of precedence.
+	Returns (guard, indices) pairs in the order to emit them, where guard is the character
+	class the indexed patterns start with, or None for a pattern emitted as it is.
+	'''
+	result = []
+	segment = []
+	for n, regex in enumerate(regexes):
+		chars = first_characters(regex)
+		if not chars or capture_groups(regex) is None:
+			result += group_segment(segment, limit) if segment else []
+			segment = []
+			result.append((None, [n]))
+		else:
+			segment.append((n, chars))
+	if segment:
+		result += group_segment(segment, limit)
+	return result
+
+def combine(guard, texts, regexes):
+	'''
+	Joins the members of a group into a single regex. texts are what to write for each
+	member, regexes what they stand for. Returns the regex and the number of the capture
+	group around each member.
+	'''
+	numbers = []
+	number = 1
+	for regex in regexes:
+		numbers.append(number)
+		number += 1 + capture_groups(regex)
+	return "(?=%s)(?:%s)" % (guard, '|'.join("(%s)" % text for text in texts)), numbers
@@ -0,0 +1,225 @@
+'''
+Exports a file highlighted with a scheme's keywords, as text coloured with ANSI escape
+codes for terminals or as a standalone HTML page, e.g. for an incident report. From the
+command line:
+
+	python -m synesthesia.export SCHEME FILE [--html] [--out PATH]
+
+The scheme's keywords and colours are worked out as compiling it would, and matched by
+matcher.py. The file is read and written CHUNK_LINES lines at a time, so memory use
+doesn't grow with its size.
+'''
+
+import os, sys, time, argparse
+from html import escape
+from itertools import islice
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from . import compile
+from . import registry
+from . import templates
+from .matcher import Matcher
+from .jobs import QUEUE, Cancelled
+
+# Lines read, highlighted and written at a time
+CHUNK_LINES = 4096
+
+ANSI_RESET = "\x1b[0m"
+
+# Extension of exported files, by format
+EXTENSIONS = {"html": "html", "ansi": "ans"}
+
+def hex_rgb(c):
+	''' Returns the (red, green, blue) of a #rgb or #rrggbb colour, ignoring any alpha, or None '''
+	if not isinstance(c, str) or not c.startswith('#'):
+		return None
+	digits = c[1:]
+	if len(digits) in (3, 4):
+		digits = ''.join(d * 2 for d in digits[:3])
+	try:
+		return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4)) if len(digits) in (6, 8) else None
+	except ValueError:
+		return None
+
+def ansi_code(style):
+	''' The escape code that starts text in a style, or '' if the style changes nothing '''
+	foreground, background, fontstyle = style
+	codes = []
+	if fontstyle and "bold" in fontstyle.split():
+		codes.append("1")
+	if fontstyle and "italic" in fontstyle.split():
+		codes.append("3")
+	if hex_rgb(foreground):
+		codes.append("38;2;%d;%d;%d" % hex_rgb(foreground))
+	if hex_rgb(background):
+		codes.append("48;2;%d;%d;%d" % hex_rgb(background))
+	return "\x1b[%sm" % ';'.join(codes) if codes else ''
+
+def css(style):
+	foreground, background, fontstyle = style
+	rules = []
+	if hex_rgb(foreground):
+		rules.append("color: %s" % foreground)
+	if hex_rgb(background):
+		rules.append("background-color: %s" % background)
+	if fontstyle and "bold" in fontstyle.split():
+		rules.append("font-weight: bold")
+	if fontstyle and "italic" in fontstyle.split():
+		rules.append("font-style: italic")
+	return '; '.join(rules)
+
+class Exporter():
+	def __init__(self, entries, html=False):
+		''' Takes (regex, keyname, style, merged) entries, like KeywordTable.entries '''
+		regexes = []
+		# what goes before and after the text of each pattern's matches; None for patterns that change nothing
+		self.wrappers = []
+		# style -> wrapper, since most keywords share a style with many others
+		wrappers = {}
+		for regex, _, style, _ in entries:
+			regexes.append(regex)
+			if style not in wrappers:
+				if html:
+					wrappers[style] = (templates.html_keyword_start % escape(css(style)), templates.html_keyword_end) if css(style) else None
+				else:
+					wrappers[style] = (ansi_code(style), ANSI_RESET) if ansi_code(style) else None
+			self.wrappers.append(wrappers[style])
+		self.matcher = Matcher(regexes)
+		self.escape = (lambda text: escape(text, False)) if html else (lambda text: text)
+		self.matches = 0
+
+	def highlight(self, line, pieces):
+		''' Appends the highlighted text of a line, without its line ending, to pieces '''
+		position = 0
+		for start, end, pattern in self.matcher.scan(line):
+			wrapper = self.wrappers[pattern]
+			if wrapper is None:
+				continue
+			pieces += [self.escape(line[position:start]), wrapper[0], self.escape(line[start:end]), wrapper[1]]
+			position = end
+			self.matches += 1
+		pieces.append(self.escape(line[position:]))
+
+def export_file(scheme_path, path, output, html=False, default_colours=None, job=None):
+	'''
+	Writes the file at path, highlighted with the scheme at scheme_path, to output, a text
+	stream. Stops between chunks if the job is cancelled. Returns the number of lines and
+	of keywords highlighted, or None if the scheme can't be read.
+	'''
+	loaded = compile.load_keywords(scheme_path, default_colours)
+	if not loaded:
+		return None
+	theme_name, scheme, keywords = loaded
+	exporter = Exporter(keywords.entries(), html)
+	exporter.matcher.report_failed(theme_name, "when exporting")
+
+	if html:
+		colours = scheme.default_colours
+		output.write(templates.html_header % (escape(os.path.basename(path)), escape(colours.get("background", "#000000")), escape(colours.get("foreground", "#FFFFFF"))))
+	lines = 0
+	with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+		while True:
+			chunk = list(islice(f, CHUNK_LINES))
+			if not chunk:
+				break
+			if job:
+				job.checkpoint()
+			pieces = []
+			for line in chunk:
+				text = line.rstrip('\r\n')
+				exporter.highlight(text, pieces)
+				pieces.append(line[len(text):])
+			output.write(''.join(pieces))
+			lines += len(chunk)
+	if html:
+		output.write(templates.html_footer)
+	return lines, exporter.matches
+
+class SynesthesiaExportCommand(sublime_plugin.WindowCommand):
+	''' Exports the active file highlighted with a generated scheme, as HTML or ANSI-coloured text, next to it '''
+
+	def run(self, format="html", scheme=None):
+		view = self.window.active_view()
+		path = view.file_name() if view else None
+		if not path:
+			sublime.status_message("Save the file before exporting it.")
+			return
+		if format not in EXTENSIONS:
+			sublime.status_message("Unknown export format %s; expected one of %s." % (format, ', '.join(sorted(EXTENSIONS))))
+			return
+
+		schemes = registry.read(compile.SYNESTHESIA_OUTPUT_PATH)
+		if scheme is None:
+			names = sorted(schemes)
+			if not names:
+				sublime.status_message("No highlighting schemes have been generated.")
+				return
+
+			def done(which):
+				if which != -1:
+					self.window.run_command("synesthesia_export", {"format": format, "scheme": names[which]})
+
+			self.window.show_quick_panel(names, done)
+			return
+
+		source = scheme in schemes and schemes[scheme].get("source")
+		if not source or not os.path.isfile(source):
+			sublime.status_message("The source of %s can't be found." % scheme)
+			return
+		default_colours = compile.read_default_settings(view)
+		output_path = "%s.%s" % (path, EXTENSIONS[format])
+
+		def work(job):
+			start = time.perf_counter()
+			try:
+				with open(output_path, 'w', encoding='utf-8', newline='') as output:
+					result = export_file(source, path, output, format == "html", default_colours, job)
+			except Cancelled:
+				os.remove(output_path)
+				raise
+			if result is None:
+				sublime.status_message("%s could not be exported." % os.path.basename(path))
+				return
+			print("Exported %s to %s: %d lines, %d keywords highlighted in %.2fs." % (path, output_path, result[0], result[1], time.perf_counter() - start))
+			sublime.status_message("Exported to %s." % os.path.basename(output_path))
+
+		sublime.status_message("Exporting %s..." % os.path.basename(path))
+		QUEUE.submit("export %s" % output_path, work)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.export", description="Highlight a file with a highlighting scheme, as ANSI-coloured text or HTML.")
+	parser.add_argument("scheme", help="highlighting scheme JSON file")
+	parser.add_argument("file", help="file to highlight")
+	parser.add_argument("--html", action="store_true", help="write a standalone HTML page instead of ANSI-coloured text")
+	parser.add_argument("--out", help="file to write to (default: standard output)")
+	parser.add_argument("--colour-scheme", help="tmTheme to take the page's colours from")
+	args = parser.parse_args(argv)
+
+	compile.configure_headless(os.getcwd())
+	default_colours = compile.read_colour_scheme_defaults(args.colour_scheme) if args.colour_scheme else None
+
+	stdout = output = sys.stdout
+	# messages go to standard error, out of the way of the export
+	sys.stdout = sys.stderr
+	try:
+		if args.out:
+			with open(args.out, 'w', encoding='utf-8', newline='') as output:
+				result = export_file(args.scheme, args.file, output, args.html, default_colours)
+		else:
+			result = export_file(args.scheme, args.file, output, args.html, default_colours)
+			output.flush()
+	except BrokenPipeError:
+		# e.g. piped into head; whatever was wanted has been written
+		sys.stderr.close()
+		return 0
+	finally:
+		sys.stdout = stdout
+	return 0 if result else 1
+
+if __name__ == "__main__":
+	raise SystemExit(main())
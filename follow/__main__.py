@@ -0,0 +1,3 @@
+from .tail import main
+
+raise SystemExit(main())
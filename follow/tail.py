@@ -0,0 +1,236 @@
+'''
+Follows growing log files, printing what is added to them highlighted with a scheme's
+keywords in ANSI colours, like tail -f for many files at once. Run from the directory
+containing the synesthesia package:
+
+	python -m synesthesia.follow SCHEME FILE [FILE ...]
+
+All the files are followed from a single asyncio event loop. For each file, a reader
+polls it for new bytes and queues them a chunk of whole lines at a time, and a
+highlighter passes the chunks to a pool of worker processes, which highlight them as
+export.py does, and queues the result for the one writer. Every queue is bounded, so
+when the writer or the workers fall behind, the readers wait rather than buffer, and
+memory use stays the same however fast the files grow.
+
+A file that shrinks was truncated and is read again from its start. A file replaced by
+another, e.g. by log rotation, is read to its end, then the new one is followed from its
+start. A file that doesn't exist yet is waited for.
+'''
+
+import os, sys, time, signal, asyncio, argparse
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import compile
+from ..export import Exporter
+from ..instrument import format_bytes
+
+# Bytes read from a file at a time
+READ_BYTES = 256 * 1024
+
+# A line longer than this is highlighted in pieces rather than held back until it ends
+MAX_LINE_BYTES = 1024 * 1024
+
+# Chunks waiting to be highlighted, per file
+READ_QUEUE_CHUNKS = 4
+
+# Highlighted chunks waiting to be written, from all files
+WRITE_QUEUE_CHUNKS = 16
+
+# How often files with nothing new are looked at again, in seconds
+POLL_INTERVAL = 0.25
+
+# The exporter highlighting chunks, set up by load_exporter in each process
+exporter = None
+
+def load_exporter(scheme_path):
+	''' Reads the scheme, printing any messages to standard error. Returns the scheme's name, or None. '''
+	global exporter
+	with redirect_stdout(sys.stderr):
+		loaded = compile.load_keywords(scheme_path)
+	if not loaded:
+		return None
+	theme_name, _, keywords = loaded
+	exporter = Exporter(keywords.entries())
+	return theme_name
+
+def start_worker(scheme_path):
+	# interrupting the follower stops the workers through it
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	compile.configure_headless(os.getcwd())
+	load_exporter(scheme_path)
+
+def highlight(data):
+	''' Highlights whole lines given as bytes, returning the text to write '''
+	pieces = []
+	lines = data.decode('utf-8', 'replace').split('\n')
+	for n, line in enumerate(lines):
+		text = line.rstrip('\r')
+		exporter.highlight(text, pieces)
+		pieces.append(line[len(text):])
+		if n + 1 < len(lines):
+			pieces.append('\n')
+	return ''.join(pieces)
+
+class Throughput():
+	''' What has been read from a file '''
+
+	def __init__(self, path):
+		self.path = path
+		self.bytes = 0
+		self.lines = 0
+		self.truncations = 0
+		self.rotations = 0
+		# seconds readers spent waiting for the highlighter to catch up
+		self.waiting = 0.0
+		self.start = time.perf_counter()
+		# bytes when last reported
+		self.reported = 0
+
+	def describe(self, seconds=None):
+		''' Describes the throughput over the whole run, or since the last report if seconds is given '''
+		if seconds is None:
+			seconds = time.perf_counter() - self.start
+			n = self.bytes
+		else:
+			n = self.bytes - self.reported
+			self.reported = self.bytes
+		line = "%s: %d lines, %s, %s/s" % (self.path, self.lines, format_bytes(self.bytes), format_bytes(n / max(seconds, 0.001)))
+		events = []
+		if self.truncations:
+			events.append("truncated %d times" % self.truncations)
+		if self.rotations:
+			events.append("rotated %d times" % self.rotations)
+		if self.waiting >= 0.1:
+			events.append("waited %.1fs for highlighting" % self.waiting)
+		return line + ("; %s" % ', '.join(events) if events else "")
+
+async def queue_chunk(queue, chunk, stats):
+	''' Queues a chunk, waiting for room if the queue is full '''
+	start = time.perf_counter()
+	await queue.put(chunk)
+	stats.waiting += time.perf_counter() - start
+	stats.lines += chunk.count(b'\n')
+
+async def read_file(path, queue, stats, from_start):
+	''' Queues what is added to a file, a chunk of whole lines at a time '''
+	f = None
+	first = True
+	pending = b''
+	while True:
+		if f is None:
+			try:
+				f = open(path, 'rb')
+			except FileNotFoundError:
+				# all of a file created after following started is new
+				first = False
+				await asyncio.sleep(POLL_INTERVAL)
+				continue
+			identity = os.fstat(f.fileno())
+			if first and not from_start:
+				f.seek(0, os.SEEK_END)
+			first = False
+			pending = b''
+
+		data = f.read(READ_BYTES)
+		if data:
+			stats.bytes += len(data)
+			pending += data
+			cut = pending.rfind(b'\n') + 1
+			if not cut and len(pending) > MAX_LINE_BYTES:
+				cut = len(pending)
+			if cut:
+				chunk, pending = pending[:cut], pending[cut:]
+				await queue_chunk(queue, chunk, stats)
+			# let the other files have a turn
+			await asyncio.sleep(0)
+			continue
+
+		# nothing new: the file may have been truncated, or replaced
+		try:
+			current = os.stat(path)
+		except FileNotFoundError:
+			current = None
+		if current is not None and (current.st_ino, current.st_dev) != (identity.st_ino, identity.st_dev):
+			# the old file has been read to its end; its last line won't be finished now
+			if pending:
+				await queue_chunk(queue, pending + b'\n', stats)
+			f.close()
+			f = None
+			stats.rotations += 1
+			continue
+		if os.fstat(f.fileno()).st_size < f.tell():
+			f.seek(0)
+			pending = b''
+			stats.truncations += 1
+			continue
+		await asyncio.sleep(POLL_INTERVAL)
+
+async def highlight_file(path, queue, output, executor):
+	loop = asyncio.get_running_loop()
+	while True:
+		chunk = await queue.get()
+		text = await loop.run_in_executor(executor, highlight, chunk) if executor else highlight(chunk)
+		await output.put((path, text))
+
+async def write_output(output, out, headers):
+	last = None
+	while True:
+		path, text = await output.get()
+		if headers and path != last:
+			out.write("\n==> %s <==\n" % path)
+			last = path
+		out.write(text)
+		out.flush()
+
+async def report_throughput(statistics, interval):
+	while True:
+		await asyncio.sleep(interval)
+		for stats in statistics:
+			sys.stderr.write(stats.describe(interval) + "\n")
+
+async def follow(paths, out, statistics, executor, from_start=False, headers=True, report_interval=None):
+	output = asyncio.Queue(WRITE_QUEUE_CHUNKS)
+	tasks = [asyncio.ensure_future(write_output(output, out, headers))]
+	for path, stats in zip(paths, statistics):
+		queue = asyncio.Queue(READ_QUEUE_CHUNKS)
+		tasks.append(asyncio.ensure_future(read_file(path, queue, stats, from_start)))
+		tasks.append(asyncio.ensure_future(highlight_file(path, queue, output, executor)))
+	if report_interval:
+		tasks.append(asyncio.ensure_future(report_throughput(statistics, report_interval)))
+	# the tasks only end by failing, or when the follower is interrupted
+	await asyncio.gather(*tasks)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.follow", description="Follow growing files, highlighting what is added to them with a highlighting scheme.")
+	parser.add_argument("scheme", help="highlighting scheme JSON file")
+	parser.add_argument("files", nargs="+", help="files to follow")
+	parser.add_argument("--from-start", action="store_true", help="print the files from their start rather than only what is added")
+	parser.add_argument("--jobs", type=int, default=None, help="number of worker processes highlighting, or 0 to highlight in this one (default: one per core)")
+	parser.add_argument("--stats", type=float, metavar="SECONDS", help="report each file's throughput to standard error this often")
+	parser.add_argument("--no-headers", action="store_true", help="don't print the name of the file before what was added to it")
+	args = parser.parse_args(argv)
+
+	compile.configure_headless(os.getcwd())
+	theme_name = load_exporter(args.scheme)
+	if not theme_name:
+		return 1
+	exporter.matcher.report_failed(theme_name, "when following")
+
+	statistics = [Throughput(path) for path in args.files]
+	executor = ProcessPoolExecutor(args.jobs, initializer=start_worker, initargs=(args.scheme,)) if args.jobs != 0 else None
+	headers = len(args.files) > 1 and not args.no_headers
+	try:
+		asyncio.run(follow(args.files, sys.stdout, statistics, executor, args.from_start, headers, args.stats))
+	except KeyboardInterrupt:
+		pass
+	except BrokenPipeError:
+		# e.g. piped into head; whatever was wanted has been written
+		sys.stderr.close()
+		return 0
+	finally:
+		if executor:
+			executor.shutdown(wait=False)
+	for stats in statistics:
+		sys.stderr.write(stats.describe() + "\n")
+	return 0
@@ -0,0 +1,66 @@
+'''
+A thin stand-in for the parts of the sublime and sublime_plugin APIs that the compiler uses,
+so that highlighting schemes can be compiled outside the editor, e.g.
+
+	python -m synesthesia.compile --out DIR schemes/*.json
+
+Resources are looked up in this package's own directory only.
+'''
+
+import os, sys, queue, fnmatch, threading
+
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_NAME = os.path.basename(PACKAGE_PATH)
+
+def platform():
+	if os.name == "nt":
+		return "windows"
+	return "osx" if sys.platform == "darwin" else "linux"
+
+def packages_path():
+	return os.path.dirname(PACKAGE_PATH)
+
+def status_message(message):
+	print(message)
+
+def set_timeout(callback, delay=0):
+	''' Runs callback after delay milliseconds, on a timer thread of its own '''
+	threading.Timer(delay / 1000.0, callback).start()
+
+async_callbacks = queue.Queue()
+
+def run_async_callbacks():
+	while True:
+		async_callbacks.get()()
+
+def set_timeout_async(callback, delay=0):
+	''' Like Sublime's async thread, callbacks run one at a time on a single thread '''
+	if not hasattr(set_timeout_async, "thread"):
+		set_timeout_async.thread = threading.Thread(target=run_async_callbacks, daemon=True)
+		set_timeout_async.thread.start()
+	threading.Timer(delay / 1000.0, async_callbacks.put, [callback]).start()
+
+def find_resources(pattern):
+	''' Returns the paths of files in this package matching a pattern, in "Packages/<name>/..." form '''
+	result = []
+	for root, _, files in os.walk(PACKAGE_PATH):
+		for f in fnmatch.filter(files, pattern):
+			relative = os.path.relpath(os.path.join(root, f), packages_path())
+			result.append("Packages/" + relative.replace(os.sep, "/"))
+	return result
+
+def load_resource(name):
+	path = os.path.join(packages_path(), *name.split("/")[1:])
+	with open(path, 'r') as f:
+		return f.read()
+
+class WindowCommand():
+	def __init__(self, window):
+		self.window = window
+
+class TextCommand():
+	def __init__(self, view):
+		self.view = view
+
+class EventListener():
+	pass
@@ -0,0 +1,140 @@
+import os, json, hashlib
+
+try:
+	import sublime
+except ImportError:
+	from . import headless as sublime
+
+from . import instrument
+
+class Mixin():
+	''' A mixin, parsed from a particular location '''
+
+	def __init__(self, name, location, mtime, entries, digest):
+		self.name = name
+		self.location = location
+		self.mtime = mtime
+		self.entries = entries
+		self.digest = digest
+
+	@property
+	def includes(self):
+		return self.entries.get("include", []) if self.entries else []
+
+	@property
+	def keywords(self):
+		return self.entries.get("keywords", {}) if self.entries else {}
+
+def resource_file(location):
+	''' Returns the file on disk backing a location, or None if it is inside a .sublime-package '''
+	if location.startswith("Packages/"):
+		path = os.path.join(sublime.packages_path(), *location.split("/")[1:])
+		return path if os.path.isfile(path) else None
+	return location
+
+class IncludeIndex():
+	'''
+	Remembers where mixins are and what they contain, so that a mixin shared by many
+	schemes (or compiled again and again) is only found and parsed once per session.
+	Files on disk are parsed again only when their modification time changes.
+	'''
+
+	def __init__(self):
+		# location -> Mixin
+		self.mixins = {}
+		# include path -> {name: resource}
+		self.packaged = {}
+		# (directory, scheme name, includes) -> (mixins loaded while resolving, names that couldn't be found)
+		self.orders = {}
+
+	def packaged_mixins(self, include_path):
+		''' Returns the mixins in the include directory, abstracting away differences between directory and .sublime_package format '''
+		if include_path not in self.packaged:
+			self.packaged[include_path] = dict((x[len(include_path):-5], x) for x in sublime.find_resources('*.json') if x.startswith(include_path))
+		return self.packaged[include_path]
+
+	def locate(self, name, directory, include_path):
+		''' Mixins next to the scheme take precedence over those in the include directory '''
+		path = os.path.join(directory, name + '.json')
+		if os.path.isfile(path):
+			return path
+		return self.packaged_mixins(include_path).get(name)
+
+	def load(self, name, location):
+		path = resource_file(location)
+		mtime = os.path.getmtime(path) if path else None
+
+		mixin = self.mixins.get(location)
+		if mixin is not None and mixin.mtime == mtime:
+			instrument.count("cache_hits")
+			return mixin
+		instrument.count("cache_misses")
+
+		if path:
+			with open(path, 'r') as f:
+				text = f.read()
+		else:
+			text = sublime.load_resource(location)
+
+		try:
+			entries = json.loads(text)
+		except ValueError:
+			sublime.status_message("%s.json is not a valid JSON file." % name)
+			entries = None
+
+		mixin = Mixin(name, location, mtime, entries, hashlib.sha1(text.encode('utf-8')).hexdigest())
+		self.mixins[location] = mixin
+		return mixin
+
+	def resolve(self, scheme_name, directory, includes, include_path):
+		'''
+		Returns the mixins a scheme depends on, directly or indirectly, in order of precedence.
+		'''
+		key = (directory, scheme_name, tuple(includes))
+		if key not in self.orders or not self.still_valid(self.orders[key], directory, include_path):
+			self.orders[key] = self.dependency_order(scheme_name, directory, includes, include_path)
+		order, _ = self.orders[key]
+		return [mixin for mixin in order if mixin.entries is not None]
+
+	def still_valid(self, resolved, directory, include_path):
+		''' A cached order stays valid as long as every mixin resolves to the same, unchanged file '''
+		order, missing = resolved
+		for mixin in order:
+			if self.locate(mixin.name, directory, include_path) != mixin.location:
+				return False
+			if self.load(mixin.name, mixin.location) is not mixin:
+				return False
+		return all(self.locate(name, directory, include_path) is None for name in missing)
+
+	def dependency_order(self, scheme_name, directory, includes, include_path):
+		'''
+		Walks the graph of mixin dependencies (the includes of each mixin) and linearises it:
+		depth-first, in the order the mixins are specified, each mixin once. Edges back to a
+		mixin that was already visited are dropped, which breaks circular dependencies.
+		Mixins that aren't valid JSON are kept in the order so that fixing them is noticed.
+		'''
+		order = []
+		missing = []
+		visited = set([scheme_name])
+		stack = list(reversed(includes))
+		while stack:
+			name = stack.pop()
+			if name in visited:
+				print("%s is already included." % (name))
+				continue
+			visited.add(name)
+
+			location = self.locate(name, directory, include_path)
+			if location is None:
+				print("Could not find %s." % (name))
+				missing.append(name)
+				continue
+
+			mixin = self.load(name, location)
+			order.append(mixin)
+			stack.extend(reversed(mixin.includes))
+
+		return order, missing
+
+# Shared by every compile in this session
+INDEX = IncludeIndex()
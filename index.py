@@ -0,0 +1,563 @@
+'''
+Keeps an index of where a scheme's keywords occur in a file, next to the file, so that
+jumping to a keyword's next occurrence or counting its occurrences is a lookup rather
+than a search through the whole file. From the command line:
+
+	python -m synesthesia.index SCHEME FILE [--counts N] [--next KEYWORD --from LINE:COLUMN]
+
+An occurrence is stored as a 64-bit number, line << COLUMN_BITS | column, so that
+occurrences sort in the order they appear in. The index is a directory of segments,
+each holding the occurrences in a range of the file's lines, and meta.json, which
+describes them. A segment is an array of such numbers:
+
+	n                    how many keywords occur in the segment
+	keywords             their indices, in order
+	starts               n + 1 offsets into occurrences, where each keyword's begin
+	occurrences          each keyword's, in order
+
+Segments are memory-mapped and searched by bisection. The file is scanned in chunks of
+about CHUNK_BYTES, in parallel. Only lines that have ended are indexed; when the file
+grows, the lines added are scanned into a new segment, and the segments are merged once
+there are more than SEGMENT_LIMIT. If the file was truncated or replaced, e.g. by log
+rotation, or the scheme's keywords changed, the index is built again.
+'''
+
+import os, json, mmap, time, hashlib, argparse, multiprocessing
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from . import compile
+from . import registry
+from .atomicfile import AtomicFile, write_if_changed
+from .matcher import Matcher
+from .jobs import QUEUE
+
+# Changes whenever the layout of the index does
+INDEX_VERSION = 1
+
+COLUMN_BITS = 24
+COLUMN_LIMIT = (1 << COLUMN_BITS) - 1
+
+# Bytes scanned by each worker at a time
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Segments beyond this are merged into one
+SEGMENT_LIMIT = 8
+
+# Bytes at the start of the file that must stay the same for the index to be updated rather than rebuilt
+HEAD_BYTES = 4096
+
+# Bytes read at a time looking back for the last line ending
+TAIL_BYTES = 64 * 1024
+
+META_NAME = "meta.json"
+
+# The matcher used by scan_chunk, set up by load_matcher in each worker
+worker_matcher = None
+
+def index_directory(path):
+	return path + ".synesthesia-index"
+
+def position_key(line, column):
+	return line << COLUMN_BITS | min(column, COLUMN_LIMIT)
+
+def key_position(key):
+	return key >> COLUMN_BITS, key & COLUMN_LIMIT
+
+def head_digest(path, length):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read(length)).hexdigest()
+
+def lines_end(path, begin, size):
+	''' Returns the offset just after the last line ending between begin and size, or begin if there is none '''
+	with open(path, 'rb') as f:
+		end = size
+		while end > begin:
+			start = max(end - TAIL_BYTES, begin)
+			f.seek(start)
+			found = f.read(end - start).rfind(b'\n')
+			if found != -1:
+				return start + found + 1
+			end = start
+	return begin
+
+def chunk_ranges(path, begin, end):
+	''' Splits the bytes from begin to end of a file into ranges of about CHUNK_BYTES, each ending after a line ending '''
+	ranges = []
+	with open(path, 'rb') as f:
+		while begin < end:
+			stop = begin + CHUNK_BYTES
+			if stop < end:
+				f.seek(stop)
+				stop += len(f.readline())
+			stop = min(stop, end)
+			ranges.append((begin, stop))
+			begin = stop
+	return ranges
+
+def scheme_keywords(scheme_path):
+	''' Returns the scheme's name and its keywords with the regex each is matched with, or None '''
+	loaded = compile.load_keywords(scheme_path)
+	if not loaded:
+		return None
+	theme_name, _, keywords = loaded
+	return theme_name, [(key, regex) for key, regex, _, _, _, _ in keywords]
+
+def load_matcher(scheme_path):
+	global worker_matcher
+	theme_name, keywords = scheme_keywords(scheme_path)
+	worker_matcher = Matcher([regex for _, regex in keywords])
+
+def scan_chunk(path, begin, end):
+	'''
+	Scans the lines from begin to end of a file. Returns how many there are and the
+	occurrences of each keyword in them, by keyword index, with lines counted from begin.
+	'''
+	with open(path, 'rb') as f:
+		f.seek(begin)
+		lines = f.read(end - begin).decode('utf-8', 'replace').split('\n')
+	# the range ends with a line ending, after which there is nothing
+	lines.pop()
+	found = {}
+	for number, line in enumerate(lines):
+		for start, _, pattern in worker_matcher.scan(line.rstrip('\r')):
+			found.setdefault(pattern, array('Q')).append(position_key(number, start))
+	return len(lines), found
+
+def write_segment(path, found):
+	''' Writes the occurrences of each keyword, a dict of arrays by keyword index, as a segment '''
+	keywords = sorted(found)
+	starts = array('Q', [0])
+	for pattern in keywords:
+		starts.append(starts[-1] + len(found[pattern]))
+	with AtomicFile(path) as f:
+		f.write(array('Q', [len(keywords)]).tobytes())
+		f.write(array('Q', keywords).tobytes())
+		f.write(starts.tobytes())
+		for pattern in keywords:
+			f.write(found[pattern].tobytes())
+
+class Segment():
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.numbers = memoryview(self.map).cast('Q')
+		n = self.numbers[0]
+		self.keywords = self.numbers[1:1 + n]
+		self.starts = self.numbers[1 + n:2 + 2 * n]
+		self.occurrences = self.numbers[2 + 2 * n:]
+
+	def find(self, pattern):
+		''' Returns the occurrences of a keyword, in order '''
+		i = bisect_left(self.keywords, pattern)
+		if i == len(self.keywords) or self.keywords[i] != pattern:
+			return self.occurrences[0:0]
+		return self.occurrences[self.starts[i]:self.starts[i + 1]]
+
+	def counts(self):
+		''' Yields (keyword index, occurrences) for each keyword in the segment '''
+		for i, pattern in enumerate(self.keywords):
+			yield pattern, self.starts[i + 1] - self.starts[i]
+
+	def close(self):
+		for view in (self.keywords, self.starts, self.occurrences, self.numbers):
+			view.release()
+		self.map.close()
+
+class Index():
+	''' An index opened for lookups '''
+
+	def __init__(self, directory, meta):
+		self.directory = directory
+		self.meta = meta
+		self.segments = [Segment(os.path.join(directory, segment["file"])) for segment in meta["segments"]]
+		self.keyword_index = None
+
+	@classmethod
+	def open(cls, path, directory=None):
+		''' Opens the index of the file at path, or returns None if it has none '''
+		directory = directory or index_directory(path)
+		meta = read_meta(directory)
+		return cls(directory, meta) if meta else None
+
+	def keyword(self, key):
+		''' The index of a keyword, or None if the scheme has no such keyword '''
+		if self.keyword_index is None:
+			self.keyword_index = dict((k, n) for n, k in reversed(list(enumerate(self.meta["keywords"]))))
+		return self.keyword_index.get(key)
+
+	def counts(self):
+		''' Returns the number of occurrences of each keyword that occurs, by keyword index '''
+		counts = {}
+		for segment in self.segments:
+			for pattern, n in segment.counts():
+				counts[pattern] = counts.get(pattern, 0) + n
+		return counts
+
+	def following(self, patterns, line, column, backwards=False):
+		'''
+		Returns the (line, column) of the nearest occurrence of any of the keywords after
+		the given position, or before it if backwards is set, going round from the other
+		end of the file if there is none. Returns None if they don't occur at all.
+		'''
+		key = position_key(line, column)
+		nearest = None
+		# the occurrence to go round to
+		outermost = None
+		for segment in self.segments:
+			for pattern in patterns:
+				occurrences = segment.find(pattern)
+				if not len(occurrences):
+					continue
+				if backwards:
+					i = bisect_left(occurrences, key)
+					if i > 0 and (nearest is None or occurrences[i - 1] > nearest):
+						nearest = occurrences[i - 1]
+					if outermost is None or occurrences[-1] > outermost:
+						outermost = occurrences[-1]
+				else:
+					i = bisect_right(occurrences, key)
+					if i < len(occurrences) and (nearest is None or occurrences[i] < nearest):
+						nearest = occurrences[i]
+					if outermost is None or occurrences[0] < outermost:
+						outermost = occurrences[0]
+		found = nearest if nearest is not None else outermost
+		return key_position(found) if found is not None else None
+
+	def close(self):
+		for segment in self.segments:
+			segment.close()
+		self.segments = []
+
+def read_meta(directory):
+	path = os.path.join(directory, META_NAME)
+	if not os.path.isfile(path):
+		return None
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			meta = json.load(f)
+	except ValueError:
+		print("%s is not a valid JSON file; the index will be built again." % path)
+		return None
+	return meta if meta.get("version") == INDEX_VERSION else None
+
+def keywords_digest(keywords):
+	digest = hashlib.sha1()
+	for key, regex in keywords:
+		digest.update(("%s\n%s\n" % (key, regex)).encode('utf-8'))
+	return digest.hexdigest()
+
+def is_stale(path, directory=None):
+	''' Whether lines were added to the file since its index was updated, or it has none '''
+	meta = read_meta(directory or index_directory(path))
+	if not meta or not os.path.isfile(path):
+		return True
+	size = os.path.getsize(path)
+	return size < meta["indexed_bytes"] or lines_end(path, meta["indexed_bytes"], size) > meta["indexed_bytes"]
+
+def merge_segments(directory, meta, name):
+	''' Merges the segments of an index into one segment, name '''
+	found = {}
+	segments = [Segment(os.path.join(directory, segment["file"])) for segment in meta["segments"]]
+	try:
+		for segment in segments:
+			for pattern, _ in segment.counts():
+				found.setdefault(pattern, array('Q')).frombytes(segment.find(pattern).tobytes())
+	finally:
+		for segment in segments:
+			segment.close()
+	write_segment(os.path.join(directory, name), found)
+	old = [segment["file"] for segment in meta["segments"]]
+	meta["segments"] = [{"file": name, "lines": meta["lines"]}]
+	return old
+
+def update(path, scheme_path, executor, directory=None, job=None):
+	'''
+	Brings the index of the file at path up to date with the file and the scheme at
+	scheme_path, scanning chunks on executor. The executor's workers must have had
+	load_matcher called with the scheme. Only lines added since the last update are
+	scanned, unless the index has to be built again. Stops between chunks if the job is
+	cancelled. Returns (meta, lines scanned, whether the index was built from scratch),
+	or None if the scheme can't be read.
+	'''
+	directory = directory or index_directory(path)
+	loaded = scheme_keywords(scheme_path)
+	if not loaded:
+		return None
+	theme_name, keywords = loaded
+	digest = keywords_digest(keywords)
+
+	size = os.path.getsize(path)
+	meta = read_meta(directory)
+	rebuilt = not meta or meta["keywords_digest"] != digest or size < meta["indexed_bytes"] or head_digest(path, meta["head_bytes"]) != meta["head"]
+	if rebuilt:
+		if meta:
+			print("%s changed since it was indexed; indexing it again." % path)
+		remove_index(directory)
+		compile.ensure_directory_exists(directory)
+		meta = {
+			"version": INDEX_VERSION,
+			"scheme": theme_name,
+			"keywords": [key for key, _ in keywords],
+			"keywords_digest": digest,
+			"indexed_bytes": 0,
+			"lines": 0,
+			"head_bytes": 0,
+			"head": head_digest(path, 0),
+			"segments": [],
+			"next_segment": 0,
+		}
+
+	begin = meta["indexed_bytes"]
+	end = lines_end(path, begin, size)
+	scanned = 0
+	# segments merged into another, to remove
+	old = []
+	if end > begin:
+		ranges = chunk_ranges(path, begin, end)
+		found = {}
+		first_line = meta["lines"]
+		line = first_line
+		results = executor.map(scan_chunk, [path] * len(ranges), [b for b, _ in ranges], [e for _, e in ranges])
+		for lines, chunk_found in results:
+			if job:
+				job.checkpoint("Indexing %s: %d lines..." % (os.path.basename(path), line))
+			shift = line << COLUMN_BITS
+			for pattern, occurrences in chunk_found.items():
+				found.setdefault(pattern, array('Q')).extend(key + shift for key in occurrences)
+			line += lines
+		scanned = line - first_line
+
+		name = "%d.bin" % meta["next_segment"]
+		meta["next_segment"] += 1
+		write_segment(os.path.join(directory, name), found)
+		meta["segments"].append({"file": name, "lines": scanned})
+		meta["lines"] = line
+		meta["indexed_bytes"] = end
+		meta["head_bytes"] = min(end, HEAD_BYTES)
+		meta["head"] = head_digest(path, meta["head_bytes"])
+
+		if len(meta["segments"]) > SEGMENT_LIMIT:
+			name = "%d.bin" % meta["next_segment"]
+			meta["next_segment"] += 1
+			old = merge_segments(directory, meta, name)
+
+	write_if_changed(os.path.join(directory, META_NAME), json.dumps(meta, indent=1))
+	# only removed once the new meta.json no longer refers to them
+	for name in old:
+		os.remove(os.path.join(directory, name))
+	return meta, scanned, rebuilt
+
+def remove_index(directory):
+	''' Removes an index's files, and nothing else that is in its directory '''
+	meta = read_meta(directory)
+	names = [META_NAME] + ([segment["file"] for segment in meta["segments"]] if meta else [])
+	names += [name for name in os.listdir(directory) if name.endswith(".bin")] if os.path.isdir(directory) else []
+	for name in set(names):
+		if os.path.isfile(os.path.join(directory, name)):
+			os.remove(os.path.join(directory, name))
+
+def describe(meta, scanned, rebuilt, seconds):
+	return "%s %d lines in %.2fs; %d indexed with %s." % ("Indexed" if rebuilt else "Added", scanned, seconds, meta["lines"], meta["scheme"])
+
+# file path -> Index open for lookups, reopened when meta.json changes
+OPEN_INDEXES = {}
+
+def open_index(path):
+	''' Returns the index of the file at path, opened once and kept open until it changes '''
+	meta_path = os.path.join(index_directory(path), META_NAME)
+	if not os.path.isfile(meta_path):
+		return None
+	mtime = os.path.getmtime(meta_path)
+	cached = OPEN_INDEXES.get(path)
+	if cached and cached[0] == mtime:
+		return cached[1]
+	close_index(path)
+	index = Index.open(path)
+	if index:
+		OPEN_INDEXES[path] = (mtime, index)
+	return index
+
+def close_index(path):
+	cached = OPEN_INDEXES.pop(path, None)
+	if cached:
+		cached[1].close()
+
+def update_in_background(view, scheme, then=None):
+	''' Updates the index of the view's file with a generated scheme, then calls then(index) on the main thread '''
+	path = view.file_name()
+	schemes = registry.read(compile.SYNESTHESIA_OUTPUT_PATH)
+	source = scheme in schemes and schemes[scheme].get("source")
+	if not source or not os.path.isfile(source):
+		sublime.status_message("The source of %s can't be found." % scheme)
+		return
+
+	def work(job):
+		start = time.perf_counter()
+		# the index's files can't be replaced while they are mapped, on some platforms
+		close_index(path)
+		# Sublime's plugin host can't start worker processes, so the workers are threads
+		load_matcher(source)
+		with ThreadPoolExecutor(multiprocessing.cpu_count()) as executor:
+			result = update(path, source, executor, job=job)
+		if result is None:
+			sublime.status_message("%s could not be indexed." % os.path.basename(path))
+			return
+		message = describe(*(result + (time.perf_counter() - start,)))
+		print("%s: %s" % (path, message))
+		sublime.status_message(message)
+		view.settings().set("synesthesia_index_scheme", scheme)
+		if then:
+			sublime.set_timeout(lambda: then(open_index(path)), 0)
+
+	QUEUE.submit("index %s" % path, work)
+
+def with_index(view, then):
+	''' Calls then(index) with the view's file's index, updated first if lines were added to the file '''
+	path = view.file_name()
+	scheme = view.settings().get("synesthesia_index_scheme")
+	if not path or not scheme:
+		sublime.status_message("Index the file with Synesthesia: Index Keywords in File first.")
+		return
+	if is_stale(path):
+		update_in_background(view, scheme, then)
+	else:
+		then(open_index(path))
+
+def jump(view, index, patterns, backwards=False):
+	if not index:
+		return
+	caret = view.sel()[0].b if len(view.sel()) else 0
+	line, column = view.rowcol(caret)
+	found = index.following(patterns, line, column, backwards)
+	if found is None:
+		sublime.status_message("No occurrences in %s." % os.path.basename(view.file_name()))
+		return
+	point = view.text_point(*found)
+	view.sel().clear()
+	view.sel().add(sublime.Region(point))
+	view.show_at_center(point)
+
+class SynesthesiaIndexCommand(sublime_plugin.WindowCommand):
+	''' Indexes where a generated scheme's keywords occur in the active file, or brings its index up to date '''
+
+	def run(self, scheme=None):
+		view = self.window.active_view()
+		if not view or not view.file_name():
+			sublime.status_message("Save the file before indexing it.")
+			return
+		if scheme is None:
+			scheme = view.settings().get("synesthesia_index_scheme")
+		if scheme is None:
+			names = sorted(registry.read(compile.SYNESTHESIA_OUTPUT_PATH))
+			if not names:
+				sublime.status_message("No highlighting schemes have been generated.")
+				return
+
+			def done(which):
+				if which != -1:
+					self.window.run_command("synesthesia_index", {"scheme": names[which]})
+
+			self.window.show_quick_panel(names, done)
+			return
+		update_in_background(view, scheme)
+
+class SynesthesiaIndexKeywordsCommand(sublime_plugin.TextCommand):
+	''' Lists the keywords occurring in the file by how often they do; picking one jumps to it '''
+
+	def run(self, edit):
+		view = self.view
+
+		def show(index):
+			if not index:
+				return
+			counts = sorted(index.counts().items(), key=lambda item: (-item[1], item[0]))
+			if not counts:
+				sublime.status_message("No keywords occur in %s." % os.path.basename(view.file_name()))
+				return
+			items = [[index.meta["keywords"][pattern], "%d occurrences" % n] for pattern, n in counts]
+
+			def done(which):
+				if which != -1:
+					key = index.meta["keywords"][counts[which][0]]
+					view.settings().set("synesthesia_index_keywords", [key])
+					view.run_command("synesthesia_index_jump", {"keywords": [key]})
+
+			view.window().show_quick_panel(items, done)
+
+		with_index(view, show)
+
+class SynesthesiaIndexJumpCommand(sublime_plugin.TextCommand):
+	'''
+	Moves to the next occurrence of the given keywords, or the previous one if backwards
+	is set. Without keywords, those last picked from the keyword list are used.
+	'''
+
+	def run(self, edit, keywords=None, backwards=False):
+		view = self.view
+		keywords = keywords or view.settings().get("synesthesia_index_keywords")
+		if not keywords:
+			view.run_command("synesthesia_index_keywords")
+			return
+
+		def go(index):
+			if not index:
+				return
+			patterns = [index.keyword(key) for key in keywords]
+			unknown = [key for key, pattern in zip(keywords, patterns) if pattern is None]
+			if unknown:
+				sublime.status_message("%s has no keyword %s." % (index.meta["scheme"], ', '.join(unknown)))
+			jump(view, index, [pattern for pattern in patterns if pattern is not None], backwards)
+
+		with_index(view, go)
+
+def parse_position(text):
+	''' Reads LINE:COLUMN, counted from 1, as (line, column) counted from 0 '''
+	line, _, column = text.partition(':')
+	return int(line) - 1, int(column or 1) - 1
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.index", description="Index where a highlighting scheme's keywords occur in a file, and look them up.")
+	parser.add_argument("scheme", help="highlighting scheme JSON file")
+	parser.add_argument("file", help="file to index")
+	parser.add_argument("--jobs", type=int, default=None, help="number of worker processes (default: one per core)")
+	parser.add_argument("--counts", type=int, metavar="N", help="list the N keywords occurring most often")
+	parser.add_argument("--next", metavar="KEYWORD", action="append", help="print where the next occurrence of KEYWORD is; may be given more than once")
+	parser.add_argument("--previous", action="store_true", help="look for the previous occurrence instead")
+	parser.add_argument("--from", dest="position", default="1:1", help="position to look from, as LINE:COLUMN (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	compile.configure_headless(os.getcwd())
+	start = time.perf_counter()
+	with ProcessPoolExecutor(args.jobs, initializer=load_matcher, initargs=(args.scheme,)) as executor:
+		result = update(args.file, args.scheme, executor)
+	if result is None:
+		return 1
+	print(describe(*(result + (time.perf_counter() - start,))))
+
+	index = Index.open(args.file)
+	try:
+		if args.counts:
+			counts = sorted(index.counts().items(), key=lambda item: (-item[1], item[0]))
+			for pattern, n in counts[:args.counts]:
+				print("%10d  %s" % (n, index.meta["keywords"][pattern]))
+		if args.next:
+			patterns = [index.keyword(key) for key in args.next]
+			if None in patterns:
+				print("%s has no keyword %s." % (index.meta["scheme"], ', '.join(key for key, p in zip(args.next, patterns) if p is None)))
+				return 1
+			found = index.following(patterns, *parse_position(args.position), backwards=args.previous)
+			print("%d:%d" % (found[0] + 1, found[1] + 1) if found else "No occurrences.")
+	finally:
+		index.close()
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main())
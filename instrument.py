@@ -0,0 +1,141 @@
+'''
+Records what each compile spends its time on: how long each stage took, how many
+keywords and patterns it handled, what it wrote and how often caches saved work.
+
+Every compile collects a Report on the thread it runs on. The compiler marks where its
+stages begin and counts things as it goes; outside a compile, these calls do nothing.
+Finished reports are printed as a one-line summary and passed to every listener, e.g.
+
+	from synesthesia import instrument
+	instrument.add_listener(lambda report: send_to_metrics(report.to_dict()))
+'''
+
+import os, time, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class Report():
+	def __init__(self, scheme):
+		self.scheme = scheme
+		# "generated", "up to date", "failed" or "cancelled"
+		self.outcome = "failed"
+		# stage -> seconds, in the order the stages began
+		self.stages = OrderedDict()
+		# counter -> count
+		self.counters = {}
+		# (path, bytes, changed, seconds spent writing it) for each file written or left as it was
+		self.artifacts = []
+		self.seconds = 0.0
+		self.stage = None
+		self.stage_start = None
+
+	def begin(self, stage):
+		now = time.perf_counter()
+		self.end(now)
+		self.stage = stage
+		self.stage_start = now
+
+	def end(self, now=None):
+		if self.stage is not None:
+			now = now or time.perf_counter()
+			self.stages[self.stage] = self.stages.get(self.stage, 0.0) + now - self.stage_start
+			self.stage = None
+
+	def count(self, counter, n=1):
+		self.counters[counter] = self.counters.get(counter, 0) + n
+
+	def to_dict(self):
+		return {
+			"scheme": self.scheme,
+			"outcome": self.outcome,
+			"seconds": self.seconds,
+			"stages": OrderedDict(self.stages),
+			"counters": dict(self.counters),
+			"artifacts": [{"path": path, "bytes": size, "changed": changed, "seconds": seconds} for path, size, changed, seconds in self.artifacts],
+		}
+
+	def summary(self):
+		''' Describes the report in a line, leaving out stages too quick to show and counters that are zero '''
+		stages = ', '.join("%s %.2fs" % (stage, seconds) for stage, seconds in self.stages.items() if seconds >= 0.005)
+		counts = ["%d %s" % (n, counter.replace('_', ' ')) for counter, n in sorted(self.counters.items()) if n]
+		written = sum(size for _, size, changed, _ in self.artifacts if changed)
+		if self.artifacts:
+			counts.append("%d of %d files written (%s)" % (sum(1 for a in self.artifacts if a[2]), len(self.artifacts), format_bytes(written)))
+		line = "%s %s in %.2fs" % (self.scheme, self.outcome, self.seconds)
+		if stages:
+			line += " (%s)" % stages
+		if counts:
+			line += "; %s" % ', '.join(counts)
+		return line + "."
+
+def format_bytes(n):
+	for unit in ["bytes", "KB", "MB"]:
+		if n < 1024 or unit == "MB":
+			return ("%d %s" if unit == "bytes" else "%.1f %s") % (n, unit)
+		n /= 1024.0
+
+# The report of the compile running on each thread
+local = threading.local()
+
+# Called with every finished Report
+listeners = []
+
+def add_listener(callback):
+	listeners.append(callback)
+
+def remove_listener(callback):
+	if callback in listeners:
+		listeners.remove(callback)
+
+def current():
+	return getattr(local, "report", None)
+
+def last_report():
+	''' The report of the last compile that finished on this thread '''
+	return getattr(local, "last", None)
+
+@contextmanager
+def compiling(scheme):
+	''' Collects a Report of whatever happens on this thread inside the block, then hands it to the listeners '''
+	report = Report(scheme)
+	previous = current()
+	local.report = report
+	start = time.perf_counter()
+	try:
+		yield report
+	finally:
+		report.end()
+		report.seconds = time.perf_counter() - start
+		local.report = previous
+		local.last = report
+		for listener in list(listeners):
+			try:
+				listener(report)
+			except Exception as e:
+				print("Instrumentation listener failed: %s" % e)
+
+def begin(stage):
+	''' Marks the start of a stage, which lasts until the next one begins or the compile ends '''
+	report = current()
+	if report is not None:
+		report.begin(stage)
+
+def count(counter, n=1):
+	report = current()
+	if report is not None:
+		report.count(counter, n)
+
+def counted(entries, counter):
+	''' Passes entries through, counting them once they run out '''
+	n = 0
+	try:
+		for entry in entries:
+			n += 1
+			yield entry
+	finally:
+		count(counter, n)
+
+def artifact(path, changed, seconds=0.0):
+	report = current()
+	if report is not None:
+		report.artifacts.append((path, os.path.getsize(path) if os.path.isfile(path) else 0, changed, seconds))
@@ -0,0 +1,82 @@
+'''
+Runs compiles off the UI thread, on Sublime's async thread, so that compiling a large
+scheme doesn't freeze the editor.
+'''
+
+import threading
+
+try:
+	import sublime
+except ImportError:
+	from . import headless as sublime
+
+class Cancelled(Exception):
+	''' Raised at a checkpoint of a job that has been superseded '''
+	pass
+
+class Job():
+	def __init__(self, key, work):
+		self.key = key
+		self.work = work
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+	def checkpoint(self, message=None):
+		''' Stops the job if it was cancelled, otherwise reports its progress in the status bar '''
+		if self.cancelled:
+			raise Cancelled()
+		if message:
+			sublime.status_message(message)
+
+class JobQueue():
+	'''
+	Jobs are keyed, e.g. by the scheme they compile. Submitting a job for a key that
+	already has one waiting replaces the waiting one, and a job that is already running
+	is cancelled at its next checkpoint, so a burst of submissions results in exactly one
+	job running to completion: the last.
+	'''
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		# key -> Job not started yet
+		self.pending = {}
+		# key -> Job in progress
+		self.running = {}
+
+	def submit(self, key, work):
+		''' Schedules work(job) to run in the background. Returns the job. '''
+		job = Job(key, work)
+		with self.lock:
+			if key in self.running:
+				self.running[key].cancel()
+			replaced = self.pending.get(key)
+			if replaced is not None:
+				replaced.cancel()
+			self.pending[key] = job
+		# a replaced job was already scheduled, and that run will pick this one up instead
+		if replaced is None:
+			sublime.set_timeout_async(lambda: self.run(key), 0)
+		return job
+
+	def run(self, key):
+		with self.lock:
+			job = self.pending.pop(key, None)
+			if job is None:
+				return
+			self.running[key] = job
+		try:
+			job.work(job)
+		except Cancelled:
+			print("%s was superseded by a newer job." % key)
+		except Exception as e:
+			print("%s failed: %s" % (key, e))
+			sublime.status_message("Synesthesia: %s failed." % key)
+		finally:
+			with self.lock:
+				if self.running.get(key) is job:
+					del self.running[key]
+
+# Shared by every command in this session
+QUEUE = JobQueue()
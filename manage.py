@@ -0,0 +1,42 @@
+import sublime, sublime_plugin
+import os
+from . import compile
+from . import registry
+
+class SynesthesiaListCommand(sublime_plugin.WindowCommand):
+	''' Lists the generated highlighting schemes; selecting one opens its source '''
+
+	def run(self):
+		schemes = registry.read(compile.SYNESTHESIA_OUTPUT_PATH)
+		names = sorted(schemes)
+		if not names:
+			sublime.status_message("No highlighting schemes have been generated.")
+			return
+
+		items = [[name, schemes[name].get("source") or "source unknown", "%s, %d files" % (schemes[name].get("format", "tmLanguage"), len(schemes[name].get("artifacts", [])))] for name in names]
+
+		def done(which):
+			if which == -1:
+				return
+			source = schemes[names[which]].get("source")
+			if source and os.path.isfile(source):
+				self.window.open_file(source)
+			else:
+				sublime.status_message("The source of %s can't be found." % names[which])
+
+		self.window.show_quick_panel(items, done)
+
+class SynesthesiaCleanUpCommand(sublime_plugin.WindowCommand):
+	''' Forgets schemes whose files were all deleted, and reports those whose source is gone '''
+
+	def run(self):
+		directory = compile.SYNESTHESIA_OUTPUT_PATH
+		for name in registry.prune(directory):
+			print("%s has no files left; forgotten." % name)
+
+		schemes = registry.read(directory)
+		orphans = sorted(name for name, entry in schemes.items() if entry.get("source") and not os.path.isfile(entry["source"]))
+		for name in orphans:
+			print("The source of %s, %s, no longer exists. It can be removed with Remove Highlighting Scheme." % (name, schemes[name]["source"]))
+
+		sublime.status_message("Highlighting schemes cleaned up; %d without a source." % len(orphans))
@@ -0,0 +1,327 @@
+'''
+Applies a scheme's keyword patterns to lines of text the way Sublime does, with
+Python's re module instead of Oniguruma: at each point, the pattern that matches
+earliest wins, and of those matching at the same place, the first one.
+
+Patterns that only ever match a fixed text, optionally between word boundaries or
+regardless of case, are found all at once by an Aho–Corasick automaton, in a single
+pass over the line however many of them there are. The rest are joined into
+alternations of up to CHUNK_SIZE members, each member in a capture group of its own, so
+that which one matched can be told from the match's lastindex. Patterns that refer to
+their own groups are searched for on their own.
+'''
+
+import re
+
+from .dispatch import capture_groups
+
+# Patterns joined into a single regex
+CHUNK_SIZE = 500
+
+# Fewer literals than this are cheaper to match as regexes than with an automaton
+AUTOMATON_MIN = 32
+
+# Patterns that can't be matched listed in the console, at most
+FAILED_REPORT_LIMIT = 20
+
+# Characters that mean something other than themselves in a regex
+SPECIAL = set('\\.^$*+?()[]{}|')
+
+def is_word(c):
+	return c.isalnum() or c == '_'
+
+def is_boundary(line, i):
+	''' Whether \\b holds before line[i] '''
+	return (i > 0 and is_word(line[i - 1])) != (i < len(line) and is_word(line[i]))
+
+def is_ascii(text):
+	if hasattr(text, 'isascii'):
+		return text.isascii()
+	return all(ord(c) < 128 for c in text)
+
+def literal_text(regex):
+	'''
+	Returns (text, case_insensitive, starts with \\b, ends with \\b) if regex only ever
+	matches a fixed text, or None.
+	'''
+	case_insensitive = regex.startswith('(?i:') and regex.endswith(')')
+	if case_insensitive:
+		regex = regex[4:-1]
+	start = regex.startswith('\\b')
+	if start:
+		regex = regex[2:]
+	end = False
+	text = []
+	i = 0
+	while i < len(regex):
+		c = regex[i]
+		if c == '\\':
+			following = regex[i + 1:i + 2]
+			if following == 'b' and i + 2 == len(regex):
+				end = True
+			elif not following or following.isalnum():
+				return None
+			else:
+				text.append(following)
+			i += 2
+		elif c in SPECIAL:
+			return None
+		else:
+			text.append(c)
+			i += 1
+	text = ''.join(text)
+	if not text or case_insensitive and not is_ascii(text):
+		# only ASCII is folded, which keeps lowered lines the same length
+		return None
+	return text, case_insensitive, start, end
+
+class Automaton():
+	''' An Aho–Corasick automaton, finding every occurrence of a set of texts in one pass '''
+
+	def __init__(self):
+		# state -> character -> state
+		self.goto = [{}]
+		# state -> state to carry on from when a character has no transition
+		self.fail = [0]
+		# state -> (pattern, length) of the texts that end there
+		self.ends = [[]]
+		# state -> nearest state along the fail links that some text ends at
+		self.link = [0]
+		self.texts = 0
+
+	def add(self, text, pattern):
+		state = 0
+		for c in text:
+			following = self.goto[state].get(c)
+			if following is None:
+				following = self.goto[state][c] = len(self.goto)
+				self.goto.append({})
+				self.fail.append(0)
+				self.ends.append([])
+				self.link.append(0)
+			state = following
+		self.ends[state].append((pattern, len(text)))
+		self.texts += 1
+
+	def finish(self):
+		''' Works out the fail links, once every text has been added '''
+		queue = list(self.goto[0].values())
+		for state in queue:
+			for c, following in self.goto[state].items():
+				fallback = self.fail[state]
+				while fallback and c not in self.goto[fallback]:
+					fallback = self.fail[fallback]
+				fail = self.goto[fallback].get(c, 0)
+				self.fail[following] = fail
+				self.link[following] = fail if self.ends[fail] else self.link[fail]
+				queue.append(following)
+
+	def occurrences(self, text):
+		'''
+		Returns (end, state) wherever some text ends in text, with end the index of the
+		character after it and state one that texts_ending_at can list them from.
+		'''
+		goto, fail, ends, link = self.goto, self.fail, self.ends, self.link
+		found = []
+		state = 0
+		end = 0
+		for c in text:
+			end += 1
+			following = goto[state].get(c)
+			while following is None and state:
+				state = fail[state]
+				following = goto[state].get(c)
+			if following is None:
+				continue
+			state = following
+			if ends[state]:
+				found.append((end, state))
+			elif link[state]:
+				found.append((end, link[state]))
+		return found
+
+	def texts_ending_at(self, state):
+		''' Yields (pattern, length) of the texts ending at a state, the longest first '''
+		while state:
+			for ending in self.ends[state]:
+				yield ending
+			state = self.link[state]
+
+class Literals():
+	''' Finds the matches of the patterns that only match fixed texts '''
+
+	def __init__(self):
+		self.exact = Automaton()
+		# texts of case-insensitive patterns, lowercased
+		self.folded = Automaton()
+		# pattern -> (starts with \b, ends with \b)
+		self.boundaries = {}
+
+	def __len__(self):
+		return len(self.boundaries)
+
+	def add(self, pattern, text, case_insensitive, start, end):
+		if case_insensitive:
+			self.folded.add(text.lower(), pattern)
+		else:
+			self.exact.add(text, pattern)
+		self.boundaries[pattern] = (start, end)
+
+	def finish(self):
+		self.exact.finish()
+		self.folded.finish()
+
+	def matches(self, line, folded=True):
+		'''
+		Returns (start, pattern, end) for each position of the line a pattern matches at,
+		the first pattern if several do, in order. Case-insensitive patterns are only
+		looked for if folded is set.
+		'''
+		first = {}
+		searches = [(self.exact, line)] if self.exact.texts else []
+		if folded and self.folded.texts:
+			searches.append((self.folded, line.lower()))
+		for automaton, text in searches:
+			for stop, state in automaton.occurrences(text):
+				for pattern, length in automaton.texts_ending_at(state):
+					start = stop - length
+					if start in first and first[start][0] < pattern:
+						continue
+					starts_at_boundary, ends_at_boundary = self.boundaries[pattern]
+					if starts_at_boundary and not is_boundary(line, start) or ends_at_boundary and not is_boundary(line, stop):
+						continue
+					first[start] = (pattern, stop)
+		return [(start, pattern, stop) for start, (pattern, stop) in sorted(first.items())]
+
+class Scanner():
+	def __init__(self, regex, members=None, single=None):
+		self.regex = regex
+		# group number -> index of the pattern, if the regex joins several
+		self.members = members
+		# index of the pattern otherwise
+		self.single = single
+
+	def pattern(self, match):
+		return self.members[match.lastindex] if self.members else self.single
+
+class Matcher():
+	def __init__(self, regexes):
+		''' Takes the regexes of the patterns in order of precedence '''
+		self.literals = Literals()
+		# (regex, error) for each pattern Python can't compile, which is left out
+		self.failed = []
+
+		# case-insensitive or not -> (index, literal_text) of the literals
+		literals = {False: [], True: []}
+		others = []
+		for n, regex in enumerate(regexes):
+			literal = literal_text(regex)
+			if literal is None:
+				others.append(n)
+			else:
+				literals[literal[1]].append((n, literal))
+		for case_insensitive in literals:
+			if len(literals[case_insensitive]) < AUTOMATON_MIN:
+				others += [n for n, _ in literals[case_insensitive]]
+				literals[case_insensitive] = []
+			for n, literal in literals[case_insensitive]:
+				self.literals.add(n, *literal)
+		self.literals.finish()
+		self.scanners = self.compile_scanners(sorted(others), regexes)
+		# the case-insensitive literals again, for lines the automaton can't fold
+		self.folded_scanners = self.compile_scanners([n for n, _ in literals[True]], regexes)
+
+	def report_failed(self, theme_name, where):
+		if not self.failed:
+			return
+		print("%s: %d patterns can't be matched %s and are left out:" % (theme_name, len(self.failed), where))
+		for regex, error in self.failed[:FAILED_REPORT_LIMIT]:
+			print("    %s (%s)" % (regex, error))
+		if len(self.failed) > FAILED_REPORT_LIMIT:
+			print("    and %d more." % (len(self.failed) - FAILED_REPORT_LIMIT))
+
+	def compile_scanners(self, indices, regexes):
+		scanners = []
+		chunk = []
+		for n in indices:
+			if capture_groups(regexes[n]) is None:
+				self.add_chunk(scanners, chunk, regexes)
+				chunk = []
+				self.add_single(scanners, n, regexes[n])
+				continue
+			chunk.append(n)
+			if len(chunk) == CHUNK_SIZE:
+				self.add_chunk(scanners, chunk, regexes)
+				chunk = []
+		self.add_chunk(scanners, chunk, regexes)
+		return scanners
+
+	def add_single(self, scanners, n, regex):
+		try:
+			scanners.append(Scanner(re.compile(regex), single=n))
+		except re.error as e:
+			self.failed.append((regex, str(e)))
+
+	def add_chunk(self, scanners, chunk, regexes):
+		if not chunk:
+			return
+		if len(chunk) == 1:
+			self.add_single(scanners, chunk[0], regexes[chunk[0]])
+			return
+		members = {}
+		number = 1
+		for n in chunk:
+			members[number] = n
+			number += 1 + capture_groups(regexes[n])
+		try:
+			regex = re.compile('|'.join("(%s)" % regexes[n] for n in chunk))
+		except re.error:
+			# find the patterns at fault, and join the rest without them
+			good = []
+			for n in chunk:
+				try:
+					re.compile(regexes[n])
+					good.append(n)
+				except re.error as e:
+					self.failed.append((regexes[n], str(e)))
+			if len(good) < len(chunk):
+				self.add_chunk(scanners, good, regexes)
+			else:
+				for n in good:
+					self.add_single(scanners, n, regexes[n])
+			return
+		scanners.append(Scanner(regex, members=members))
+
+	def scan(self, line):
+		''' Yields (start, end, pattern index) for each match in a line, left to right '''
+		ascii = is_ascii(line)
+		scanners = self.scanners if ascii else self.scanners + self.folded_scanners
+		literals = self.literals.matches(line, ascii) if len(self.literals) else []
+		next_literal = 0
+		# each scanner's next match from where the last match ended, or None once it has no more
+		upcoming = [False] * len(scanners)
+		position = 0
+		while position <= len(line):
+			# (start, pattern, end) of the best match so far
+			best = None
+			for n, scanner in enumerate(scanners):
+				match = upcoming[n]
+				if match is False or match is not None and match.start() < position:
+					match = upcoming[n] = scanner.regex.search(line, position)
+				if match is not None:
+					candidate = (match.start(), scanner.pattern(match), match.end())
+					if best is None or candidate < best:
+						best = candidate
+			while next_literal < len(literals) and literals[next_literal][0] < position:
+				next_literal += 1
+			if next_literal < len(literals) and (best is None or literals[next_literal] < best):
+				best = literals[next_literal]
+			if best is None:
+				return
+			start, pattern, end = best
+			if end > start:
+				yield start, end, pattern
+				position = end
+			else:
+				# an empty match doesn't highlight anything, but the scan moves on past it
+				position = start + 1
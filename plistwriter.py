@@ -0,0 +1,14 @@
+import uuid
+from xml.sax.saxutils import escape
+from .atomicfile import TemplateStream
+
+class PlistStream(TemplateStream):
+	'''
+	A plist document written to a buffered file piece by piece, as its entries are generated,
+	so that a large document never has to be held in memory as a whole.
+	Values from user input must be passed through escape before they are written.
+	'''
+
+	def content_uuid(self):
+		''' A UUID derived from everything written so far, so that the same contents always get the same UUID '''
+		return uuid.UUID(bytes=self.hash.digest()[:16], version=5)
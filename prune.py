@@ -0,0 +1,209 @@
+'''
+Finds keywords that can never be highlighted because an earlier keyword always matches
+wherever they do.
+
+Sublime tries a context's patterns at each position and takes the match that starts
+first, and of those that start at the same place, the pattern listed first. So a pattern
+that only ever matches where an earlier one also matches never wins, and costs a match
+attempt at every position for nothing.
+
+Patterns are summarised as the literal text each of their alternatives has to start
+with, and whether that text is all of the alternative, or is followed by a word
+boundary, or by something else. Only patterns built from literals, groups, alternation
+and \\b are understood; anything else is never reported, so what is reported is certain.
+'''
+
+import re
+
+from .regexcost import tokenise_atom, read_quantifier
+
+# What follows an alternative's text: nothing, a word boundary, or anything else
+COMPLETE, BOUNDARY, OPEN_ENDED = range(3)
+
+# Patterns with more alternatives than this, once groups are multiplied out, are left alone
+MAX_ALTERNATIVES = 256
+
+# Characters that mean something other than themselves outside a character class
+SPECIAL = set('.^$')
+
+class Unsupported(Exception):
+	pass
+
+def is_word(c):
+	return c.isalnum() or c == '_'
+
+def boundary(path):
+	''' Appends \\b to an alternative given as (starts with \\b, text, what follows) '''
+	start, text, end = path
+	if end == OPEN_ENDED:
+		return path
+	if not text:
+		return True, text, end
+	return start, text, BOUNDARY
+
+def literal(path, c):
+	start, text, end = path
+	if end == COMPLETE:
+		return start, text + c, COMPLETE
+	if end == BOUNDARY and is_word(text[-1]) != is_word(c):
+		# the boundary is between two known characters, and holds
+		return start, text + c, COMPLETE
+	return start, text, OPEN_ENDED
+
+def open_ended(path):
+	return path[0], path[1], OPEN_ENDED
+
+def concatenate(path, sub):
+	if sub[0]:
+		path = boundary(path)
+	for c in sub[1]:
+		path = literal(path, c)
+	if sub[2] == BOUNDARY:
+		return boundary(path)
+	if sub[2] == OPEN_ENDED:
+		return open_ended(path)
+	return path
+
+def repeat_minimum(regex, i):
+	''' How many times the quantifier at regex[i] requires what it follows to match '''
+	if regex[i] in '*?':
+		return 0
+	if regex[i] == '+':
+		return 1
+	return int(re.match(r'\{(\d*)', regex[i:]).group(1) or 0)
+
+def parse_alternation(regex, i):
+	''' Returns the alternatives of the alternation starting at regex[i], and the index of the ) or end after it '''
+	alternatives = []
+	paths = [(False, '', COMPLETE)]
+	while i < len(regex) and regex[i] != ')':
+		c = regex[i]
+		if c == '|':
+			alternatives += paths
+			paths = [(False, '', COMPLETE)]
+			i += 1
+			continue
+
+		if c == '(':
+			prefix = re.match(r'\((?:\?(?:[=!:>]|<=|<!|<[A-Za-z_]\w*>|P<[A-Za-z_]\w*>|[imsx-]+:|[imsx-]+\)))?', regex[i:]).group(0)
+			if prefix.endswith(')'):
+				# inline flags change how everything after them matches
+				raise Unsupported()
+			sub, i = parse_alternation(regex, i + len(prefix))
+			if i >= len(regex):
+				raise Unsupported()
+			i += 1
+			# only plain and named groups match exactly what their alternatives do
+			transparent = prefix in ('(', '(?:') or prefix.startswith('(?<') and prefix[3] not in '=!' or prefix.startswith('(?P<')
+			if not transparent:
+				sub = [(False, '', OPEN_ENDED)]
+		elif regex.startswith('\\b', i):
+			sub = [(True, '', COMPLETE)]
+			i += 2
+		else:
+			atom, i = tokenise_atom(regex, i)
+			if len(atom) == 1 and atom not in SPECIAL:
+				sub = [(False, atom, COMPLETE)]
+			elif len(atom) == 2 and atom[0] == '\\' and not atom[1].isalnum():
+				sub = [(False, atom[1], COMPLETE)]
+			else:
+				sub = [(False, '', OPEN_ENDED)]
+
+		if read_quantifier(regex, i):
+			optional = repeat_minimum(regex, i) == 0
+			i = read_quantifier(regex, i)[2]
+			if optional:
+				sub = [(False, '', OPEN_ENDED)]
+			else:
+				# matched at least once, but what comes after the first time is unknown
+				sub = [open_ended(s) if s[1] else (False, '', OPEN_ENDED) for s in sub]
+
+		paths = list(set(concatenate(path, s) for path in paths for s in sub))
+		if len(paths) > MAX_ALTERNATIVES:
+			raise Unsupported()
+	return alternatives + paths, i
+
+def summarise(regex):
+	'''
+	Returns (case_insensitive, alternatives) for a regex, where each alternative is
+	(starts with \\b, text it starts with, what follows the text), or None if the regex
+	isn't understood.
+	'''
+	case_insensitive = False
+	if regex.startswith('(?i:') and regex.endswith(')'):
+		case_insensitive = True
+		regex = regex[4:-1]
+	try:
+		alternatives, i = parse_alternation(regex, 0)
+	except Unsupported:
+		return None
+	if i != len(regex):
+		# an unbalanced ), which means the (?i: wasn't around the whole regex
+		return None
+	return case_insensitive, alternatives
+
+def is_caseless(text):
+	return text.lower() == text.upper()
+
+class Index():
+	''' Alternatives of the patterns seen so far, by their text '''
+
+	def __init__(self):
+		self.exact = {}
+		# text of case-insensitive patterns, lowercased
+		self.folded = {}
+
+	def add(self, key, case_insensitive, alternatives):
+		for start, text, end in alternatives:
+			# an alternative followed by anything might not match, so it can't cover others
+			if text and end != OPEN_ENDED:
+				if case_insensitive:
+					self.folded.setdefault(text.lower(), []).append((start, end, key))
+				else:
+					self.exact.setdefault(text, []).append((start, end, key))
+
+	def covering(self, case_insensitive, alternative):
+		''' Returns the key of a pattern that matches wherever alternative does, or None '''
+		start, text, end = alternative
+		for n in range(1, len(text) + 1):
+			prefix = text[:n]
+			candidates = self.folded.get(prefix.lower(), [])
+			if not case_insensitive or is_caseless(prefix):
+				candidates = self.exact.get(prefix, []) + candidates
+			for other_start, other_end, key in candidates:
+				if other_start and not start:
+					continue
+				if other_end == COMPLETE:
+					return key
+				if n < len(text):
+					if is_word(text[n - 1]) != is_word(text[n]):
+						return key
+				elif end == BOUNDARY:
+					return key
+		return None
+
+def shadowed_keywords(patterns):
+	'''
+	Takes (key, regex) pairs in the order they are matched in and returns a (key, reason)
+	pair for each key that can never win a match.
+	'''
+	index = Index()
+	# regex -> first key with it
+	seen = {}
+	shadowed = []
+	for key, regex in patterns:
+		if regex in seen:
+			shadowed.append((key, "same pattern as %s" % seen[regex]))
+			continue
+		seen[regex] = key
+
+		summary = summarise(regex)
+		if summary is None:
+			continue
+		case_insensitive, alternatives = summary
+		covering = [index.covering(case_insensitive, alternative) for alternative in alternatives]
+		if alternatives and None not in covering:
+			shadowed.append((key, "always matched first by %s" % ', '.join(sorted(set(covering)))))
+		else:
+			index.add(key, case_insensitive, alternatives)
+	return shadowed
@@ -0,0 +1,179 @@
+'''
+Rebuilds every scheme in the registry that is out of date.
+
+A scheme is out of date if anything its fingerprint covers changed: the scheme, its
+mixins, the files it derives from or the default colours. A scheme can also derive from
+files generated for another scheme, so it is rebuilt after that scheme, and is looked at
+again if that scheme was rebuilt. Schemes are compiled in waves, each wave in parallel.
+From the command line:
+
+	python -m synesthesia.rebuild --out DIR
+'''
+
+import os, time, argparse, multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from . import compile
+from . import registry
+from .jobs import QUEUE
+
+def normalise(path):
+	return os.path.normcase(os.path.abspath(path))
+
+class Summary():
+	def __init__(self):
+		self.built = []
+		self.skipped = []
+		# (name, reason)
+		self.failed = []
+		self.seconds = 0.0
+		# the report of each compile, as a dict
+		self.reports = []
+
+	def describe(self):
+		lines = ["%d built, %d skipped, %d failed in %.2fs." % (len(self.built), len(self.skipped), len(self.failed), self.seconds)]
+		if self.built:
+			lines.append("Built: %s" % ', '.join(self.built))
+		for name, reason in self.failed:
+			lines.append("Failed: %s (%s)" % (name, reason))
+		return '\n'.join(lines)
+
+def upstream_schemes(directory, schemes):
+	''' Maps each scheme to the schemes whose generated files it derives from '''
+	producers = {}
+	for name, entry in schemes.items():
+		for artifact in entry.get("artifacts", []):
+			producers[normalise(os.path.join(directory, artifact))] = name
+	upstream = {}
+	for name, entry in schemes.items():
+		upstream[name] = set(producers[normalise(d)] for d in entry.get("dependencies", []) if normalise(d) in producers) - set([name])
+	return upstream
+
+def plan(directory, default_colours=None, force=False):
+	'''
+	Works out which schemes to compile, without compiling anything.
+	Returns (waves, summary), where waves is a list of lists of scheme names to compile
+	one after another, and summary already lists the schemes that are skipped or can't be built.
+	'''
+	summary = Summary()
+	schemes = registry.read(directory)
+	upstream = upstream_schemes(directory, schemes)
+
+	stale = set()
+	for name in sorted(schemes):
+		source = schemes[name].get("source")
+		if not source or not os.path.isfile(source):
+			summary.failed.append((name, "source not found"))
+		elif force or not compile.scheme_up_to_date(source, default_colours):
+			stale.add(name)
+
+	# anything deriving from a scheme that may change has to be looked at after it
+	buildable = set(schemes) - set(name for name, _ in summary.failed)
+	changed = True
+	while changed:
+		changed = False
+		for name in buildable - stale:
+			if upstream[name] & stale:
+				stale.add(name)
+				changed = True
+
+	waves = []
+	remaining = set(stale)
+	while remaining:
+		wave = sorted(name for name in remaining if not upstream[name] & remaining)
+		if not wave:
+			# schemes deriving from each other; nothing to order them by
+			wave = sorted(remaining)
+		waves.append(wave)
+		remaining -= set(wave)
+
+	summary.skipped = sorted(buildable - stale)
+	return waves, summary
+
+def rebuild(directory, executor, worker, default_colours=None, force=False, job=None):
+	'''
+	Compiles the schemes of the output directory that are out of date, each wave in
+	parallel on executor. worker(path) must compile a scheme without recording it, and
+	return (path, result of compile_scheme, report), like compile_worker. Returns a Summary.
+	'''
+	start = time.perf_counter()
+	waves, summary = plan(directory, default_colours, force)
+	schemes = registry.read(directory)
+
+	for n, wave in enumerate(waves):
+		if job:
+			job.checkpoint("Rebuilding highlighting schemes: %d of %d waves done..." % (n, len(waves)))
+		futures = [(name, executor.submit(worker, schemes[name]["source"])) for name in wave]
+		entries = {}
+		for name, future in futures:
+			_, result, report = future.result()
+			if report:
+				summary.reports.append(report)
+			if result is None:
+				summary.failed.append((name, "could not be compiled"))
+				continue
+			theme_name, entry, generated = result
+			entries[theme_name] = entry
+			if generated:
+				summary.built.append(name)
+			else:
+				# only looked at because something it derives from might have changed
+				summary.skipped.append(name)
+		# recorded wave by wave, so that the next wave sees what this one generated
+		if entries:
+			registry.update(directory, entries)
+
+	summary.built.sort()
+	summary.skipped.sort()
+	summary.seconds = time.perf_counter() - start
+	return summary
+
+class SynesthesiaRebuildAllCommand(sublime_plugin.WindowCommand):
+	''' Rebuilds every generated scheme that is out of date, in the background '''
+
+	def run(self, force=False):
+		view = self.window.active_view()
+		default_colours = compile.read_default_settings(view) if view else None
+		directory = compile.SYNESTHESIA_OUTPUT_PATH
+		# compiled in this process, which is already set up
+		worker = partial(compile.compile_worker, output_path=None, output_path_relative=None, default_colours=default_colours, force=force)
+
+		def work(job):
+			# Sublime's plugin host can't start worker processes, so the workers are threads
+			with ThreadPoolExecutor(multiprocessing.cpu_count()) as executor:
+				summary = rebuild(directory, executor, worker, default_colours, force, job)
+			print(summary.describe())
+			sublime.status_message("Highlighting schemes rebuilt: %s" % summary.describe().splitlines()[0])
+
+		QUEUE.submit("rebuild all", work)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.rebuild", description="Rebuild every out-of-date highlighting scheme in an output directory.")
+	parser.add_argument("--out", required=True, help="output directory the schemes were compiled to")
+	parser.add_argument("--relative-out", default="Packages/User", help="where the output directory lives inside Sublime Text (default: %(default)s)")
+	parser.add_argument("--colour-scheme", help="tmTheme to take default colours from")
+	parser.add_argument("--jobs", type=int, default=None, help="number of worker processes (default: one per core)")
+	parser.add_argument("--force", action="store_true", help="rebuild every scheme, even if it is up to date")
+	parser.add_argument("--report", help="file to write a JSON report of each compile's stages and counts to")
+	args = parser.parse_args(argv)
+
+	compile.configure_headless(args.out, args.relative_out)
+	default_colours = compile.read_colour_scheme_defaults(args.colour_scheme) if args.colour_scheme else None
+	worker = partial(compile.compile_worker, output_path=args.out, output_path_relative=args.relative_out, default_colours=default_colours, force=args.force)
+
+	with ProcessPoolExecutor(args.jobs) as executor:
+		summary = rebuild(args.out, executor, worker, default_colours, args.force)
+	print(summary.describe())
+	if args.report:
+		compile.write_report(args.report, summary.reports)
+	return 1 if summary.failed else 0
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,381 @@
+'''
+Estimates how expensive a scheme's keyword regexes are to highlight with.
+
+Each pattern is timed over a sample corpus, line by line as Sublime applies them, and
+patterns that are prone to catastrophic backtracking are flagged without being run.
+From the command line:
+
+	python -m synesthesia.regexcost SCHEME CORPUS
+
+where SCHEME is either a highlighting scheme (.json) or a generated .tmLanguage or .sublime-syntax.
+Timings come from Python's re module rather than Oniguruma, so they are only a guide
+to relative cost.
+'''
+
+import os, re, time, argparse, plistlib
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from .sublimeformat import generated_syntax_patterns
+
+# The characters some escapes match; other escapes that match characters, and ., are too varied to compare
+ESCAPE_CHARS = {'\\d': set('0123456789'), '\\s': set(' \t\n\r\f\v')}
+
+# Atoms that match a position rather than a character
+ZERO_WIDTH_ATOMS = set(['^', '$', '\\b', '\\B', '\\A', '\\z', '\\Z', '\\G'])
+
+class Group():
+	def __init__(self, lookaround=False):
+		self.lookaround = lookaround
+		# each alternative is a list of (atom, optional) pairs, a group standing for its first atom
+		self.alternatives = [[]]
+		# every atom inside
+		self.atoms = []
+		# for each alternative, the atoms repeating without bound that nothing after them has to match
+		self.trailing = [[]]
+
+	def add(self, atom, optional, trailing):
+		''' Adds an item to the current alternative, with the atoms repeating without bound at its end '''
+		self.alternatives[-1].append((atom, optional))
+		if not optional:
+			# what repeats before a required item can't run past it
+			self.trailing[-1] = []
+		self.trailing[-1] = self.trailing[-1] + trailing
+
+	def trailing_atoms(self):
+		return [atom for trailing in self.trailing for atom in trailing]
+
+def tokenise_atom(regex, i):
+	''' Returns the atom starting at regex[i] and the index after it '''
+	if regex[i] == '\\':
+		return regex[i:i + 2], i + 2
+	if regex[i] == '[':
+		j = i + 1
+		if j < len(regex) and regex[j] == '^':
+			j += 1
+		if j < len(regex) and regex[j] == ']':
+			j += 1
+		depth = 1
+		while j < len(regex) and depth > 0:
+			if regex[j] == '\\':
+				j += 1
+			elif regex[j] == '[':
+				depth += 1
+			elif regex[j] == ']':
+				depth -= 1
+			j += 1
+		return regex[i:j], j
+	return regex[i], i + 1
+
+def read_quantifier(regex, i):
+	'''
+	Returns (unbounded, possessive, index after the quantifier) for a quantifier at regex[i],
+	or None if there isn't one.
+	'''
+	if i >= len(regex):
+		return None
+	if regex[i] in '*+?':
+		unbounded = regex[i] != '?'
+		i += 1
+	elif regex[i] == '{':
+		match = re.match(r'\{(\d*)(,?)(\d*)\}', regex[i:])
+		if not match:
+			return None
+		unbounded = match.group(2) == ',' and match.group(3) == ''
+		i += len(match.group(0))
+	else:
+		return None
+	possessive = i < len(regex) and regex[i] == '+'
+	if i < len(regex) and regex[i] in '?+':
+		i += 1
+	return unbounded, possessive, i
+
+def atom_chars(atom, case_insensitive=False):
+	''' Returns the characters an atom can match, or None if there are too many to tell '''
+	# dispatch builds on this module, so it can't be imported before it
+	from .dispatch import class_chars, Unknown
+	if atom in ZERO_WIDTH_ATOMS:
+		return set()
+	if atom in ESCAPE_CHARS:
+		chars = ESCAPE_CHARS[atom]
+	elif atom.startswith('['):
+		try:
+			chars = set(class_chars(atom))
+		except (Unknown, IndexError):
+			return None
+	elif atom.startswith('\\'):
+		if atom[1:].isalnum():
+			return None
+		chars = set(atom[1:])
+	elif atom in ('.', '('):
+		return None
+	else:
+		chars = set(atom)
+	return set(c.lower() for c in chars) if case_insensitive else chars
+
+def may_overlap(a, b, case_insensitive=False):
+	''' Whether two atoms could match the same character '''
+	if a is None or b is None:
+		return False
+	if a == b:
+		return True
+	if '\\w' in (a, b):
+		chars = atom_chars(b if a == '\\w' else a)
+		return chars is None or any(c.isalnum() or c == '_' for c in chars)
+	a_chars, b_chars = atom_chars(a, case_insensitive), atom_chars(b, case_insensitive)
+	return a_chars is None or b_chars is None or bool(a_chars & b_chars)
+
+def first_atom(alternative):
+	return alternative[0][0] if alternative else None
+
+def starting_atoms(alternative):
+	''' Returns the atoms a match of an alternative can start with, or None if it can match nothing '''
+	atoms = []
+	for atom, optional in alternative:
+		atoms.append(atom)
+		if not optional:
+			return atoms
+	return None
+
+def is_optional(regex, i):
+	''' Whether the quantifier at regex[i] allows no repetitions at all '''
+	return regex[i] in '*?' or re.match(r'\{0*(,\d*)?\}', regex[i:]) is not None
+
+def risks(regex):
+	'''
+	Returns reasons why a regex might backtrack catastrophically: a repeated group ending
+	in unbounded repetition that can also match the start of the group's next repetition
+	(e.g. (a+)+, but not ([A-Z][a-z]+)+ or (\\d+\\.)+), or a repeated alternation whose
+	branches can start with the same character (e.g. (a|ab)*).
+	'''
+	found = []
+	# an inline i anywhere is taken to apply everywhere
+	case_insensitive = re.search(r'\(\?[imsx-]*i', regex) is not None
+	stack = [Group()]
+	i = 0
+	while i < len(regex):
+		c = regex[i]
+		if c == '(':
+			lookaround = re.match(r'\(\?(=|!|<=|<!)', regex[i:]) is not None
+			stack.append(Group(lookaround))
+			prefix = re.match(r'\((?:\?(?:[=!:>]|<=|<!|<[A-Za-z_]\w*>|P<[A-Za-z_]\w*>|[imsx-]+:|[imsx-]+\)))?', regex[i:])
+			i += len(prefix.group(0))
+			if prefix.group(0).endswith(')'):
+				# inline flags apply to what follows and aren't a group
+				stack.pop()
+			continue
+		if c == '|':
+			stack[-1].alternatives.append([])
+			stack[-1].trailing.append([])
+			i += 1
+			continue
+		if c == ')' and len(stack) > 1:
+			group = stack.pop()
+			# a group with several branches is too varied to compare with other atoms
+			starts = starting_atoms(group.alternatives[0]) if len(group.alternatives) == 1 else None
+			atom = starts[0] if starts and len(starts) == 1 else '('
+			i += 1
+			quantifier = read_quantifier(regex, i)
+			optional = group.lookaround
+			trailing = group.trailing_atoms()
+			if quantifier:
+				optional = optional or is_optional(regex, i)
+				unbounded, possessive, i = quantifier
+				if unbounded and not possessive and not group.lookaround:
+					# repetition that can run straight into the next repeat, from the end of this one
+					repeated = trailing
+					trailing = group.atoms
+					iteration_starts = [starting_atoms(alt) for alt in group.alternatives]
+					if repeated and (None in iteration_starts or any(may_overlap(r, s, case_insensitive) for r in repeated for starts in iteration_starts for s in starts)):
+						found.append("nested quantifier")
+					alternatives = [first_atom(alt) for alt in group.alternatives]
+					if any(may_overlap(a, b, case_insensitive) for n, a in enumerate(alternatives) for b in alternatives[n + 1:]):
+						found.append("ambiguous alternation")
+			stack[-1].add(atom, optional, trailing)
+			stack[-1].atoms += group.atoms
+			continue
+
+		atom, i = tokenise_atom(regex, i)
+		quantifier = read_quantifier(regex, i)
+		optional = atom in ZERO_WIDTH_ATOMS
+		trailing = []
+		if quantifier:
+			optional = optional or is_optional(regex, i)
+			unbounded, possessive, i = quantifier
+			if unbounded and not possessive:
+				trailing = [atom]
+		stack[-1].add(atom, optional, trailing)
+		stack[-1].atoms.append(atom)
+
+	return sorted(set(found))
+
+class PatternCost():
+	def __init__(self, regex):
+		self.regex = regex
+		self.risks = risks(regex)
+		self.seconds = None
+		self.matches = 0
+		self.error = None
+
+	def describe(self):
+		if self.error:
+			cost = "not compiled"
+		elif self.seconds is None:
+			cost = "not timed"
+		else:
+			cost = "%8.2f ms" % (self.seconds * 1000)
+		notes = []
+		if self.risks:
+			notes.append("risky: %s" % ', '.join(self.risks))
+		if self.error:
+			notes.append(self.error)
+		return "%12s  %7d matches  %s%s" % (cost, self.matches, self.regex, "  [%s]" % '; '.join(notes) if notes else '')
+
+def profile(regexes, lines, time_risky=False):
+	'''
+	Times each regex over the lines of a corpus. Risky regexes are only run if time_risky
+	is set, since they may never finish. Returns PatternCosts, most expensive first.
+	'''
+	costs = [PatternCost(regex) for regex in regexes]
+	for cost in costs:
+		if cost.risks and not time_risky:
+			continue
+		try:
+			pattern = re.compile(cost.regex)
+		except re.error as e:
+			cost.error = "Python can't compile this: %s" % e
+			continue
+
+		start = time.perf_counter()
+		for line in lines:
+			for _ in pattern.finditer(line):
+				cost.matches += 1
+		cost.seconds = time.perf_counter() - start
+
+	# risky patterns that weren't timed go first, then the slowest
+	costs.sort(key=lambda c: (not (c.risks and c.seconds is None), -(c.seconds or 0)))
+	return costs
+
+def over_budget(costs, budget_ms, allow_risky=False):
+	''' Returns reasons why a profile exceeds a budget in milliseconds, if it does '''
+	reasons = []
+	if not allow_risky:
+		reasons = ["%s may backtrack catastrophically (%s)" % (c.regex, ', '.join(c.risks)) for c in costs if c.risks]
+	total = sum(c.seconds or 0 for c in costs)
+	if budget_ms is not None and total * 1000 > budget_ms:
+		reasons.append("highlighting the corpus took %.1f ms, over the budget of %s ms" % (total * 1000, budget_ms))
+	return reasons
+
+def read_lines(path):
+	with open(path, 'r', encoding='utf-8', errors='replace') as f:
+		return f.read().splitlines()
+
+def check_budget(budget, directory, regexes):
+	'''
+	Profiles a scheme's regexes against the "cost_budget" option of a scheme,
+	{"corpus": path relative to the scheme, "max_ms": number, "allow_risky": boolean}.
+	Returns whether the scheme may be compiled.
+	'''
+	corpus = os.path.join(directory, budget["corpus"])
+	if not os.path.isfile(corpus):
+		print("Cost budget corpus %s not found." % corpus)
+		return False
+	allow_risky = budget.get("allow_risky", False)
+	reasons = over_budget(profile(regexes, read_lines(corpus), allow_risky), budget.get("max_ms"), allow_risky)
+	for reason in reasons:
+		print("Over cost budget: %s" % reason)
+	return not reasons
+
+def tmLanguage_patterns(plist):
+	''' Returns the match regexes of a tmLanguage, including those in its repository '''
+	def walk(node):
+		if isinstance(node, dict):
+			if 'match' in node:
+				yield node['match']
+			for value in node.values():
+				for regex in walk(value):
+					yield regex
+		elif isinstance(node, list):
+			for value in node:
+				for regex in walk(value):
+					yield regex
+	return list(walk(plist))
+
+def scheme_regexes(path):
+	''' Returns the keyword regexes of a highlighting scheme or generated syntax '''
+	if path.endswith('.tmLanguage'):
+		with open(path, 'rb') as f:
+			return tmLanguage_patterns(plistlib.load(f) if hasattr(plistlib, 'load') else plistlib.readPlist(f))
+	if path.endswith('.sublime-syntax'):
+		with open(path, 'r', encoding='utf-8') as f:
+			return generated_syntax_patterns(f.read())
+
+	from . import compile
+	theme_name, entries = compile.load_json_data(os.path.abspath(path))
+	if not entries:
+		return []
+	directory, _, _ = compile.split_filepath(os.path.abspath(path))
+	keyword_map = compile.HighlightingScheme(directory, entries).resolve_keywords(theme_name)
+	return list(compile.keyword_regexes(keyword_map))
+
+def report(costs, top):
+	lines = [cost.describe() for cost in costs[:top]]
+	timed = [c for c in costs if c.seconds is not None]
+	lines.append("%d patterns, %d timed, %d risky, %.1f ms in total" % (len(costs), len(timed), len([c for c in costs if c.risks]), sum(c.seconds for c in timed) * 1000))
+	return '\n'.join(lines)
+
+class SynesthesiaProfileCommand(sublime_plugin.WindowCommand):
+	''' Profiles the active view's syntax, if it was generated by Synesthesia, on the view's own text '''
+
+	def run(self, top=30):
+		from . import compile
+		view = self.window.active_view()
+		syntax = view.settings().get('syntax')
+		name = os.path.basename(syntax).split('.')[0]
+		path = compile.first_valid_path(*[os.path.join(compile.SYNESTHESIA_OUTPUT_PATH, "%s.%s" % (name, extensions[0])) for extensions in compile.OUTPUT_FORMATS.values()])
+		if not path:
+			sublime.status_message("%s is not a highlighting scheme." % name)
+			return
+		lines = view.substr(sublime.Region(0, view.size())).splitlines()
+
+		def profile_in_background():
+			result = report(profile(scheme_regexes(path), lines), top)
+			sublime.set_timeout(lambda: self.show(name, result), 0)
+
+		sublime.status_message("Profiling %s..." % name)
+		sublime.set_timeout_async(profile_in_background, 0)
+
+	def show(self, name, result):
+		panel = self.window.create_output_panel("synesthesia_profile")
+		panel.run_command("append", {"characters": "Cost of %s:\n%s\n" % (name, result)})
+		self.window.run_command("show_panel", {"panel": "output.synesthesia_profile"})
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m synesthesia.regexcost", description="Time a highlighting scheme's regexes over a sample corpus.")
+	parser.add_argument("scheme", help="highlighting scheme (.json) or generated .tmLanguage or .sublime-syntax")
+	parser.add_argument("corpus", help="sample text to highlight")
+	parser.add_argument("--top", type=int, default=30, help="number of patterns to list (default: %(default)s)")
+	parser.add_argument("--budget-ms", type=float, help="fail if highlighting the corpus takes longer than this")
+	parser.add_argument("--time-risky", action="store_true", help="also time patterns that may backtrack catastrophically")
+	args = parser.parse_args(argv)
+
+	if args.scheme.endswith('.json'):
+		from . import compile
+		compile.configure_headless(os.getcwd())
+
+	costs = profile(scheme_regexes(args.scheme), read_lines(args.corpus), args.time_risky)
+	print(report(costs, args.top))
+
+	if args.budget_ms is not None:
+		reasons = over_budget(costs, args.budget_ms, args.time_risky)
+		for reason in reasons:
+			print("Over budget: %s" % reason)
+		return 1 if reasons else 0
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,128 @@
+'''
+The registry of generated highlighting schemes, kept next to the generated files.
+For each scheme it records:
+
+- artifacts: the files generated for it, relative to the output directory
+- source: the scheme it was compiled from
+- format: the output format it was last compiled to
+- fingerprint: a hash of everything its output depends on
+- dependencies: the files other than the source it was generated from
+
+Commands that list or remove schemes read the registry rather than scanning the
+output directory, and only ever touch files recorded in it.
+'''
+
+import os, json, threading
+
+from .atomicfile import write_if_changed
+
+REGISTRY_NAME = "synesthesia-registry.json"
+
+# Written by versions that only kept fingerprints
+LEGACY_MANIFEST_NAME = "synesthesia-manifest.json"
+
+# Extensions of the files generated for a scheme, by format, the syntax first
+LEGACY_FORMATS = [
+	["tmLanguage", "tmTheme", "sublime-settings"],
+	["sublime-syntax", "sublime-color-scheme", "sublime-settings"],
+]
+
+# Guards read-modify-write cycles between threads of the same process
+LOCK = threading.RLock()
+
+def registry_path(directory):
+	return os.path.join(directory, REGISTRY_NAME)
+
+def read(directory, recording=()):
+	'''
+	Returns the registry of the output directory, keyed by scheme name. Schemes named in
+	recording are about to be recorded, so their files aren't taken for an older version's.
+	'''
+	with LOCK:
+		path = registry_path(directory)
+		if not os.path.isfile(path):
+			if not os.path.isdir(directory):
+				return {}
+			return adopt(directory, recording)
+		try:
+			with open(path, 'r') as f:
+				return json.load(f)
+		except ValueError:
+			print("%s is not a valid JSON file; starting a new registry." % path)
+			return {}
+
+def write(directory, registry):
+	with LOCK:
+		write_if_changed(registry_path(directory), json.dumps(registry, sort_keys=True, indent=4, separators=(',', ': ')))
+
+def update(directory, entries):
+	'''
+	Records schemes, given their entries by name. Artifacts recorded for a scheme earlier
+	that still exist are kept, e.g. those of the format it was compiled to before, so that
+	removing the scheme removes them too.
+	'''
+	with LOCK:
+		registry = read(directory, entries)
+		for name, entry in entries.items():
+			previous = registry.get(name, {}).get("artifacts", [])
+			entry = dict(entry)
+			entry["artifacts"] = sorted(set(entry.get("artifacts", [])) | set(a for a in previous if os.path.isfile(os.path.join(directory, a))))
+			registry[name] = entry
+		write(directory, registry)
+
+def forget(directory, name):
+	with LOCK:
+		registry = read(directory)
+		if registry.pop(name, None) is not None:
+			write(directory, registry)
+
+def prune(directory):
+	''' Forgets schemes none of whose artifacts exist any more. Returns their names. '''
+	with LOCK:
+		registry = read(directory)
+		gone = sorted(name for name, entry in registry.items() if not any(os.path.isfile(os.path.join(directory, a)) for a in entry.get("artifacts", [])))
+		for name in gone:
+			del registry[name]
+		if gone:
+			write(directory, registry)
+		return gone
+
+def adopt(directory, recording=()):
+	'''
+	Builds the registry of an output directory written by an older version, once:
+	schemes are found by their complete sets of generated files, as they used to be,
+	and what the old manifest knew about them is carried over. Schemes named in
+	recording are left out; e.g. the first compile into a new directory has just
+	written them.
+	'''
+	files = set(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)))
+	registry = {}
+	for extensions in LEGACY_FORMATS:
+		suffix = '.' + extensions[0]
+		for name in [f[:-len(suffix)] for f in files if f.endswith(suffix)]:
+			artifacts = ["%s.%s" % (name, ext) for ext in extensions]
+			if name not in recording and all(a in files for a in artifacts):
+				entry = registry.setdefault(name, {"artifacts": []})
+				entry["artifacts"] += [a for a in artifacts if a not in entry["artifacts"]]
+
+	legacy_path = os.path.join(directory, LEGACY_MANIFEST_NAME)
+	if os.path.isfile(legacy_path):
+		try:
+			with open(legacy_path, 'r') as f:
+				legacy = json.load(f)
+		except ValueError:
+			legacy = {}
+		for name, entry in legacy.items():
+			# fingerprints are left out so that these schemes are rebuilt on their next compile
+			if name in registry and isinstance(entry, dict):
+				for key in ["source", "dependencies"]:
+					if key in entry:
+						registry[name][key] = entry[key]
+		os.remove(legacy_path)
+
+	for entry in registry.values():
+		entry["artifacts"].sort()
+	write(directory, registry)
+	if registry:
+		print("Registered %d existing highlighting schemes." % len(registry))
+	return registry
@@ -0,0 +1,32 @@
+import os
+
+from . import instrument
+
+class ResourceCache():
+	'''
+	Remembers what files parse to, for as long as their modification time stays the same.
+
+	Parsed values are shared between everyone who asks for them, so they must not be
+	modified. Callers that need to change a value copy just the parts they change.
+	'''
+
+	def __init__(self):
+		# (path, loader) -> (mtime, value)
+		self.entries = {}
+
+	def get(self, path, loader):
+		''' Returns loader(path), calling it only if the file changed since the last call '''
+		mtime = os.path.getmtime(path)
+		key = (path, loader)
+		if key in self.entries:
+			cached_mtime, value = self.entries[key]
+			if cached_mtime == mtime:
+				instrument.count("cache_hits")
+				return value
+		instrument.count("cache_misses")
+		value = loader(path)
+		self.entries[key] = (mtime, value)
+		return value
+
+# Shared by every compile in this session
+CACHE = ResourceCache()
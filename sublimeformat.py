@@ -0,0 +1,75 @@
+'''
+Helpers for Sublime Text's native formats: .sublime-syntax, which is YAML, and
+.sublime-color-scheme, which is JSON. Both are smaller than their plist equivalents
+and are loaded faster by the editor.
+'''
+
+import re
+
+def yaml_string(s):
+	''' Quotes a string as a single-quoted YAML scalar, in which only the quote itself is special '''
+	return "'%s'" % s.replace("'", "''")
+
+def unquote_yaml_string(s):
+	return s[1:-1].replace("''", "'")
+
+def snake_case(key):
+	''' tmTheme settings are camelCase (lineHighlight), colour scheme ones snake_case (line_highlight) '''
+	return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', key).lower()
+
+def colour_scheme_globals(settings):
+	''' Converts the global settings of a tmTheme '''
+	return dict((snake_case(key), settings[key]) for key in sorted(settings) if isinstance(settings[key], str))
+
+def colour_scheme_rule(name, scope, style):
+	''' Returns the rule for a scope styled with a (foreground, background, fontstyle) triple '''
+	foreground, background, fontstyle = style
+	rule = {"name": name, "scope": scope}
+	if foreground is not None:
+		rule["foreground"] = foreground
+	if background is not None:
+		rule["background"] = background
+	if fontstyle is not None:
+		rule["font_style"] = fontstyle
+	return rule
+
+def tmTheme_to_colour_scheme(plist):
+	''' Converts a parsed tmTheme into the contents of a .sublime-color-scheme '''
+	scheme = {"name": plist.get("name", ""), "globals": {}, "rules": []}
+	if "author" in plist:
+		scheme["author"] = plist["author"]
+	for element in plist.get("settings", []):
+		settings = element.get("settings", {})
+		if "scope" not in element:
+			# the global settings are the ones that don't apply to any particular scope
+			scheme["globals"].update(colour_scheme_globals(settings))
+			continue
+		rule = {}
+		if "name" in element:
+			rule["name"] = element["name"]
+		rule["scope"] = element["scope"]
+		rule.update(colour_scheme_globals(settings))
+		scheme["rules"].append(rule)
+	return scheme
+
+def generated_syntax_patterns(text):
+	'''
+	Returns the match regexes of a .sublime-syntax written by Synesthesia, with variables
+	expanded. Only the subset of YAML that the compiler writes is understood.
+	'''
+	variables = {}
+	patterns = []
+	section = None
+	for line in text.splitlines():
+		if not line.startswith(' '):
+			section = line.split(':')[0]
+			continue
+		if section == "variables":
+			match = re.match(r"^  ([^:]+): ('.*')$", line)
+			if match:
+				variables[match.group(1)] = unquote_yaml_string(match.group(2))
+		elif section == "contexts":
+			match = re.match(r"^\s+- match: ('.*')$", line)
+			if match:
+				patterns.append(unquote_yaml_string(match.group(1)))
+	return [re.sub(r'\{\{(\w+)\}\}', lambda m: variables.get(m.group(1), m.group(0)), p) for p in patterns]
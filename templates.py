@@ -1,5 +1,5 @@
 
-scope = """<?xml version="1.0" encoding="UTF-8"?>
+scope_header = """<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
 <plist version="1.0">
 <dict>
@@ -11,7 +11,9 @@ scope = """<?xml version="1.0" encoding="UTF-8"?>
 	<string>%s</string>
 	<key>patterns</key>
 	<array>
-%s
+"""
+
+scope_footer = """
 	</array>
 	<key>scopeName</key>
 	<string>%s.%s</string>
@@ -51,27 +53,28 @@ sample_file = """{
 	}
 }"""
 
-default_colours = """
+default_colour = """				<key>%s</key>
+				<string>%s</string>
+"""
+
+default_colours_element = """
 		<dict>
 			<key>settings</key>
 			<dict>
-				<key>background</key>
-				<string>#000000</string>
-				<key>caret</key>
-				<string>#9F9F9F</string>
-				<key>foreground</key>
-				<string>#DEDEDE</string>
-				<key>invisibles</key>
-				<string>#343434</string>
-				<key>lineHighlight</key>
-				<string>#2A2A2A</string>
-				<key>selection</key>
-				<string>#424242</string>
-			</dict>
+%s			</dict>
 		</dict>
 """
 
-theme = """<?xml version="1.0" encoding="UTF-8"?>
+default_colours = {
+	"background": "#000000",
+	"caret": "#9F9F9F",
+	"foreground": "#DEDEDE",
+	"invisibles": "#343434",
+	"lineHighlight": "#2A2A2A",
+	"selection": "#424242"
+}
+
+theme_header = """<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
 <plist version="1.0">
 <dict>
@@ -82,7 +85,9 @@ theme = """<?xml version="1.0" encoding="UTF-8"?>
 	<key>settings</key>
 	<array>
 		%s
-		%s
+"""
+
+theme_footer = """
 	</array>
 	<key>uuid</key>
 	<string>%s</string>
@@ -100,6 +105,23 @@ keyword = """
 		</dict>
 """
 
+keyword_group = """
+		<dict>
+			<key>match</key>
+			<string>%s</string>
+			<key>captures</key>
+			<dict>
+%s			</dict>
+		</dict>
+"""
+
+keyword_capture = """				<key>%d</key>
+				<dict>
+					<key>name</key>
+					<string>%s</string>
+				</dict>
+"""
+
 theme_element = """
 		<dict>
 			<key>name</key>
@@ -131,10 +153,79 @@ theme_element_background = """
 additional_settings_extension = "\"%s\""
 
 default_settings = """{
-	"color_scheme": "%s/%s.tmTheme",
+	"color_scheme": "%s/%s.%s",
 	"extensions": [%s]%s
 }
 """
 
 other_settings = """,
 	\"%s\": \"%s\""""
+
+syntax_header = """%%YAML 1.2
+---
+# Generated by Synesthesia
+name: %s
+file_extensions:%s
+scope: %s.%s
+"""
+
+syntax_extension = """
+  - %s"""
+
+syntax_variables = """variables:
+"""
+
+syntax_variable = """  %s: %s
+"""
+
+syntax_contexts = """contexts:
+  main:
+"""
+
+syntax_keyword = """    - match: %s
+      scope: %s
+"""
+
+syntax_keyword_group = """    - match: %s
+      captures:
+%s"""
+
+syntax_capture = """        %d: %s
+"""
+
+colour_scheme_header = """{
+	"name": %s,
+	"author": "Generated by Synesthesia",
+	"globals": %s,
+	"rules":
+	["""
+
+colour_scheme_rule = """%s
+		%s"""
+
+colour_scheme_footer = """
+	]
+}
+"""
+
+html_header = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%s</title>
+<style>
+body { margin: 0; background: %s; color: %s; }
+pre { margin: 0; padding: 1em; font-family: Menlo, Consolas, "DejaVu Sans Mono", monospace; white-space: pre-wrap; }
+</style>
+</head>
+<body>
+<pre>"""
+
+html_keyword_start = """<span style="%s">"""
+
+html_keyword_end = """</span>"""
+
+html_footer = """</pre>
+</body>
+</html>
+"""
@@ -0,0 +1,14 @@
+'''
+Lets the tests import this checkout as the synesthesia package, whatever its directory is
+called, when they are run with pytest from the repository:
+
+	python -m pytest tests
+'''
+
+import os, sys, types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+package = types.ModuleType("synesthesia")
+package.__path__ = [ROOT]
+sys.modules["synesthesia"] = package
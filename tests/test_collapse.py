@@ -0,0 +1,55 @@
+'''
+Checks that collapsing literal keywords doesn't change what is highlighted. Run from
+the repository with the other tests:
+
+	python -m pytest tests
+'''
+
+import random, unittest
+
+from synesthesia import compile
+from synesthesia.matcher import Matcher
+
+WORDS = ["err", "error", "errno", "Error", "ERROR", "fatal", "fail", "warn", "x1", "ab"]
+REGEXES = ["err.*", "e\\w+", "[ef]a\\w*", "x\\d+", "\\w+no", "(?:fa|wa)\\w+", "a|b", "ERR\\w*"]
+COLOURS = ["#FF0000", "#0000FF", "#00FF00"]
+
+def random_keyword_map(rng):
+	keyword_map = {}
+	for _ in range(rng.randint(2, 10)):
+		key = rng.choice(WORDS + REGEXES)
+		colour = rng.choice(COLOURS)
+		keyword_map[key] = {"colour": colour, "case-insensitive": True} if rng.random() < 0.2 else colour
+	return keyword_map
+
+def random_line(rng):
+	return ' '.join(rng.choice(WORDS + ["errnos", "eat", "x42", "-", "warning", "FATAL"]) for _ in range(rng.randint(0, 8)))
+
+def highlighted(entries, line):
+	''' The spans of a line highlighted by entries, with their styles '''
+	entries = list(entries)
+	matcher = Matcher([regex for regex, _, _, _ in entries])
+	return [(start, end, entries[pattern][2]) for start, end, pattern in matcher.scan(line)]
+
+class CollapseTest(unittest.TestCase):
+	def test_errno_stays_behind_regex(self):
+		table = compile.KeywordTable.build({"error": "#FF0000", "err.*": "#0000FF", "errno": "#FF0000"})
+		entries = table.entries(True)
+		self.assertEqual(len(entries), 3)
+		self.assertEqual(highlighted(entries, "errno"), [(0, 5, entries[1][2])])
+
+	def test_merges_adjacent_literals(self):
+		table = compile.KeywordTable.build({"error": "#FF0000", "errno": "#FF0000", "fatal": "#0000FF", "fail": "#FF0000", "x\\d+": "#00FF00"})
+		entries = table.entries(True)
+		self.assertEqual([merged for _, _, _, merged in entries], [True, False, False])
+
+	def test_same_highlighting_as_separate_patterns(self):
+		rng = random.Random(1)
+		for _ in range(2000):
+			table = compile.KeywordTable.build(random_keyword_map(rng))
+			for _ in range(5):
+				line = random_line(rng)
+				self.assertEqual(highlighted(table.entries(True), line), highlighted(table.entries(), line), (list(table), line))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,34 @@
+'''
+Checks which regexes are flagged as prone to catastrophic backtracking. Run from the
+repository with the other tests:
+
+	python -m pytest tests
+'''
+
+import os, glob, unittest
+
+from synesthesia import regexcost
+
+INCLUDE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "include")
+
+class RisksTest(unittest.TestCase):
+	def test_flags_nested_quantifiers(self):
+		for regex in ["(a+)+", "(a*)*", "(\\d+\\s?)+", "(a?b+)+", "(?i:([A-Z][a-z]+)+)", "((?:ab)+)+", "((?:a+)b?)+"]:
+			self.assertEqual(regexcost.risks(regex), ["nested quantifier"], regex)
+
+	def test_flags_ambiguous_alternations(self):
+		self.assertEqual(regexcost.risks("(a|ab)*"), ["ambiguous alternation"])
+
+	def test_repetition_that_cant_run_into_the_next(self):
+		for regex in ["([A-Z][a-z]+)+\\.java:\\d+", "(x(?:ab)+)+", "(?:a++)+", "(a|b)*", "(?:\\d+\\.)+\\d", "(x+,)*y", "(\\s*,\\s*\\w+)*;"]:
+			self.assertEqual(regexcost.risks(regex), [], regex)
+
+	def test_bundled_includes_pass(self):
+		paths = sorted(glob.glob(os.path.join(INCLUDE_DIRECTORY, "*.json")))
+		self.assertTrue(paths)
+		for path in paths:
+			for regex in regexcost.scheme_regexes(path):
+				self.assertEqual(regexcost.risks(regex), [], "%s in %s" % (regex, os.path.basename(path)))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,55 @@
+import re
+
+# Marks the end of a word inside a trie node
+END = ''
+
+def build_trie(words):
+	trie = {}
+	for word in words:
+		node = trie
+		for ch in word:
+			node = node.setdefault(ch, {})
+		node[END] = True
+	return trie
+
+def render_trie(node):
+	''' Renders a trie node as a regex matching exactly the words below it '''
+	optional = END in node
+	alternatives = [re.escape(ch) + render_trie(node[ch]) for ch in sorted(k for k in node if k != END)]
+
+	if not alternatives:
+		return ''
+
+	if len(alternatives) == 1:
+		result = alternatives[0]
+		atomic = len(result) == 1
+	elif all(len(alt) == 1 for alt in alternatives):
+		result = '[%s]' % ''.join(alternatives)
+		atomic = True
+	else:
+		result = '(?:%s)' % '|'.join(alternatives)
+		atomic = True
+
+	if optional:
+		# Only a single character or a group can be made optional directly
+		if not atomic:
+			result = '(?:%s)' % result
+		result += '?'
+
+	return result
+
+def trie_regex(words, case_insensitive=False):
+	'''
+	Collapses a list of alphanumeric words into a single word-bounded alternation,
+	e.g. ['error', 'errno', 'fatal'] becomes \\b(?:err(?:no|or)|fatal)\\b.
+
+	Since every word consists only of word characters, the surrounding word boundaries
+	force a match to span a whole word, so the alternation matches exactly where one of
+	the separate \\bword\\b patterns would have.
+	'''
+	if case_insensitive:
+		words = [w.lower() for w in words]
+	regex = "\\b%s\\b" % render_trie(build_trie(words))
+	if case_insensitive:
+		regex = "(?i:%s)" % regex
+	return regex
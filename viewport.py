@@ -0,0 +1,234 @@
+'''
+Highlights a view with a generated scheme's keywords as regions, only over the lines in
+view, for files too large for a syntax to be applied to.
+
+The scheme's keywords are matched with Python's re module (see matcher.py) against the
+visible lines and VIEWPORT_MARGIN lines either side of them, and drawn with add_regions
+in the scopes the scheme's generated theme colours, one set of regions per style. The
+view is switched to the generated theme for as long as the mode is on.
+
+As the view scrolls, only lines that weren't scanned before are, and regions that leave
+the margin are dropped, so the work done and the regions kept don't grow with the size
+of the file. Small edits rescan the lines they were made on; an edit that adds or
+removes lines rescans the lines in view.
+'''
+
+import os
+
+try:
+	import sublime, sublime_plugin
+except ImportError:
+	from . import headless as sublime
+	from . import headless as sublime_plugin
+
+from . import compile
+from . import registry
+from .matcher import Matcher
+
+# Lines scanned beyond the visible ones, above and below
+VIEWPORT_MARGIN = 200
+
+# How often the view is checked for having scrolled, in milliseconds
+POLL_INTERVAL = 100
+
+# Edits that change more characters than this rescan the lines in view
+SMALL_EDIT = 256
+
+# view id -> ViewportHighlighter
+HIGHLIGHTERS = {}
+
+def subtract(window, covered):
+	''' Returns the parts of the range window that aren't in the range covered '''
+	begin, end = window
+	covered_begin, covered_end = covered
+	if covered_end <= begin or covered_begin >= end or covered_begin >= covered_end:
+		return [window]
+	parts = []
+	if begin < covered_begin:
+		parts.append((begin, covered_begin))
+	if covered_end < end:
+		parts.append((covered_end, end))
+	return parts
+
+class ViewportHighlighter():
+	def __init__(self, view, theme_name, scheme, entries):
+		self.view = view
+		self.theme_name = theme_name
+		self.matcher = Matcher([regex for regex, _, _, _ in entries])
+		# style of each pattern, as an index into scopes
+		self.pattern_styles = []
+		# the scope of the first keyword with each style, which the theme colours in that style
+		self.scopes = []
+		style_index = {}
+		for _, keyname, style, _ in entries:
+			if style not in style_index:
+				style_index[style] = len(self.scopes)
+				self.scopes.append(scheme.keyword_scope(theme_name, keyname))
+			self.pattern_styles.append(style_index[style])
+		# the range of text scanned, (begin, end); nothing outside it has regions
+		self.covered = (0, 0)
+		# styles with regions in the view
+		self.drawn = set()
+		self.size = view.size()
+		self.rows = view.rowcol(self.size)[0]
+		# the view's own colour scheme setting, if it had one, to put back afterwards
+		self.colour_scheme = view.settings().get("color_scheme") if view.settings().has("color_scheme") else None
+
+	def key(self, style):
+		return "synesthesia_viewport_%d" % style
+
+	def lines(self, begin, end):
+		''' Widens a range to the whole lines it touches '''
+		return self.view.line(begin).begin(), self.view.line(end).end()
+
+	def window(self):
+		''' The range of the visible lines and the margin around them '''
+		visible = self.view.visible_region()
+		first = max(self.view.rowcol(visible.begin())[0] - VIEWPORT_MARGIN, 0)
+		last = min(self.view.rowcol(visible.end())[0] + VIEWPORT_MARGIN, self.rows)
+		return self.view.text_point(first, 0), self.view.line(self.view.text_point(last, 0)).end()
+
+	def scan(self, begin, end, found):
+		''' Adds the regions of the keywords in the lines from begin to end to found, by style '''
+		offset = begin
+		for line in self.view.substr(sublime.Region(begin, end)).split('\n'):
+			for start, stop, pattern in self.matcher.scan(line):
+				found.setdefault(self.pattern_styles[pattern], []).append(sublime.Region(offset + start, offset + stop))
+			offset += len(line) + 1
+
+	def redraw(self, window, dirty=()):
+		'''
+		Makes the regions cover window, a range of whole lines: regions outside it are
+		dropped, and the parts of it not scanned before are scanned, as are the ranges in dirty.
+		'''
+		begin, end = window
+		rescanned = [self.lines(b, e) for b, e in subtract(window, self.covered) + list(dirty) if b < end and e > begin]
+		found = {}
+		for b, e in rescanned:
+			self.scan(b, e, found)
+
+		for style in self.drawn | set(found):
+			key = self.key(style)
+			kept = [r for r in self.view.get_regions(key) if begin <= r.begin() and r.end() <= end and not any(b <= r.begin() <= e for b, e in rescanned)]
+			regions = kept + found.get(style, [])
+			if regions:
+				self.view.add_regions(key, regions, self.scopes[style], '', sublime.DRAW_NO_OUTLINE)
+				self.drawn.add(style)
+			else:
+				self.view.erase_regions(key)
+				self.drawn.discard(style)
+		self.covered = window
+
+	def modified(self):
+		size = self.view.size()
+		rows = self.view.rowcol(size)[0]
+		change = size - self.size
+		self.size = size
+		if rows != self.rows or abs(change) > SMALL_EDIT:
+			# lines moved; everything in view is scanned again
+			self.rows = rows
+			self.covered = (0, 0)
+			self.redraw(self.window())
+			return
+		begin, end = self.covered
+		self.covered = (begin, end + change)
+		self.redraw(self.window(), [(r.begin(), r.end()) for r in self.view.sel()])
+
+	def poll(self):
+		if HIGHLIGHTERS.get(self.view.id()) is not self:
+			return
+		if not self.view.is_valid():
+			del HIGHLIGHTERS[self.view.id()]
+			return
+		window = self.window()
+		if window != self.covered:
+			self.redraw(window)
+		sublime.set_timeout_async(self.poll, POLL_INTERVAL)
+
+	def clear(self):
+		for style in self.drawn:
+			self.view.erase_regions(self.key(style))
+		self.drawn = set()
+		if self.colour_scheme is None:
+			self.view.settings().erase("color_scheme")
+		else:
+			self.view.settings().set("color_scheme", self.colour_scheme)
+
+def load_highlighter(view, theme_name, entry):
+	''' Reads a generated scheme's keywords from its source, as it was compiled, or returns None '''
+	source = entry.get("source")
+	if not source or not os.path.isfile(source):
+		sublime.status_message("The source of %s can't be found." % theme_name)
+		return None
+	loaded = compile.load_keywords(source)
+	if not loaded:
+		return None
+	_, scheme, keywords = loaded
+	# named as they were in the generated theme, which only collapses keywords it doesn't derive
+	entries = list(keywords.entries(scheme.collapses_keywords and "deriving" not in scheme.data))
+	highlighter = ViewportHighlighter(view, theme_name, scheme, entries)
+	highlighter.matcher.report_failed(theme_name, "in viewport mode")
+	return highlighter
+
+def disable(view):
+	highlighter = HIGHLIGHTERS.pop(view.id(), None)
+	if highlighter:
+		highlighter.clear()
+	return highlighter
+
+class SynesthesiaViewportCommand(sublime_plugin.TextCommand):
+	''' Highlights the view with a generated scheme, only over the lines in view '''
+
+	def run(self, edit, scheme=None):
+		schemes = registry.read(compile.SYNESTHESIA_OUTPUT_PATH)
+		if scheme is None:
+			names = sorted(schemes)
+			if not names:
+				sublime.status_message("No highlighting schemes have been generated.")
+				return
+
+			def done(which):
+				if which != -1:
+					self.view.run_command("synesthesia_viewport", {"scheme": names[which]})
+
+			self.view.window().show_quick_panel(names, done)
+			return
+
+		if scheme not in schemes:
+			sublime.status_message("%s is not a highlighting scheme." % scheme)
+			return
+		view = self.view
+		theme_extension = compile.OUTPUT_FORMATS[schemes[scheme].get("format", "tmLanguage")][1]
+
+		def load():
+			highlighter = load_highlighter(view, scheme, schemes[scheme])
+			if not highlighter:
+				return
+			disable(view)
+			HIGHLIGHTERS[view.id()] = highlighter
+			view.settings().set("color_scheme", '%s/%s.%s' % (compile.SYNESTHESIA_OUTPUT_PATH_RELATIVE, scheme, theme_extension))
+			highlighter.poll()
+			sublime.status_message("Highlighting the lines in view with %s (%d patterns)." % (scheme, len(highlighter.pattern_styles)))
+
+		sublime.status_message("Loading %s..." % scheme)
+		sublime.set_timeout_async(load, 0)
+
+class SynesthesiaViewportClearCommand(sublime_plugin.TextCommand):
+	''' Stops highlighting the view with a scheme's keywords as regions '''
+
+	def run(self, edit):
+		view = self.view
+		# after anything the highlighter has queued on the async thread
+		sublime.set_timeout_async(lambda: disable(view), 0)
+
+	def is_enabled(self):
+		return self.view.id() in HIGHLIGHTERS
+
+class SynesthesiaViewportListener(sublime_plugin.EventListener):
+	def on_modified_async(self, view):
+		highlighter = HIGHLIGHTERS.get(view.id())
+		if highlighter:
+			highlighter.modified()
+
+	def on_close(self, view):
+		HIGHLIGHTERS.pop(view.id(), None)